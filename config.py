@@ -59,6 +59,64 @@ NOTES_FILE = DATA_DIR / "notes.txt"
 TODOS_FILE = DATA_DIR / "todos.json"
 REMINDERS_FILE = DATA_DIR / "reminders.txt"
 
+# ============== 知识库配置 ==============
+# 知识库存储目录
+KB_DIR = DATA_DIR / "knowledge_base"
+
+# 存储引擎: json（快照 + 操作日志）或 sqlite
+KB_STORAGE_BACKEND = os.getenv("KB_STORAGE_BACKEND", "json")
+
+# 操作日志累计多少条记录后压缩为快照
+KB_JOURNAL_COMPACT_THRESHOLD = 500
+
+# 批量导入时每多少篇文档持久化一次
+KB_IMPORT_COMMIT_EVERY = 1000
+
+# 批量导入时分词/提取关键词的进程数（1 表示不使用进程池）
+KB_IMPORT_WORKERS = int(os.getenv("KB_IMPORT_WORKERS", os.cpu_count() or 1))
+
+# 语义检索的本地嵌入维度（哈希特征，需要 numpy）
+KB_EMBEDDING_DIM = 256
+
+# 嵌入数达到此值后建立 IVF 近似最近邻索引（更少时直接精确检索）：
+# 20 万个 256 维向量时精确检索约 20ms，再少时精确检索已足够快，不值得损失召回
+KB_ANN_MIN_ROWS = 200000
+
+# IVF 查询时扫描的质心占全部质心的比例：越大召回越高、越慢。
+# kb_benchmark ann（20 万行、256 维）中 3% 的 recall@10 约 0.99，延迟约为精确检索的 1/10
+KB_ANN_PROBE_RATIO = float(os.getenv("KB_ANN_PROBE_RATIO", 0.03))
+
+# 长文档切分为段落检索：每段字符数和相邻段落的重叠字符数
+KB_PASSAGE_SIZE = 400
+KB_PASSAGE_OVERLAP = 80
+
+# 检索结果缓存的条目数（0 表示不缓存）
+KB_QUERY_CACHE_SIZE = 256
+
+# 是否维护词位置索引（支持 "短语" 查询；关闭时短语查询改为重新分词校验，索引更小）
+KB_POSITIONAL_INDEX = True
+
+# 分词器: ngram（中文按 2/3 字切分）或 dict（按本地词典最大匹配，词典每行一个词）
+# 已有知识库沿用快照中记录的分词器，显式指定了不同的分词器时会重建索引
+KB_TOKENIZER = os.getenv("KB_TOKENIZER", "ngram")
+KB_TOKENIZER_DICT = DATA_DIR / "kb_dict.txt"
+
+# 搜索结果摘要的字符数（以查询词命中最密集处为中心）
+KB_SNIPPET_CHARS = 200
+
+# 知识图谱关联实体查询最多返回的实体数（多跳遍历达到此数后不再向外扩展）
+KB_GRAPH_MAX_RESULTS = 1000
+
+# 实体重要度（PageRank）的阻尼系数、收敛阈值（L1）和最大迭代次数
+KB_PAGERANK_DAMPING = 0.85
+KB_PAGERANK_TOL = 1e-6
+KB_PAGERANK_MAX_ITER = 100
+
+# 批量导入/同步后是否以上次结果为初值增量刷新实体重要度（需要 numpy）；
+# 只有一次新增、更新、删除的文档数达到下限时才刷新，零星的改动留给手动刷新
+KB_RANK_AFTER_IMPORT = True
+KB_RANK_AFTER_IMPORT_MIN_DOCS = 100
+
 # ============== 系统配置 ==============
 # 是否启用流式响应
 ENABLE_STREAMING = True
@@ -0,0 +1,416 @@
+"""
+知识库性能基准 - 在临时目录中用合成数据测量检索的召回率和延迟
+
+用法:
+    python kb_benchmark.py ann [--rows 200000] [--dim 256] [--queries 200]
+    python kb_benchmark.py topk [--docs 100000] [--queries 200]
+    python kb_benchmark.py tokenize [--docs 5000] [--dict 词典文件]
+    python kb_benchmark.py graph [--entities 100000] [--edges 500000] [--queries 100]
+    python kb_benchmark.py rank [--entities 100000] [--edges 500000] [--added 1000]
+"""
+
+import math
+import time
+import json
+import heapq
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List, Dict
+
+from kb_index import InvertedIndex, PositionIndex, token_positions, top_k
+from kb_tokenizer import NgramTokenizer, DictTokenizer
+from kb_graph import GraphView
+from kb_vector import VectorStore, vectors_available
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """百分位数（不依赖 numpy）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+# ============== 关键词 Top-k ==============
+
+def synthetic_index(docs: int = 100000, vocab: int = 50000,
+                    seed: int = 0) -> tuple:
+    """按 Zipf 分布生成词表和文档，返回 (正文索引, 标题索引, 词表)"""
+    rng = random.Random(seed)
+    terms = [f"term{i}" for i in range(vocab)]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(vocab)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    content, title = InvertedIndex(), InvertedIndex()
+    for num in range(docs):
+        content.add(num, rng.choices(terms, cum_weights=cumulative, k=rng.randint(50, 300)))
+        title.add(num, rng.choices(terms, cum_weights=cumulative, k=rng.randint(2, 8)))
+    return content, title, terms
+
+
+def bench_topk(docs: int = 100000, queries: int = 200, k: int = 10,
+               title_boost: float = 2.0) -> List[Dict]:
+    """对比全量打分排序、全量打分+堆、MaxScore 剪枝三种 top-k 的延迟"""
+    start = time.perf_counter()
+    content, title, terms = synthetic_index(docs)
+    print(f"生成 {docs} 篇文档的索引: {time.perf_counter() - start:.2f}s")
+
+    # 查询：1~2 个高频词 + 1~3 个中低频词
+    rng = random.Random(1)
+    query_set = [
+        list(dict.fromkeys(rng.sample(terms[:100], rng.randint(1, 2))
+                           + rng.sample(terms[100:5000], rng.randint(1, 3))))
+        for _ in range(queries)
+    ]
+
+    def full_scores(words):
+        scores = content.bm25(words)
+        for num, score in title.bm25(words).items():
+            scores[num] = scores.get(num, 0.0) + score * title_boost
+        return scores
+
+    def full_sort(words):
+        return sorted(full_scores(words).items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def heap(words):
+        return heapq.nlargest(k, full_scores(words).items(), key=lambda x: x[1])
+
+    def maxscore(words):
+        return top_k(content.scorers(words) + title.scorers(words, title_boost), k)
+
+    for words in query_set:
+        maxscore(words)  # 预先计算各词的得分上界
+
+    report = []
+    baseline = None
+    for name, func in (("full_sort", full_sort), ("heap", heap), ("maxscore", maxscore)):
+        latencies, results = [], []
+        for words in query_set:
+            t = time.perf_counter()
+            results.append(func(words))
+            latencies.append((time.perf_counter() - t) * 1000)
+        if baseline is None:
+            baseline = results
+        same = sum(
+            [round(s, 6) for _, s in a] == [round(s, 6) for _, s in b]
+            for a, b in zip(results, baseline)
+        )
+        report.append({
+            "method": name,
+            "mean_ms": sum(latencies) / len(latencies),
+            "p95_ms": _percentile(latencies, 95),
+            "same_as_full": same / len(query_set)
+        })
+
+    print(f"\n{'method':>10} {'mean(ms)':>10} {'p95(ms)':>10} {'一致率':>8}")
+    for row in report:
+        print(f"{row['method']:>10} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f} "
+              f"{row['same_as_full']:>8.0%}")
+    return report
+
+
+# ============== 分词 ==============
+
+def synthetic_chinese(docs: int = 5000, words: int = 20000, doc_words: int = 300,
+                      seed: int = 0) -> tuple:
+    """生成词典（2~4 字词）和按 Zipf 分布用词、夹杂英文和标点的文档，返回 (文档列表, 词典)"""
+    rng = random.Random(seed)
+    chars = [chr(0x4e00 + i) for i in range(3000)]
+    vocab = list(dict.fromkeys(
+        "".join(rng.choices(chars, k=rng.choice((2, 2, 3, 4)))) for _ in range(words)
+    ))
+    english = ["python", "data", "model", "api", "server", "index", "query", "cache"]
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+
+    texts = []
+    for _ in range(docs):
+        parts = []
+        for word in rng.choices(vocab, weights=weights, k=doc_words):
+            parts.append(word)
+            roll = rng.random()
+            if roll < 0.08:
+                parts.append("，")
+            elif roll < 0.12:
+                parts.append(f" {rng.choice(english)} ")
+        texts.append("".join(parts))
+    return texts, vocab
+
+
+def bench_tokenize(docs: int = 5000, dict_file: str = None) -> List[Dict]:
+    """对比 ngram 与词典最大匹配分词的吞吐量（词/秒）和索引大小"""
+    texts, vocab = synthetic_chinese(docs)
+    tmp_dir = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    try:
+        if dict_file is None:
+            dict_file = tmp_dir / "dict.txt"
+            dict_file.write_text("\n".join(vocab), encoding="utf-8")
+        tokenizers = [NgramTokenizer(), DictTokenizer(dict_file)]
+        chars = sum(len(text) for text in texts)
+        print(f"{docs} 篇文档，{chars / 1e6:.1f}M 字符，词典 {len(tokenizers[1].words)} 词")
+
+        report = []
+        for tokenizer in tokenizers:
+            start = time.perf_counter()
+            token_lists = [tokenizer.tokenize(text) for text in texts]
+            elapsed = time.perf_counter() - start
+            tokens = sum(len(t) for t in token_lists)
+
+            index = InvertedIndex()
+            positions = PositionIndex()
+            for num, token_list in enumerate(token_lists):
+                index.add(num, token_list)
+                positions.add(num, token_positions(token_list))
+            index_bytes = len(json.dumps(index.to_dict()))
+            position_bytes = len(json.dumps(positions.to_dict()))
+            report.append({
+                "tokenizer": tokenizer.name,
+                "tokens": tokens,
+                "tokens_per_sec": tokens / elapsed,
+                "chars_per_sec": chars / elapsed,
+                "terms": len(index),
+                "postings": sum(len(plist) // 2 for plist in index.postings.values()),
+                "index_mb": index_bytes / 1e6,
+                "positions_mb": position_bytes / 1e6
+            })
+
+        print(f"\n{'tokenizer':>10} {'词数':>10} {'词/秒':>12} {'字符/秒':>12} "
+              f"{'词项':>8} {'倒排记录':>10} {'倒排(MB)':>9} {'位置(MB)':>9}")
+        for row in report:
+            print(f"{row['tokenizer']:>10} {row['tokens']:>10} {row['tokens_per_sec']:>12,.0f} "
+                  f"{row['chars_per_sec']:>12,.0f} {row['terms']:>8} {row['postings']:>10} "
+                  f"{row['index_mb']:>9.2f} {row['positions_mb']:>9.2f}")
+        return report
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# ============== 知识图谱遍历 ==============
+
+def synthetic_graph(entities: int = 100000, edges: int = 500000, seed: int = 0):
+    """按幂律度数分布生成共现图谱，返回 KnowledgeGraph"""
+    from knowledge_base import KnowledgeGraph
+
+    rng = random.Random(seed)
+    names = [f"entity{i}" for i in range(entities)]
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(entities)]
+    kg = KnowledgeGraph()
+    for name in names:
+        kg.add_entity(name, "keyword")
+    src = rng.choices(names, weights=weights, k=edges)
+    dst = rng.choices(names, weights=weights, k=edges)
+    for i, (a, b) in enumerate(zip(src, dst)):
+        kg.add_relationship(a, b, "co_occurrence", doc_id=str(i % 1000))
+    return kg
+
+
+def bench_graph(entities: int = 100000, edges: int = 500000, queries: int = 100,
+                depths: List[int] = (1, 2, 3), limit: int = 1000) -> List[Dict]:
+    """对比基于集合的逐实体 BFS 与 CSR 向量化扩展的多跳查询延迟"""
+    start = time.perf_counter()
+    kg = synthetic_graph(entities, edges)
+    print(f"生成 {len(kg.entities)} 个实体、{len(kg.relationships)} 条关系: "
+          f"{time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    view = GraphView.build(kg.entities, kg.relationships)
+    print(f"建立 CSR 视图 ({view.edge_count} 个邻接项): {time.perf_counter() - start:.2f}s")
+
+    def set_bfs(name, depth):
+        related = set()
+        current = {name}
+        for _ in range(depth):
+            following = set()
+            for entity in current:
+                following.update(kg.entities[entity]["related"])
+            related.update(following)
+            current = following
+        related.discard(name)
+        return related
+
+    rng = random.Random(1)
+    sources = rng.sample(list(kg.entities), queries)
+    report = []
+    for depth in depths:
+        for method, func in (("set_bfs", lambda n: set_bfs(n, depth)),
+                             ("csr", lambda n: view.k_hop(n, depth, None)),
+                             (f"csr@{limit}", lambda n: view.k_hop(n, depth, limit))):
+            latencies, sizes = [], []
+            for name in sources:
+                t = time.perf_counter()
+                sizes.append(len(func(name)))
+                latencies.append((time.perf_counter() - t) * 1000)
+            report.append({
+                "depth": depth,
+                "method": method,
+                "mean_results": sum(sizes) / len(sizes),
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95)
+            })
+
+    print(f"\n{'depth':>6} {'method':>10} {'平均结果数':>10} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for row in report:
+        print(f"{row['depth']:>6} {row['method']:>10} {row['mean_results']:>10.0f} "
+              f"{row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+    return report
+
+
+def bench_rank(entities: int = 100000, edges: int = 500000, added: int = 1000) -> Dict:
+    """实体重要度：全量冷启动 vs 增量导入后以上次结果热启动的迭代次数和耗时"""
+    kg = synthetic_graph(entities, edges)
+    cold = kg.update_centrality()
+    print(f"冷启动: {cold['entities']} 个实体, 迭代 {cold['iterations']} 次, "
+          f"{cold['seconds']:.2f}s (含建立 CSR 视图)")
+
+    rng = random.Random(2)
+    names = list(kg.entities)
+    for i in range(added):
+        kg.add_relationship(rng.choice(names), rng.choice(names), "co_occurrence",
+                            doc_id=f"new{i % 100}")
+    warm = kg.update_centrality()
+    print(f"新增 {added} 条关系后热启动: 迭代 {warm['iterations']} 次, "
+          f"{len(warm['changed'])} 个实体得分有变化, {warm['seconds']:.2f}s")
+
+    for entity in kg.entities.values():
+        entity["pagerank"] = 0.0
+    recold = kg.update_centrality()
+    print(f"同一图谱冷启动: 迭代 {recold['iterations']} 次, {recold['seconds']:.2f}s")
+    return {"cold": cold, "warm": warm, "recold": recold}
+
+
+# ============== 向量检索 ==============
+
+def synthetic_vectors(rows: int, dim: int, clusters: int = 1000,
+                      noise: float = 0.6, seed: int = 0) -> "np.ndarray":
+    """生成带簇结构的单位向量（模拟主题相近的文档）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + noise * rng.standard_normal((rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def bench_ann(rows: int = 200000, dim: int = 256, queries: int = 200,
+              k: int = 10,
+              ratios: List[float] = (0.005, 0.01, 0.02, 0.03, 0.05, 0.1)) -> List[Dict]:
+    """对比 IVF 近似检索（按质心比例扫描）与精确检索的 recall@k 和 p95 延迟"""
+    kb_dir = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    try:
+        vectors = synthetic_vectors(rows, dim)
+        store = VectorStore(kb_dir, dim, ann_min_rows=rows + 1)  # 先不自动训练
+
+        start = time.perf_counter()
+        for i, vec in enumerate(vectors):
+            store.set(str(i), vec)
+        store.flush()
+        print(f"写入 {rows} 个 {dim} 维向量: {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        store.train()
+        print(f"训练 IVF ({store.ivf.nlist} 个质心): {time.perf_counter() - start:.2f}s")
+
+        rng = np.random.default_rng(1)
+        picks = rng.integers(0, rows, queries)
+        query_vecs = vectors[picks] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+        query_vecs /= np.linalg.norm(query_vecs, axis=1, keepdims=True)
+
+        def run(nprobe):
+            latencies, results = [], []
+            for q in query_vecs:
+                t = time.perf_counter()
+                results.append([doc_id for doc_id, _ in store.search(q, k, nprobe=nprobe)])
+                latencies.append((time.perf_counter() - t) * 1000)
+            return results, latencies
+
+        exact, exact_ms = run(0)
+        report = [{
+            "ratio": 1.0,
+            "nprobe": "exact",
+            "recall": 1.0,
+            "p50_ms": _percentile(exact_ms, 50),
+            "p95_ms": _percentile(exact_ms, 95)
+        }]
+        for ratio in ratios:
+            nprobe = max(1, math.ceil(store.ivf.nlist * ratio))
+            approx, approx_ms = run(nprobe)
+            hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+            total = sum(len(e) for e in exact) or 1
+            report.append({
+                "ratio": ratio,
+                "nprobe": nprobe,
+                "recall": hits / total,
+                "p50_ms": _percentile(approx_ms, 50),
+                "p95_ms": _percentile(approx_ms, 95)
+            })
+
+        print(f"\n{'质心比例':>8} {'nprobe':>8} {'recall@' + str(k):>10} {'p50(ms)':>10} {'p95(ms)':>10}")
+        for row in report:
+            print(f"{row['ratio']:>10.1%} {row['nprobe']:>8} {row['recall']:>10.3f} "
+                  f"{row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+        return report
+    finally:
+        shutil.rmtree(kb_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库性能基准")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    ann = sub.add_parser("ann", help="IVF 近似检索 vs 精确检索")
+    ann.add_argument("--rows", type=int, default=200000)
+    ann.add_argument("--dim", type=int, default=256)
+    ann.add_argument("--queries", type=int, default=200)
+
+    topk = sub.add_parser("topk", help="关键词 top-k：全量排序 vs 堆 vs MaxScore")
+    topk.add_argument("--docs", type=int, default=100000)
+    topk.add_argument("--queries", type=int, default=200)
+
+    tok = sub.add_parser("tokenize", help="分词吞吐量和索引大小：ngram vs 词典最大匹配")
+    tok.add_argument("--docs", type=int, default=5000)
+    tok.add_argument("--dict", dest="dict_file", default=None,
+                     help="词典文件（默认使用合成语料的词表）")
+
+    graph = sub.add_parser("graph", help="知识图谱多跳查询：集合 BFS vs CSR 向量化扩展")
+    graph.add_argument("--entities", type=int, default=100000)
+    graph.add_argument("--edges", type=int, default=500000)
+    graph.add_argument("--queries", type=int, default=100)
+
+    rank = sub.add_parser("rank", help="实体重要度：冷启动 vs 热启动")
+    rank.add_argument("--entities", type=int, default=100000)
+    rank.add_argument("--edges", type=int, default=500000)
+    rank.add_argument("--added", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.bench == "topk":
+        bench_topk(args.docs, args.queries)
+        return
+    if args.bench == "tokenize":
+        bench_tokenize(args.docs, args.dict_file)
+        return
+
+    if not vectors_available():
+        print("❌ 需要安装 numpy")
+        return
+
+    if args.bench == "rank":
+        bench_rank(args.entities, args.edges, args.added)
+    elif args.bench == "graph":
+        bench_graph(args.entities, args.edges, args.queries)
+    elif args.bench == "ann":
+        bench_ann(args.rows, args.dim, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+知识图谱只读视图 - 实体名映射为整数，邻接表存为 CSR 数组，多跳扩展向量化（需要 numpy）
+"""
+
+from typing import List, Dict, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时图谱遍历退回逐个实体的集合运算
+    np = None
+
+
+def graph_view_available() -> bool:
+    """是否可以使用 CSR 图谱视图"""
+    return np is not None
+
+
+class GraphView:
+    """知识图谱的压缩稀疏行（CSR）视图
+
+    关系按无向边处理（与实体的 related 集合一致），每条关系在两端各存一次：
+    实体 i 的邻居为 indices[indptr[i]:indptr[i + 1]]，对应的关系权重在 weights 中。
+    同一对实体之间有多种类型的关系时，权重相加后合并为一条邻接项，不含自环。
+    视图建立后只读，图谱变化时由 KnowledgeGraph 按版本号重新建立。
+    scores 为各实体的重要度（PageRank），多跳结果在同一跳内优先按它排序。
+    """
+
+    DENSE_RATIO = 16  # 一跳的邻接项数超过实体数的 1/16 时改用稠密累加
+
+    def __init__(self, names: List[str], indptr: "np.ndarray",
+                 indices: "np.ndarray", weights: "np.ndarray", version: int = 0,
+                 scores: "np.ndarray" = None):
+        self.names = names
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.version = version
+        self.scores = scores if scores is not None else np.zeros(len(names))
+
+    @classmethod
+    def build(cls, entities: Dict, relationships: List[Dict], version: int = 0) -> "GraphView":
+        """根据实体表和关系列表建立视图（端点不在实体表中的关系忽略）"""
+        names = list(entities)
+        ids = {name: i for i, name in enumerate(names)}
+        n = len(names)
+
+        src, dst, weight = [], [], []
+        for rel in relationships:
+            a = ids.get(rel["from"])
+            b = ids.get(rel["to"])
+            if a is None or b is None or a == b:
+                continue
+            src.append(a)
+            dst.append(b)
+            weight.append(rel.get("weight", 1))
+
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        weight = np.asarray(weight, dtype=np.float64)
+        rows = np.concatenate([src, dst])
+        cols = np.concatenate([dst, src])
+        weight = np.concatenate([weight, weight])
+
+        # 按 (行, 列) 排序后合并重复的实体对
+        keys = rows * max(n, 1) + cols
+        keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=weight, minlength=len(keys))
+        rows = keys // max(n, 1)
+        indices = (keys % max(n, 1)).astype(np.int32)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        scores = np.fromiter((entities[name].get("pagerank", 0.0) for name in names),
+                             dtype=np.float64, count=n)
+        return cls(names, indptr, indices, weights, version, scores)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def edge_count(self) -> int:
+        """邻接项数（每条无向边计两次）"""
+        return len(self.indices)
+
+    def _rows(self) -> "np.ndarray":
+        """每个邻接项所在的行（实体号）"""
+        return np.repeat(np.arange(len(self.names), dtype=np.int64), np.diff(self.indptr))
+
+    def weighted_degree(self) -> "np.ndarray":
+        """各实体所连关系的权重之和"""
+        return np.bincount(self._rows(), weights=self.weights, minlength=len(self.names))
+
+    def pagerank(self, damping: float = 0.85, tol: float = 1e-6, max_iter: int = 100,
+                 start: "np.ndarray" = None) -> tuple:
+        """加权 PageRank（稀疏幂迭代），返回 (得分, 迭代次数)
+
+        从实体 j 走到邻居 i 的概率为 边权 / j 的加权度数，没有邻居的实体均匀跳到全部实体。
+        start 为初始向量（如上次的结果，图谱变化不大时可少迭代几轮），其中不为正的分量
+        （新实体）取均匀值；各分量之差的 L1 范数小于 tol 时停止。
+        """
+        n = len(self.names)
+        if n == 0:
+            return np.zeros(0), 0
+        rows = self._rows()
+        degree = np.bincount(rows, weights=self.weights, minlength=n)
+        dangling = degree == 0
+        # 每个邻接项的转移概率（按来源实体的度数归一化）
+        share = self.weights / degree[rows]
+
+        if start is not None and len(start) == n:
+            x = np.array(start, dtype=np.float64)
+            x[x <= 0] = 1.0 / n
+            x /= x.sum()
+        else:
+            x = np.full(n, 1.0 / n)
+
+        iterations = 0
+        for iterations in range(1, max_iter + 1):
+            spread = np.bincount(self.indices, weights=x[rows] * share, minlength=n)
+            leaked = x[dangling].sum()
+            new = damping * (spread + leaked / n) + (1 - damping) / n
+            delta = np.abs(new - x).sum()
+            x = new
+            if delta < tol:
+                break
+        return x, iterations
+
+    def _expand(self, frontier: "np.ndarray") -> tuple:
+        """一次取出 frontier 中所有实体的邻接项，返回 (邻居, 权重)"""
+        starts = self.indptr[frontier]
+        lengths = self.indptr[frontier + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return self.indices[:0], self.weights[:0]
+        # 把各行的 [start, end) 区间拼成一个下标数组，避免逐行循环
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = np.arange(total, dtype=np.int64) + offsets
+        return self.indices[positions], self.weights[positions]
+
+    def k_hop(self, name: str, max_depth: int = 1, limit: Optional[int] = None) -> List[str]:
+        """name 在 max_depth 跳以内的实体（不含自身）
+
+        按跳数从近到远，同一跳内按重要度（scores）、再按与上一跳相连的关系权重之和
+        从高到低排列；结果达到 limit 个后不再向外扩展。
+        """
+        start = self.ids.get(name)
+        if start is None or max_depth < 1:
+            return []
+
+        visited = np.zeros(len(self.names), dtype=bool)
+        visited[start] = True
+        frontier = np.array([start], dtype=np.int64)
+        result: List[int] = []
+        for _ in range(max_depth):
+            neighbors, weights = self._expand(frontier)
+            fresh = ~visited[neighbors]
+            if not fresh.any():
+                break
+            # 累加各新实体与上一跳相连的权重：邻接项多时用稠密数组，少时排序去重
+            neighbors, weights = neighbors[fresh], weights[fresh]
+            if len(neighbors) * self.DENSE_RATIO > len(self.names):
+                strength = np.bincount(neighbors, weights=weights, minlength=len(self.names))
+                nodes = np.flatnonzero(strength)
+                strength = strength[nodes]
+            else:
+                nodes, inverse = np.unique(neighbors, return_inverse=True)
+                strength = np.bincount(inverse, weights=weights)
+            # 最后一个键为主键；都相同时 lexsort 保持实体号顺序
+            nodes = nodes[np.lexsort((-strength, -self.scores[nodes]))]
+            visited[nodes] = True
+            result.extend(nodes.tolist())
+            if limit is not None and len(result) >= limit:
+                break
+            frontier = nodes
+
+        if limit is not None:
+            result = result[:limit]
+        names = self.names
+        return [names[i] for i in result]
@@ -0,0 +1,897 @@
+"""
+知识库倒排索引 - 整数文档号 + 数组倒排表，BM25排序，分面位图过滤，词位置索引
+"""
+
+import math
+import heapq
+import base64
+from array import array
+from bisect import bisect_left
+from typing import List, Dict, Iterable, Optional, Tuple
+
+
+def term_frequencies(tokens: List[str]) -> Dict[str, int]:
+    """统计词频"""
+    freqs = {}
+    for token in tokens:
+        freqs[token] = freqs.get(token, 0) + 1
+    return freqs
+
+
+# ============== 变长整数编码 ==============
+
+def encode_varints(values: Iterable[int]) -> bytes:
+    """把非负整数序列编码为 varint 字节串"""
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data: bytes) -> List[int]:
+    """解码 varint 字节串"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+# ============== 有序数组集合运算 ==============
+
+def intersect_sorted(a: array, b: array) -> array:
+    """两个有序数组求交（小表在大表中倍增查找）"""
+    if len(a) > len(b):
+        a, b = b, a
+    result = array('I')
+    lo, n = 0, len(b)
+    for value in a:
+        # 倍增确定查找区间，再二分
+        step = 1
+        hi = lo
+        while hi < n and b[hi] < value:
+            lo = hi
+            hi += step
+            step <<= 1
+        lo = bisect_left(b, value, lo, min(hi + 1, n))
+        if lo >= n:
+            break
+        if b[lo] == value:
+            result.append(value)
+    return result
+
+
+def difference_sorted(a: array, b: array) -> array:
+    """有序数组求差 a - b（在 b 中倍增查找 a 的每个元素）"""
+    if not a or not b:
+        return array('I', a)
+    result = array('I')
+    lo, n = 0, len(b)
+    for value in a:
+        step = 1
+        hi = lo
+        while hi < n and b[hi] < value:
+            lo = hi
+            hi += step
+            step <<= 1
+        lo = bisect_left(b, value, lo, min(hi + 1, n))
+        if lo >= n or b[lo] != value:
+            result.append(value)
+    return result
+
+
+def union_sorted(a: array, b: array) -> array:
+    """两个有序数组求并"""
+    result = array('I')
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x, y = a[i], b[j]
+        if x < y:
+            result.append(x)
+            i += 1
+        elif y < x:
+            result.append(y)
+            j += 1
+        else:
+            result.append(x)
+            i += 1
+            j += 1
+    result.extend(a[i:])
+    result.extend(b[j:])
+    return result
+
+
+class DocIdMap:
+    """文档ID驻留表：doc_id 字符串 <-> 稠密整数文档号
+
+    文档号按加入顺序递增分配，删除后留空不复用，
+    因此新文档总是追加到倒排表末尾。
+    """
+
+    def __init__(self):
+        self.ids: List[Optional[str]] = []
+        self.nums: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.nums)
+
+    def intern(self, doc_id: str) -> int:
+        """取得文档号，不存在则分配"""
+        num = self.nums.get(doc_id)
+        if num is None:
+            num = len(self.ids)
+            self.ids.append(doc_id)
+            self.nums[doc_id] = num
+        return num
+
+    def get(self, doc_id: str) -> Optional[int]:
+        return self.nums.get(doc_id)
+
+    def lookup(self, num: int) -> Optional[str]:
+        return self.ids[num] if num < len(self.ids) else None
+
+    def release(self, doc_id: str):
+        """释放文档号（留空）"""
+        num = self.nums.pop(doc_id, None)
+        if num is not None:
+            self.ids[num] = None
+
+    def to_list(self) -> List[Optional[str]]:
+        return self.ids
+
+    @classmethod
+    def from_list(cls, ids: List[Optional[str]]) -> 'DocIdMap':
+        doc_map = cls()
+        doc_map.ids = list(ids)
+        doc_map.nums = {doc_id: num for num, doc_id in enumerate(ids) if doc_id is not None}
+        return doc_map
+
+
+# ============== 文档号位图 ==============
+
+# 每个字节值中为 1 的位
+_BIT_POSITIONS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class Bitmap:
+    """文档号位图：bytearray 的第 num 位为 1 表示包含文档号 num
+
+    增删和成员测试都是 O(1)；多个位图的交/并先转成 Python 大整数再做位运算。
+    """
+
+    __slots__ = ("bits", "count")
+
+    def __init__(self, bits: bytes = b""):
+        self.bits = bytearray(bits)
+        self.count = int.from_bytes(self.bits, 'little').bit_count()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, num: int) -> bool:
+        i = num >> 3
+        return i < len(self.bits) and bool(self.bits[i] >> (num & 7) & 1)
+
+    def add(self, num: int):
+        i = num >> 3
+        if i >= len(self.bits):
+            self.bits.extend(bytes(i + 1 - len(self.bits)))
+        mask = 1 << (num & 7)
+        if not self.bits[i] & mask:
+            self.bits[i] |= mask
+            self.count += 1
+
+    def discard(self, num: int):
+        i = num >> 3
+        mask = 1 << (num & 7)
+        if i < len(self.bits) and self.bits[i] & mask:
+            self.bits[i] &= ~mask
+            self.count -= 1
+
+    def members(self) -> array:
+        """升序的文档号数组"""
+        result = array('I')
+        for i, byte in enumerate(self.bits):
+            if byte:
+                base = i << 3
+                result.extend(base + bit for bit in _BIT_POSITIONS[byte])
+        return result
+
+    def to_int(self) -> int:
+        return int.from_bytes(self.bits, 'little')
+
+    @classmethod
+    def from_int(cls, mask: int) -> 'Bitmap':
+        return cls(mask.to_bytes((mask.bit_length() + 7) // 8, 'little'))
+
+
+class FacetIndex:
+    """分面索引：取值（分类、标签）-> 文档号位图"""
+
+    def __init__(self):
+        self.bitmaps: Dict[str, Bitmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.bitmaps)
+
+    def add(self, value: str, num: int):
+        bitmap = self.bitmaps.get(value)
+        if bitmap is None:
+            bitmap = self.bitmaps[value] = Bitmap()
+        bitmap.add(num)
+
+    def discard(self, value: str, num: int):
+        bitmap = self.bitmaps.get(value)
+        if bitmap is not None:
+            bitmap.discard(num)
+            if not bitmap:
+                del self.bitmaps[value]
+
+    def get(self, value: str) -> Bitmap:
+        return self.bitmaps.get(value) or Bitmap()
+
+    def select(self, values: Iterable[str], match_all: bool = False) -> Bitmap:
+        """多个取值的位图求并（match_all=True 时求交）"""
+        bitmaps = [self.get(value) for value in dict.fromkeys(values)]
+        if len(bitmaps) == 1:
+            return bitmaps[0]
+        if not bitmaps:
+            return Bitmap()
+        mask = bitmaps[0].to_int()
+        for bitmap in bitmaps[1:]:
+            mask = mask & bitmap.to_int() if match_all else mask | bitmap.to_int()
+        return Bitmap.from_int(mask)
+
+
+def intersect_bitmaps(*bitmaps: Bitmap) -> Bitmap:
+    """位图求交"""
+    if len(bitmaps) == 1:
+        return bitmaps[0]
+    mask = bitmaps[0].to_int()
+    for bitmap in bitmaps[1:]:
+        mask &= bitmap.to_int()
+    return Bitmap.from_int(mask)
+
+
+# ============== 倒排表 ==============
+# 一个词的倒排表是一个 array('I')，按文档号升序交错存放 [文档号, 词频, 文档号, 词频, ...]，
+# 每个词只有一个数组对象，大量只出现一次的词也不会产生额外的容器开销。
+
+def _find(plist: array, num: int) -> int:
+    """二分查找文档号，返回第一个 >= num 的记录序号"""
+    lo, hi = 0, len(plist) // 2
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if plist[2 * mid] < num:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def posting_set(plist: array, num: int, tf: int):
+    """写入/覆盖一条记录"""
+    if not plist or plist[-2] < num:
+        plist.append(num)
+        plist.append(tf)
+        return
+    i = _find(plist, num)
+    if 2 * i < len(plist) and plist[2 * i] == num:
+        plist[2 * i + 1] = tf
+    else:
+        plist[2 * i:2 * i] = array('I', (num, tf))
+
+
+def posting_get(plist: array, num: int) -> int:
+    """文档在倒排表中的词频（不存在为0）"""
+    i = _find(plist, num)
+    if 2 * i < len(plist) and plist[2 * i] == num:
+        return plist[2 * i + 1]
+    return 0
+
+
+def posting_seek(plist: array, num: int, lo: int) -> int:
+    """从记录序号 lo 开始倍增查找，返回第一个文档号 >= num 的记录序号"""
+    n = len(plist) // 2
+    if lo >= n or plist[2 * lo] >= num:
+        return lo
+    step = 1
+    hi = lo + 1
+    while hi < n and plist[2 * hi] < num:
+        lo = hi
+        hi += step
+        step <<= 1
+    hi = min(hi, n)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if plist[2 * mid] < num:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def posting_discard(plist: array, num: int):
+    """删除一条记录"""
+    i = _find(plist, num)
+    if 2 * i < len(plist) and plist[2 * i] == num:
+        del plist[2 * i:2 * i + 2]
+
+
+def encode_postings(plist: array) -> str:
+    """编码为 base64(varint(文档号差值) + varint(词频))"""
+    docs = plist[0::2]
+    deltas = []
+    prev = 0
+    for num in docs:
+        deltas.append(num - prev)
+        prev = num
+    data = encode_varints([len(docs)]) + encode_varints(deltas) + encode_varints(plist[1::2])
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_postings(text: str) -> array:
+    values = decode_varints(base64.b64decode(text))
+    n = values[0]
+    plist = array('I', bytes(8 * n))
+    total = 0
+    for i, delta in enumerate(values[1:n + 1]):
+        total += delta
+        plist[2 * i] = total
+    plist[1::2] = array('I', values[n + 1:2 * n + 1])
+    return plist
+
+
+class InvertedIndex:
+    """倒排索引
+
+    postings: {词: 倒排表数组}，文档用 DocIdMap 分配的整数文档号表示；
+    同时维护每篇文档的长度（词数）和正排表（文档号 -> 词列表），
+    更新时按词差异增删倒排记录，删除时只触及该文档自己的倒排表。
+    查询时只遍历查询词的倒排表，用BM25打分。
+    """
+
+    FORMAT = 2
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, array] = {}
+        self.doc_terms: Dict[int, List[str]] = {}  # 正排表
+        self.doc_lengths = array('I')  # 按文档号索引
+        self._indexed = bytearray()  # 文档号是否已索引
+        self.doc_count = 0
+        self.total_length = 0
+        # 每个词BM25饱和项 tf·(k1+1)/(tf+norm) 的上界（不含IDF），按需计算、增量维护；
+        # 上界按参考平均文档长度 _bound_avgdl 计算，平均长度超过它时全部作废
+        self._bounds: Dict[str, float] = {}
+        self._bound_avgdl = 0.0
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.postings
+
+    # ============== 维护 ==============
+
+    def _set_length(self, num: int, length: int):
+        if num >= len(self.doc_lengths):
+            grow = num + 1 - len(self.doc_lengths)
+            self.doc_lengths.extend([0] * grow)
+            self._indexed.extend(b"\0" * grow)
+        if not self._indexed[num]:
+            self._indexed[num] = 1
+            self.doc_count += 1
+        self.total_length += length - self.doc_lengths[num]
+        self.doc_lengths[num] = length
+
+    def add(self, num: int, tokens: List[str]):
+        """索引一篇文档（已存在则覆盖其长度和词频）"""
+        self.add_counts(num, term_frequencies(tokens))
+
+    def add_counts(self, num: int, freqs: Dict[str, int]):
+        """用已统计好的词频索引一篇文档"""
+        self._set_length(num, sum(freqs.values()))
+
+        # 文档已索引过：先移除新内容里不再出现的词
+        for term in self.doc_terms.get(num, ()):
+            if term not in freqs:
+                self._discard(term, num)
+        if freqs:
+            self.doc_terms[num] = list(freqs)
+        else:
+            self.doc_terms.pop(num, None)
+
+        length = self.doc_lengths[num]
+        bounds = self._bounds
+        for term, tf in freqs.items():
+            plist = self.postings.get(term)
+            if plist is None:
+                self.postings[term] = array('I', (num, tf))
+            else:
+                posting_set(plist, num, tf)
+            if term in bounds:
+                bounds[term] = max(bounds[term], self._saturation(tf, length, self._bound_avgdl))
+
+    def load_postings(self, term: str, pairs: List[Tuple[int, int]]):
+        """写入一个词的全部 (文档号, 词频)（从存储加载时使用）"""
+        pairs.sort()
+        plist = array('I')
+        for num, tf in pairs:
+            plist.append(num)
+            plist.append(tf)
+        self.postings[term] = plist
+        for num, tf in pairs:
+            self._set_length(num, self._length(num) + tf)
+            self.doc_terms.setdefault(num, []).append(term)
+
+    def _length(self, num: int) -> int:
+        return self.doc_lengths[num] if num < len(self.doc_lengths) else 0
+
+    def _discard(self, term: str, num: int):
+        """从一个词的倒排表中移除文档，空表直接删除"""
+        plist = self.postings.get(term)
+        if plist is not None:
+            posting_discard(plist, num)
+            if not plist:
+                del self.postings[term]
+
+    def remove(self, num: int):
+        """移除文档的全部倒排记录"""
+        for term in self.doc_terms.pop(num, ()):
+            self._discard(term, num)
+        if num < len(self._indexed) and self._indexed[num]:
+            self._indexed[num] = 0
+            self.doc_count -= 1
+            self.total_length -= self.doc_lengths[num]
+            self.doc_lengths[num] = 0
+
+    def doc_vector(self, num: int) -> Dict[str, int]:
+        """文档的词频向量（来自正排表）"""
+        return {
+            term: posting_get(self.postings[term], num)
+            for term in self.doc_terms.get(num, ())
+        }
+
+    def docs(self, term: str) -> array:
+        """词的文档号数组（有序）"""
+        plist = self.postings.get(term)
+        return plist[0::2] if plist is not None else array('I')
+
+    # ============== 打分 ==============
+
+    def idf(self, term: str) -> float:
+        """BM25 逆文档频率"""
+        n = self.doc_count
+        plist = self.postings.get(term)
+        df = len(plist) // 2 if plist is not None else 0
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    # 过滤集合比倒排表小这么多倍时，改为逐个在倒排表中二分查找过滤集合的文档号
+    PROBE_RATIO = 16
+
+    def _saturation(self, tf: int, length: int, avgdl: float) -> float:
+        return tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avgdl))
+
+    def term_bound(self, term: str) -> float:
+        """词的BM25饱和项上界（乘以IDF即为该词对任意文档的最大得分）
+
+        饱和项随平均文档长度增大而增大，因此按当前平均长度的 1.25 倍计算，
+        平均长度涨过参考值前上界一直有效；删除文档后上界只会变松，不会失效。
+        """
+        avgdl = self.total_length / self.doc_count if self.doc_count else 1.0
+        if avgdl > self._bound_avgdl:
+            self._bounds.clear()
+            self._bound_avgdl = (avgdl or 1.0) * 1.25
+        bound = self._bounds.get(term)
+        if bound is None:
+            bound = 0.0
+            plist = self.postings.get(term)
+            if plist is not None:
+                lengths = self.doc_lengths
+                pairs = iter(plist)
+                for num, tf in zip(pairs, pairs):
+                    bound = max(bound, self._saturation(tf, lengths[num], self._bound_avgdl))
+            self._bounds[term] = bound
+        return bound
+
+    def scorers(self, query_terms: Iterable[str], weight: float = 1.0) -> List['TermScorer']:
+        """查询词在本索引中的打分游标（用于 top_k）"""
+        if not self.doc_count:
+            return []
+        avgdl = self.total_length / self.doc_count or 1.0
+        result = []
+        for term in query_terms:
+            plist = self.postings.get(term)
+            if plist is not None:
+                idf = self.idf(term) * weight
+                result.append(TermScorer(
+                    plist, idf, idf * self.term_bound(term),
+                    self.k1, self.k1 * (1 - self.b), self.k1 * self.b / avgdl,
+                    self.doc_lengths
+                ))
+        return result
+
+    def bm25(self, query_terms: Iterable[str],
+             allowed: Optional[Bitmap] = None) -> Dict[int, float]:
+        """对包含任一查询词的文档打分，返回 {文档号: 分数}
+
+        allowed 为可选的文档号位图（分类/标签过滤），只对其中的文档打分：
+        倒排表较短时遍历倒排表并测试位图，过滤集合很小时只查找集合中的文档。
+        """
+        scores: Dict[int, float] = {}
+        if not self.doc_count or (allowed is not None and not allowed):
+            return scores
+
+        avgdl = self.total_length / self.doc_count or 1.0
+        k1, b = self.k1, self.b
+        lengths = self.doc_lengths
+        members = None
+
+        for term in query_terms:
+            plist = self.postings.get(term)
+            if plist is None:
+                continue
+            idf = self.idf(term)
+
+            if allowed is not None and len(allowed) * self.PROBE_RATIO < len(plist) // 2:
+                if members is None:
+                    members = allowed.members()
+                hits = ((num, posting_get(plist, num)) for num in members)
+            else:
+                pairs = iter(plist)
+                hits = zip(pairs, pairs)
+                if allowed is not None:
+                    hits = ((num, tf) for num, tf in hits if num in allowed)
+
+            for num, tf in hits:
+                if not tf:
+                    continue
+                norm = k1 * (1 - b + b * lengths[num] / avgdl)
+                scores[num] = scores.get(num, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        return scores
+
+    # ============== 序列化 ==============
+
+    def to_dict(self) -> Dict:
+        # 文档长度按文档号存为 varint(长度 + 1)，0 表示该文档号未索引
+        lengths = (
+            length + 1 if indexed else 0
+            for length, indexed in zip(self.doc_lengths, self._indexed)
+        )
+        return {
+            "format": self.FORMAT,
+            "postings": {term: encode_postings(plist) for term, plist in self.postings.items()},
+            "doc_lengths": base64.b64encode(encode_varints(lengths)).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, doc_map: DocIdMap) -> 'InvertedIndex':
+        index = cls()
+        postings = data.get("postings", {})
+        if data.get("format") == cls.FORMAT:
+            stored_lengths = "doc_lengths" in data
+            if stored_lengths:
+                for num, value in enumerate(decode_varints(base64.b64decode(data["doc_lengths"]))):
+                    if value:
+                        index._set_length(num, value - 1)
+            for term, text in postings.items():
+                plist = index.postings[term] = decode_postings(text)
+                pairs = iter(plist)
+                for num, tf in zip(pairs, pairs):
+                    if not stored_lengths:
+                        index._set_length(num, index._length(num) + tf)
+                    index.doc_terms.setdefault(num, []).append(term)
+        else:
+            # 旧格式 {词: {doc_id: 词频}}
+            for term, plist in postings.items():
+                index.load_postings(
+                    term, [(doc_map.intern(doc_id), tf) for doc_id, tf in plist.items()]
+                )
+        return index
+
+
+# ============== 词位置索引 ==============
+# 一个词在一篇文档中的位置（词序号）升序排列后按差值做 varint 编码，存为一个 bytes；
+# 短语匹配时只解码候选文档中相关词的位置。
+# 每篇文档另存一份 词序号 -> 原文字符偏移 的表（差值可能为负，用 zigzag 编码），
+# 生成摘要时据此定位命中的词，不必重新扫描正文。
+
+def encode_positions(positions: List[int]) -> bytes:
+    """升序位置列表 -> varint(差值)"""
+    deltas = []
+    prev = 0
+    for pos in positions:
+        deltas.append(pos - prev)
+        prev = pos
+    return encode_varints(deltas)
+
+
+def decode_positions(data: bytes) -> List[int]:
+    positions = []
+    total = 0
+    for delta in decode_varints(data):
+        total += delta
+        positions.append(total)
+    return positions
+
+
+def encode_offsets(offsets: List[int]) -> bytes:
+    """字符偏移序列 -> varint(zigzag(差值))"""
+    values = []
+    prev = 0
+    for offset in offsets:
+        delta = offset - prev
+        values.append(delta << 1 if delta >= 0 else (-delta << 1) - 1)
+        prev = offset
+    return encode_varints(values)
+
+
+def decode_offsets(data: bytes) -> List[int]:
+    offsets = []
+    total = 0
+    for value in decode_varints(data):
+        total += value >> 1 if not value & 1 else -((value + 1) >> 1)
+        offsets.append(total)
+    return offsets
+
+
+def token_positions(tokens: List[str]) -> Dict[str, bytes]:
+    """词序列 -> {词: 编码后的位置}"""
+    positions: Dict[str, List[int]] = {}
+    for pos, token in enumerate(tokens):
+        positions.setdefault(token, []).append(pos)
+    return {token: encode_positions(plist) for token, plist in positions.items()}
+
+
+class PositionIndex:
+    """词位置索引：{词: {文档号: 编码后的位置}} + {文档号: 编码后的词起始偏移}
+
+    与正文倒排索引配合使用：文档集合的交/并在倒排表上完成，
+    位置用于校验候选文档中短语的各个词是否相邻出现，偏移用于定位摘要。
+    """
+
+    FORMAT = 2
+
+    def __init__(self):
+        self.positions: Dict[str, Dict[int, bytes]] = {}
+        self.doc_terms: Dict[int, List[str]] = {}
+        self.offsets: Dict[int, bytes] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def add(self, num: int, encoded: Dict[str, bytes], offsets: Optional[bytes] = None):
+        """写入一篇文档的全部词位置和词起始偏移（已存在则覆盖）"""
+        self.remove(num)
+        for term, data in encoded.items():
+            self.positions.setdefault(term, {})[num] = data
+        if encoded:
+            self.doc_terms[num] = list(encoded)
+        if offsets:
+            self.offsets[num] = offsets
+
+    def load(self, term: str, num: int, data: bytes):
+        """写入一条 (词, 文档号) 的位置（从存储加载时使用）"""
+        self.positions.setdefault(term, {})[num] = data
+        self.doc_terms.setdefault(num, []).append(term)
+
+    def load_offsets(self, num: int, data: bytes):
+        self.offsets[num] = data
+
+    def remove(self, num: int):
+        self.offsets.pop(num, None)
+        for term in self.doc_terms.pop(num, ()):
+            docs = self.positions.get(term)
+            if docs is not None:
+                docs.pop(num, None)
+                if not docs:
+                    del self.positions[term]
+
+    def doc_positions(self, num: int) -> Dict[str, bytes]:
+        """文档的 {词: 编码后的位置}"""
+        return {term: self.positions[term][num] for term in self.doc_terms.get(num, ())}
+
+    def doc_offsets(self, num: int) -> Optional[bytes]:
+        """文档编码后的词起始偏移"""
+        return self.offsets.get(num)
+
+    def get(self, term: str, num: int) -> List[int]:
+        data = self.positions.get(term, {}).get(num)
+        return decode_positions(data) if data else []
+
+    def term_spans(self, num: int, terms: Iterable[str]) -> Optional[List[Tuple[int, int, str]]]:
+        """查询词在文档原文中的命中 [(起始, 结束, 词)]，按起始偏移排序；没有偏移表时返回 None"""
+        data = self.doc_offsets(num)
+        if data is None:
+            return None
+        offsets = decode_offsets(data)
+        spans = []
+        for term in terms:
+            length = len(term)
+            for pos in self.get(term, num):
+                if pos < len(offsets):
+                    spans.append((offsets[pos], offsets[pos] + length, term))
+        spans.sort()
+        return spans
+
+    def has_phrase(self, num: int, terms: List[str]) -> bool:
+        """文档中是否有 terms 依次相邻出现"""
+        return phrase_in_positions([self.get(term, num) for term in terms])
+
+    # ============== 序列化 ==============
+
+    def to_dict(self) -> Dict:
+        """terms: {词: base64(varint([文档数, 文档号差值..., 各文档位置数...]) + 各文档的位置编码)}
+        offsets: {文档号: base64(词起始偏移编码)}
+        """
+        terms = {}
+        for term, docs in self.positions.items():
+            nums = sorted(docs)
+            deltas = []
+            prev = 0
+            for num in nums:
+                deltas.append(num - prev)
+                prev = num
+            counts = [len(decode_varints(docs[num])) for num in nums]
+            data = encode_varints([len(nums)] + deltas + counts)
+            terms[term] = base64.b64encode(data + b"".join(docs[num] for num in nums)).decode('ascii')
+        return {
+            "format": self.FORMAT,
+            "terms": terms,
+            "offsets": {
+                str(num): base64.b64encode(data).decode('ascii')
+                for num, data in self.offsets.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PositionIndex':
+        """还原位置索引（早期格式 {词: 编码} 没有偏移表）"""
+        index = cls()
+        if data.get("format") == cls.FORMAT:
+            for num, text in data.get("offsets", {}).items():
+                index.offsets[int(num)] = base64.b64decode(text)
+            data = data["terms"]
+        for term, text in data.items():
+            values = decode_varints(base64.b64decode(text))
+            n = values[0]
+            nums = []
+            total = 0
+            for delta in values[1:n + 1]:
+                total += delta
+                nums.append(total)
+            offset = 2 * n + 1
+            for num, count in zip(nums, values[n + 1:offset]):
+                index.load(term, num, encode_varints(values[offset:offset + count]))
+                offset += count
+        return index
+
+
+def phrase_in_positions(positions: List[List[int]]) -> bool:
+    """positions[i] 为短语第 i 个词的位置列表，判断是否存在 p 使第 i 个词出现在 p+i"""
+    if not positions or not all(positions):
+        return False
+    # 从最短的位置列表出发，换算成短语起点后逐个求交
+    order = sorted(range(len(positions)), key=lambda i: len(positions[i]))
+    first = order[0]
+    starts = {pos - first for pos in positions[first]}
+    for i in order[1:]:
+        starts.intersection_update(pos - i for pos in positions[i])
+        if not starts:
+            return False
+    return True
+
+
+# ============== Top-k 检索 ==============
+
+class TermScorer:
+    """一个查询词在一个字段上的倒排表游标"""
+
+    __slots__ = ("plist", "n", "pos", "idf", "upper", "k1", "norm_a", "norm_b", "lengths")
+
+    def __init__(self, plist: array, idf: float, upper: float,
+                 k1: float, norm_a: float, norm_b: float, lengths: array):
+        self.plist = plist
+        self.n = len(plist) // 2
+        self.pos = 0
+        self.idf = idf
+        self.upper = upper  # 该词对任意文档的得分上界
+        self.k1 = k1
+        self.norm_a = norm_a  # k1·(1-b)
+        self.norm_b = norm_b  # k1·b/avgdl
+        self.lengths = lengths
+
+    def score(self, num: int, tf: int) -> float:
+        return self.idf * tf * (self.k1 + 1) / (tf + self.norm_a + self.norm_b * self.lengths[num])
+
+    def tf_at(self, num: int) -> int:
+        """游标前移到 num，返回 num 的词频（不存在为0）"""
+        self.pos = pos = posting_seek(self.plist, num, self.pos)
+        if pos < self.n and self.plist[2 * pos] == num:
+            return self.plist[2 * pos + 1]
+        return 0
+
+
+def top_k(scorers: List[TermScorer], k: int,
+          allowed: Optional['Bitmap'] = None) -> List[Tuple[int, float]]:
+    """MaxScore 动态剪枝取前 k 个文档，返回按分数降序的 [(文档号, 分数)]
+
+    词按得分上界升序排列；当前第 k 名的分数为阈值，上界之和不超过阈值的一组词是
+    "非必要词"——只含这些词的文档不可能进入前 k，因此只遍历必要词的倒排表产生候选，
+    非必要词只对候选文档倍增查找，且累计上界不足以超过阈值时提前放弃该文档。
+    前 k 名用大小为 k 的最小堆维护。
+    """
+    if k <= 0 or not scorers:
+        return []
+
+    scorers = sorted(scorers, key=lambda s: s.upper)
+    prefix = []  # prefix[i] = scorers[0..i] 的上界之和
+    total = 0.0
+    for scorer in scorers:
+        total += scorer.upper
+        prefix.append(total)
+
+    heap: List[Tuple[float, int]] = []
+    threshold = 0.0
+    first_essential = 0
+    count = len(scorers)
+
+    while first_essential < count:
+        # 候选：必要词游标中最小的文档号
+        num = None
+        for scorer in scorers[first_essential:]:
+            if scorer.pos < scorer.n:
+                doc = scorer.plist[2 * scorer.pos]
+                if num is None or doc < num:
+                    num = doc
+        if num is None:
+            break
+
+        # 被过滤掉的文档只推进游标，不计分
+        skip = allowed is not None and num not in allowed
+        score = 0.0
+        for scorer in scorers[first_essential:]:
+            pos = scorer.pos
+            if pos < scorer.n and scorer.plist[2 * pos] == num:
+                scorer.pos = pos + 1
+                if not skip:
+                    score += scorer.score(num, scorer.plist[2 * pos + 1])
+        if skip:
+            continue
+
+        # 非必要词：按上界从大到小补分，剩余上界不够超过阈值时放弃
+        full = len(heap) >= k
+        for i in range(first_essential - 1, -1, -1):
+            if full and score + prefix[i] <= threshold:
+                score = -1.0
+                break
+            tf = scorers[i].tf_at(num)
+            if tf:
+                score += scorers[i].score(num, tf)
+        if score <= 0:
+            continue
+
+        if not full:
+            heapq.heappush(heap, (score, -num))
+        elif score > threshold:
+            heapq.heapreplace(heap, (score, -num))
+        else:
+            continue
+        if len(heap) >= k:
+            threshold = heap[0][0]
+            while first_essential < count and prefix[first_essential] <= threshold:
+                first_essential += 1
+
+    return [(-neg, score) for score, neg in sorted(heap, reverse=True)]
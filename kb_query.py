@@ -0,0 +1,214 @@
+"""
+知识库查询语言 - AND / OR / NOT、"短语"、括号
+
+语法（运算符必须大写，相邻的操作数之间默认为 AND）:
+    python AND (flask OR django) NOT java
+    "machine learning" 教程
+
+优先级 NOT > AND > OR。每个裸词按分词结果匹配：分出多个词时（如中文词）视为短语。
+求值在整数文档号的有序数组上进行：AND 按倒排表长度从短到长倍增求交，
+NOT 对有序数组求差，短语先对各词求交，再用位置索引校验相邻。
+"""
+
+import re
+from array import array
+from typing import List, Callable, Optional, Iterable
+
+from kb_index import intersect_sorted, union_sorted, difference_sorted
+
+OPERATORS = ("AND", "OR", "NOT")
+
+_LEXER = re.compile(r'"([^"]*)"?|(\()|(\))|([^\s()"]+)')
+
+# 语法树节点（元组）:
+#   ("term", 词)  ("phrase", [词...])  ("and", [子节点...])  ("or", [子节点...])  ("not", 子节点)
+
+
+def is_boolean_query(query: str) -> bool:
+    """查询是否用到了布尔运算符、引号或括号"""
+    if '"' in query or '(' in query:
+        return True
+    return any(word in OPERATORS for word in query.split())
+
+
+def _lex(query: str) -> List[tuple]:
+    tokens = []
+    for phrase, lparen, rparen, word in _LEXER.findall(query):
+        if lparen:
+            tokens.append(("(", None))
+        elif rparen:
+            tokens.append((")", None))
+        elif word in OPERATORS:
+            tokens.append((word, None))
+        elif word:
+            tokens.append(("word", word))
+        else:
+            tokens.append(("phrase", phrase))
+    return tokens
+
+
+def parse_query(query: str, tokenize: Callable[[str], List[str]]) -> Optional[tuple]:
+    """把查询解析为语法树，没有可检索的词时返回 None
+
+    括号不配对、运算符缺少操作数时尽量宽松处理（多余的符号忽略），不抛出异常。
+    """
+    tokens = _lex(query)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def operand(text: str) -> Optional[tuple]:
+        words = tokenize(text.lower())
+        if not words:
+            return None
+        if len(words) == 1:
+            return ("term", words[0])
+        return ("phrase", words)
+
+    def parse_or():
+        nonlocal pos
+        children = [parse_and()]
+        while peek() == "OR":
+            pos += 1
+            children.append(parse_and())
+        children = [child for child in children if child is not None]
+        if len(children) <= 1:
+            return children[0] if children else None
+        return ("or", children)
+
+    def parse_and():
+        nonlocal pos
+        children = []
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                pos += 1
+                continue
+            children.append(parse_unary())
+        children = [child for child in children if child is not None]
+        if len(children) <= 1:
+            return children[0] if children else None
+        return ("and", children)
+
+    def parse_unary():
+        nonlocal pos
+        kind, value = tokens[pos]
+        pos += 1
+        if kind == "NOT":
+            if peek() in (None, "OR", ")", "AND"):
+                return None
+            child = parse_unary()
+            return ("not", child) if child is not None else None
+        if kind == "(":
+            node = parse_or()
+            if peek() == ")":
+                pos += 1
+            return node
+        if kind in ("word", "phrase"):
+            return operand(value)
+        return None  # 多余的右括号
+
+    node = None
+    while pos < len(tokens):
+        part = parse_or()
+        if pos < len(tokens):
+            pos += 1  # 跳过不配对的右括号或多余的 OR
+        if part is not None:
+            node = part if node is None else ("and", [node, part])
+    return node
+
+
+def positive_terms(node: Optional[tuple]) -> List[str]:
+    """语法树中不在 NOT 之下的词（用于打分和段落定位），按出现顺序去重"""
+    terms = []
+
+    def walk(n):
+        kind = n[0]
+        if kind == "term":
+            terms.append(n[1])
+        elif kind == "phrase":
+            terms.extend(n[1])
+        elif kind in ("and", "or"):
+            for child in n[1]:
+                walk(child)
+
+    if node is not None:
+        walk(node)
+    return list(dict.fromkeys(terms))
+
+
+class QueryEvaluator:
+    """在有序文档号数组上对语法树求值
+
+    postings(词) 返回包含该词的有序文档号数组；
+    universe() 返回全部文档号（只在 NOT 没有正向条件可减时使用）；
+    has_phrase(文档号, 词列表) 校验短语的各词在文档中相邻。
+    """
+
+    def __init__(self,
+                 postings: Callable[[str], array],
+                 universe: Callable[[], array],
+                 has_phrase: Callable[[int, List[str]], bool]):
+        self.postings = postings
+        self.universe = universe
+        self.has_phrase = has_phrase
+
+    def evaluate(self, node: Optional[tuple]) -> array:
+        if node is None:
+            return array('I')
+        kind = node[0]
+        if kind == "term":
+            return self.postings(node[1])
+        if kind == "phrase":
+            return self._phrase(node[1], None)
+        if kind == "or":
+            result = array('I')
+            for child in node[1]:
+                result = union_sorted(result, self.evaluate(child))
+            return result
+        if kind == "not":
+            return difference_sorted(self.universe(), self.evaluate(node[1]))
+        return self._and(node[1])
+
+    def _and(self, children: Iterable[tuple]) -> array:
+        positive, negative, phrases = [], [], []
+        for child in children:
+            if child[0] == "not":
+                negative.append(child[1])
+            elif child[0] == "phrase":
+                phrases.append(child[1])
+            else:
+                positive.append(self.evaluate(child))
+        # 短语的各词也参与求交，位置校验推迟到候选集合最小的时候
+        for terms in phrases:
+            positive.extend(self.postings(term) for term in dict.fromkeys(terms))
+
+        if positive:
+            positive.sort(key=len)
+            result = positive[0]
+            for docs in positive[1:]:
+                if not result:
+                    break
+                result = intersect_sorted(result, docs)
+        else:
+            result = self.universe()
+
+        for terms in phrases:
+            if not result:
+                break
+            result = self._phrase(terms, result)
+        for child in negative:
+            if not result:
+                break
+            result = difference_sorted(result, self.evaluate(child))
+        return result
+
+    def _phrase(self, terms: List[str], candidates: Optional[array]) -> array:
+        if candidates is None:
+            lists = sorted((self.postings(term) for term in dict.fromkeys(terms)), key=len)
+            candidates = lists[0]
+            for docs in lists[1:]:
+                if not candidates:
+                    break
+                candidates = intersect_sorted(candidates, docs)
+        return array('I', (num for num in candidates if self.has_phrase(num, terms)))
@@ -0,0 +1,1040 @@
+"""
+知识库存储引擎 - JSON快照+操作日志 / SQLite
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import heapq
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Iterator, Iterable
+
+from kb_index import PositionIndex, decode_positions
+
+
+class JsonStorage:
+    """JSON快照 + 操作日志（write-ahead log）
+
+    每次写操作只向日志追加一行记录，写入成本与变更大小成正比；
+    日志累计到阈值后压缩为新快照并清空日志。
+    加载时先读快照，再重放快照之后的日志记录。
+    还没有快照时，日志的第一条记录是分词器描述（op 为 "tokenizer"），
+    只有日志的知识库重新打开时也能沿用建立时的分词器。
+    """
+
+    SNAPSHOT_NAME = "knowledge_base.json"
+    JOURNAL_NAME = "knowledge_base.journal"
+
+    def __init__(self, kb_dir: Path, compact_threshold: int = 500):
+        self.kb_dir = kb_dir
+        self.snapshot_file = kb_dir / self.SNAPSHOT_NAME
+        self.journal_file = kb_dir / self.JOURNAL_NAME
+        self.compact_threshold = compact_threshold
+        self.seq = 0  # 最后一条日志的序号
+        self.pending = 0  # 快照之后的日志条数
+
+    def exists(self) -> bool:
+        """是否已有持久化数据"""
+        return self.snapshot_file.exists() or self.journal_file.exists()
+
+    def fingerprint(self) -> tuple:
+        """文件指纹（mtime + 大小），用于发现其他进程的修改"""
+        result = []
+        for path in (self.snapshot_file, self.journal_file):
+            try:
+                stat = path.stat()
+                result.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                result.append(None)
+        return tuple(result)
+
+    # ---------- 知识库接口 ----------
+
+    def load(self, kb):
+        """把快照和日志加载到知识库"""
+        try:
+            data, ops = self.read()
+        except Exception as e:
+            print(f"⚠️ 加载知识库失败: {str(e)}")
+            return
+
+        if data is None and not ops:
+            return
+
+        try:
+            if data:
+                kb._restore_snapshot(data)
+            elif ops and ops[0].get("op") == "tokenizer":
+                kb._adopt_tokenizer(ops[0].get("spec"))
+
+            # 重放快照之后的操作
+            for op in ops:
+                kb._replay(op)
+
+            saved_at = data.get('saved_at', '未知') if data else '无快照'
+            print(f"✅ 知识库加载成功 (保存于: {saved_at}, 重放日志: {len(ops)} 条)")
+
+        except Exception as e:
+            print(f"⚠️ 加载知识库失败: {str(e)}")
+
+    def record(self, kb, op: Dict):
+        """记录一次写操作，累计到阈值后压缩"""
+        self.record_batch(kb, [op])
+
+    def record_batch(self, kb, ops: List[Dict]):
+        """一次性追加多条写操作，累计到阈值后压缩"""
+        if self.seq == 0 and not self.snapshot_file.exists():
+            ops = [{"op": "tokenizer", "spec": kb.tokenizer.spec()}, *ops]
+        self.append(*ops)
+        if self.should_compact():
+            self.save(kb)
+
+    def save(self, kb):
+        """压缩：写入完整快照并清空日志"""
+        self.write_snapshot(kb._snapshot())
+
+    def new_position_index(self, kb) -> PositionIndex:
+        """词位置索引：随快照整体保存在内存中"""
+        return PositionIndex()
+
+    def save_ranks(self, kb, names: List[str]):
+        """持久化实体重要度：只把有变化的实体的得分追加为一条日志记录"""
+        if not names:
+            return
+        entities = kb.knowledge_graph.entities
+        self.record(kb, {"op": "ranks", "ranks": {
+            name: [entities[name]["pagerank"], entities[name]["degree"]] for name in names
+        }})
+
+    def iter_tags(self, kb) -> Iterator[Tuple[str, str]]:
+        """遍历全部 (doc_id, 标签)"""
+        for doc_id, doc in kb.documents.items():
+            for tag in doc.tags:
+                yield doc_id, tag
+
+    def popular_tags(self, kb, limit: int) -> List[Tuple[str, int]]:
+        """按使用次数从多到少取前 limit 个 (标签, 次数)"""
+        tag_count = {}
+        for _, tag in self.iter_tags(kb):
+            tag_count[tag] = tag_count.get(tag, 0) + 1
+        return sorted(tag_count.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    def recent_documents(self, kb, limit: int) -> List:
+        """按创建时间从新到旧取前 limit 篇文档"""
+        return heapq.nlargest(limit, kb.documents.values(), key=lambda doc: doc.created_at)
+
+    # ---------- 文件操作 ----------
+
+    def read(self) -> Tuple[Optional[Dict], List[Dict]]:
+        """读取快照和需要重放的日志记录"""
+        snapshot = None
+        if self.snapshot_file.exists():
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+
+        snapshot_seq = snapshot.get("journal_seq", 0) if snapshot else 0
+        self.seq = snapshot_seq
+
+        ops = []
+        if self.journal_file.exists():
+            offset = 0
+            torn_at = None  # 损坏的行的起始偏移（读到下一行时清空：只有末行才截断）
+            skipped = 0
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    if torn_at is not None:
+                        skipped += 1  # 中间的坏行：跳过，不改动文件
+                        torn_at = None
+                    op = None
+                    # 进程崩溃可能留下写了一半（没有换行）的末行
+                    if line.endswith(b"\n"):
+                        if not line.strip():
+                            offset += len(line)
+                            continue
+                        try:
+                            op = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            pass
+                    if not isinstance(op, dict):
+                        torn_at = offset
+                    # 快照已包含的记录（压缩后未来得及清空日志）直接跳过
+                    elif op.get("seq", 0) > snapshot_seq:
+                        ops.append(op)
+                        self.seq = op["seq"]
+                    offset += len(line)
+            if skipped:
+                print(f"⚠️ 操作日志中有 {skipped} 条记录无法解析，已跳过")
+            if torn_at is not None:
+                # 截掉残缺的末行，否则之后追加的记录会接在半行后面，一起被当作坏行丢弃
+                with open(self.journal_file, 'r+b') as f:
+                    f.truncate(torn_at)
+                print(f"⚠️ 操作日志末尾有残缺的记录，已截断到 {torn_at} 字节")
+
+        self.pending = len(ops)
+        return snapshot, ops
+
+    def append(self, *ops: Dict):
+        """追加操作记录（多条记录只打开一次文件）"""
+        lines = []
+        for op in ops:
+            self.seq += 1
+            record = {"seq": self.seq, **op}
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        self.pending += len(ops)
+
+    def should_compact(self) -> bool:
+        """日志是否需要压缩"""
+        return self.pending >= self.compact_threshold
+
+    def write_snapshot(self, data: Dict):
+        """原子地写入快照并清空日志"""
+        data["journal_seq"] = self.seq
+        data["saved_at"] = datetime.now().isoformat()
+
+        tmp_file = self.snapshot_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.snapshot_file)
+
+        # 快照落盘后再清空日志；若中途崩溃，加载时按序号跳过即可
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self.pending = 0
+
+
+# 派生表（倒排索引等）格式变化时递增，旧库打开时重建
+SQLITE_SCHEMA_VERSION = 4
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id     TEXT PRIMARY KEY,
+    title      TEXT,
+    category   TEXT,
+    source     TEXT,
+    content    TEXT NOT NULL,
+    metadata   TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_documents_category ON documents(category);
+CREATE INDEX IF NOT EXISTS idx_documents_created ON documents(created_at);
+
+-- 持久的整数文档号（INTEGER PRIMARY KEY 在 VACUUM 后也不变），供按文档引用的图谱表使用
+CREATE TABLE IF NOT EXISTS doc_nums (
+    num    INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS categories (
+    category TEXT NOT NULL,
+    doc_id   TEXT NOT NULL,
+    PRIMARY KEY (category, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_categories_doc ON categories(doc_id);
+
+CREATE TABLE IF NOT EXISTS tags (
+    doc_id   TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tag      TEXT NOT NULL,
+    PRIMARY KEY (doc_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags(tag);
+
+CREATE TABLE IF NOT EXISTS postings (
+    field  TEXT NOT NULL,
+    term   TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    tf     INTEGER NOT NULL,
+    PRIMARY KEY (field, term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+
+CREATE TABLE IF NOT EXISTS passage_postings (
+    doc_id       TEXT NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset   INTEGER NOT NULL,
+    term         TEXT NOT NULL,
+    tf           INTEGER NOT NULL,
+    PRIMARY KEY (doc_id, start_offset, term)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS positions (
+    doc_id    TEXT NOT NULL,
+    term      TEXT NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (doc_id, term)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS token_offsets (
+    doc_id  TEXT PRIMARY KEY,
+    offsets BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS entities (
+    name       TEXT PRIMARY KEY,
+    type       TEXT,
+    properties TEXT NOT NULL,
+    pagerank   REAL NOT NULL DEFAULT 0,
+    degree     REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS entity_docs (
+    name   TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    PRIMARY KEY (name, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_entity_docs_doc ON entity_docs(doc_id);
+
+CREATE TABLE IF NOT EXISTS edges (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    src        TEXT NOT NULL,
+    dst        TEXT NOT NULL,
+    type       TEXT NOT NULL,
+    weight     INTEGER NOT NULL DEFAULT 1,
+    properties TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_edges_key ON edges(src, dst, type);
+CREATE INDEX IF NOT EXISTS idx_edges_dst ON edges(dst);
+
+-- 支持关系的文档：每个 (关系, 文档) 一行，增减只写一行
+CREATE TABLE IF NOT EXISTS edge_docs (
+    edge_id INTEGER NOT NULL,
+    doc     INTEGER NOT NULL,
+    PRIMARY KEY (edge_id, doc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_edge_docs_doc ON edge_docs(doc);
+
+CREATE TABLE IF NOT EXISTS kb_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteDocumentStore(MutableMapping):
+    """以SQLite为后端的文档映射
+
+    对外表现为 {doc_id: Document} 字典，文档正文保存在数据库中，
+    内存里只保留一个有界的LRU缓存。写入由 SQLiteStorage 在事务中完成；
+    写入之前的文档（如批量导入中尚未提交的一批）另存一份，不会被LRU挤掉。
+    """
+
+    def __init__(self, conn: sqlite3.Connection, cache_size: int = 256):
+        self.conn = conn
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._unsaved: Dict[str, object] = {}  # 已修改、尚未写入数据库的文档
+        self._new: set = set()  # 其中数据库里还没有行的文档ID
+
+    # 与文档行一起取出按位置排序的标签（JSON 数组），避免逐行再查标签表
+    SELECT_DOCUMENTS = (
+        "SELECT doc_id, content, metadata, created_at, updated_at, "
+        "(SELECT json_group_array(tag) FROM "
+        "(SELECT tag FROM tags WHERE tags.doc_id = documents.doc_id ORDER BY position)) "
+        "FROM documents"
+    )
+
+    def _row_to_document(self, row):
+        from knowledge_base import Document
+
+        doc_id, content, metadata, created_at, updated_at, tags = row
+        tags = json.loads(tags) if tags else []
+        return Document.from_dict({
+            "doc_id": doc_id,
+            "content": content,
+            "metadata": json.loads(metadata),
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "tags": tags
+        })
+
+    def _remember(self, doc_id: str, doc):
+        self._cache[doc_id] = doc
+        self._cache.move_to_end(doc_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, doc_id: str):
+        if doc_id in self._unsaved:
+            return self._unsaved[doc_id]
+        if doc_id in self._cache:
+            self._cache.move_to_end(doc_id)
+            return self._cache[doc_id]
+
+        row = self.conn.execute(
+            self.SELECT_DOCUMENTS + " WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+
+        doc = self._row_to_document(row)
+        self._remember(doc_id, doc)
+        return doc
+
+    def __setitem__(self, doc_id: str, doc):
+        # 行数据由 SQLiteStorage.record 在同一事务中写入，写入后调用 saved
+        if doc_id not in self._unsaved and not self._exists(doc_id):
+            self._new.add(doc_id)
+        self._unsaved[doc_id] = doc
+        self._remember(doc_id, doc)
+
+    def saved(self, doc_ids: Iterable[str]):
+        """文档行已写入数据库，此后只留在LRU缓存中"""
+        for doc_id in doc_ids:
+            self._unsaved.pop(doc_id, None)
+            self._new.discard(doc_id)
+
+    def __delitem__(self, doc_id: str):
+        self._cache.pop(doc_id, None)
+        self._unsaved.pop(doc_id, None)
+        self._new.discard(doc_id)
+
+    def _exists(self, doc_id: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone() is not None
+
+    def __contains__(self, doc_id) -> bool:
+        if doc_id in self._cache or doc_id in self._unsaved:
+            return True
+        return self._exists(doc_id)
+
+    def __iter__(self) -> Iterator[str]:
+        for (doc_id,) in self.conn.execute("SELECT doc_id FROM documents"):
+            yield doc_id
+        yield from list(self._new)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] + len(self._new)
+
+    def values(self):
+        """流式遍历所有文档（逐行读取游标，不进缓存）"""
+        for row in self.conn.execute(self.SELECT_DOCUMENTS):
+            yield self._unsaved.get(row[0]) or self._cache.get(row[0]) or self._row_to_document(row)
+        for doc_id in list(self._new):
+            yield self._unsaved[doc_id]
+
+    def recent(self, limit: int):
+        """按创建时间从新到旧取前 limit 篇文档"""
+        return [
+            self._cache.get(row[0]) or self._row_to_document(row)
+            for row in self.conn.execute(
+                self.SELECT_DOCUMENTS + " ORDER BY created_at DESC LIMIT ?", (limit,)
+            )
+        ]
+
+    def items(self):
+        for doc in self.values():
+            yield doc.doc_id, doc
+
+
+class SQLitePositionIndex(PositionIndex):
+    """以SQLite为后端的词位置索引
+
+    词位置和词起始偏移留在 positions / token_offsets 表中，短语校验和摘要定位时
+    按 (doc_id, 词) 主键读取需要的行。新增、更新、删除的文档先暂存在内存中，
+    由 SQLiteStorage 写入对应的行后取走，常驻内存的只有尚未提交的文档。
+    """
+
+    def __init__(self, conn: sqlite3.Connection, kb):
+        super().__init__()
+        self.conn = conn
+        self.kb = kb  # 文档号 -> doc_id 通过知识库当前的 doc_map 换算（重建索引时会替换）
+        # doc_id -> (编码后的位置, 编码后的偏移)，None 表示已删除
+        self._pending: Dict[str, Optional[tuple]] = {}
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(DISTINCT term) FROM positions").fetchone()[0]
+
+    def add(self, num: int, encoded: Dict[str, bytes], offsets: Optional[bytes] = None):
+        self._pending[self.kb.doc_map.lookup(num)] = (encoded, offsets)
+
+    def remove(self, num: int):
+        doc_id = self.kb.doc_map.lookup(num)
+        if doc_id is not None:
+            self._pending[doc_id] = None
+
+    def is_pending(self, doc_id: str) -> bool:
+        return doc_id in self._pending
+
+    def take(self, doc_id: str) -> Optional[tuple]:
+        """取走待写入的 (位置, 偏移)，文档已删除时为 None"""
+        return self._pending.pop(doc_id, None)
+
+    def doc_positions(self, num: int) -> Dict[str, bytes]:
+        doc_id = self.kb.doc_map.lookup(num)
+        if doc_id in self._pending:
+            entry = self._pending[doc_id]
+            return dict(entry[0]) if entry else {}
+        return dict(self.conn.execute(
+            "SELECT term, positions FROM positions WHERE doc_id = ?", (doc_id,)
+        ))
+
+    def doc_offsets(self, num: int) -> Optional[bytes]:
+        doc_id = self.kb.doc_map.lookup(num)
+        if doc_id in self._pending:
+            entry = self._pending[doc_id]
+            return entry[1] if entry else None
+        row = self.conn.execute(
+            "SELECT offsets FROM token_offsets WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, term: str, num: int) -> List[int]:
+        doc_id = self.kb.doc_map.lookup(num)
+        if doc_id in self._pending:
+            entry = self._pending[doc_id]
+            data = entry[0].get(term) if entry else None
+        else:
+            row = self.conn.execute(
+                "SELECT positions FROM positions WHERE doc_id = ? AND term = ?", (doc_id, term)
+            ).fetchone()
+            data = row[0] if row else None
+        return decode_positions(data) if data else []
+
+
+class SQLiteStorage:
+    """SQLite存储引擎
+
+    文档、分类、标签、倒排索引和图谱边分别存为带索引的表，
+    每次写操作在一个事务中只改动相关的行。
+    文档正文不常驻内存，通过 SQLiteDocumentStore 按需读取。
+    """
+
+    DB_NAME = "knowledge_base.db"
+
+    def __init__(self, kb_dir: Path, cache_size: int = 256):
+        self.kb_dir = kb_dir
+        self.db_file = kb_dir / self.DB_NAME
+        self.cache_size = cache_size
+        self.conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        self.needs_reindex = version < SQLITE_SCHEMA_VERSION
+        if self.needs_reindex:
+            self.conn.execute("DROP TABLE IF EXISTS postings")
+            self.conn.execute("DROP TABLE IF EXISTS passage_postings")
+            self.conn.execute("DROP TABLE IF EXISTS positions")
+            self.conn.execute("DROP TABLE IF EXISTS token_offsets")
+        self._rename_legacy_edges()
+        # 旧库的实体没有 entity_docs 表：加载时由来源文档和关系补全
+        self.infer_entity_docs = self._has_table("entities") and not self._has_table("entity_docs")
+        # 旧库的关系支持文档存在 edges.docs（JSON 数组）中：建表后搬到 edge_docs
+        migrate_edge_docs = not self._has_table("edge_docs") and "docs" in self._columns("edges")
+        fill_doc_nums = self._has_table("documents") and not self._has_table("doc_nums")
+        self.conn.executescript(SQLITE_SCHEMA)
+        if fill_doc_nums:
+            with self.conn:
+                self.conn.execute("INSERT INTO doc_nums (doc_id) SELECT doc_id FROM documents")
+        if migrate_edge_docs:
+            self._migrate_edge_docs()
+        self._add_missing_columns("entities", {
+            "pagerank": "REAL NOT NULL DEFAULT 0",
+            "degree": "REAL NOT NULL DEFAULT 0"
+        })
+        self.conn.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+
+    def _rename_legacy_edges(self):
+        """旧版 edges 表每次共现一行、没有权重列：改名保留，加载时合并后写入新表"""
+        columns = self._columns("edges")
+        if columns and "weight" not in columns:
+            with self.conn:
+                self.conn.execute("DROP INDEX IF EXISTS idx_edges_src")
+                self.conn.execute("DROP INDEX IF EXISTS idx_edges_dst")
+                self.conn.execute("DROP TABLE IF EXISTS edges_legacy")
+                self.conn.execute("ALTER TABLE edges RENAME TO edges_legacy")
+
+    def _migrate_edge_docs(self):
+        """把 edges.docs 中的文档ID拆成 edge_docs 的行（旧列保留但不再使用，清空以释放空间）"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO edge_docs (edge_id, doc) "
+                "SELECT edges.id, doc_nums.num FROM edges, json_each(edges.docs) "
+                "JOIN doc_nums ON doc_nums.doc_id = json_each.value"
+            )
+            self.conn.execute("UPDATE edges SET docs = '[]'")
+
+    def _columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+
+    def _add_missing_columns(self, table: str, columns: Dict[str, str]):
+        """给旧库的表补上新增的列"""
+        existing = set(self._columns(table))
+        with self.conn:
+            for column, definition in columns.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _has_table(self, name: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone() is not None
+
+    def exists(self) -> bool:
+        """是否已有持久化数据"""
+        return self.conn.execute(
+            "SELECT 1 FROM documents LIMIT 1"
+        ).fetchone() is not None
+
+    def fingerprint(self) -> int:
+        """数据版本号：其他连接提交事务后才会变化"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # ---------- 知识库接口 ----------
+
+    def load(self, kb):
+        """从数据库加载分类、索引和知识图谱"""
+        from knowledge_base import KnowledgeGraph
+        from kb_index import InvertedIndex, DocIdMap
+
+        # 首次启用时，从已有的JSON知识库迁移
+        if not self.exists():
+            legacy = JsonStorage(self.kb_dir)
+            if legacy.exists():
+                legacy.load(kb)
+                self.save(kb)
+                self.needs_reindex = False
+                print(f"✅ 已将 {len(kb.documents)} 篇文档迁移到 SQLite")
+
+        try:
+            if self.exists():
+                row = self.conn.execute(
+                    "SELECT value FROM kb_meta WHERE key = 'tokenizer'"
+                ).fetchone()
+                kb._adopt_tokenizer(json.loads(row[0]) if row else None)
+            kb.documents = SQLiteDocumentStore(self.conn, self.cache_size)
+
+            categories = {}
+            for category, doc_id in self.conn.execute(
+                "SELECT category, doc_id FROM categories"
+            ):
+                categories.setdefault(category, []).append(doc_id)
+            kb.categories = categories
+
+            if self.needs_reindex and self.exists():
+                # 旧版索引格式：根据文档重建倒排表
+                kb._rebuild_index()
+                with self.conn:
+                    for doc in kb.documents.values():
+                        self._write_postings(kb, doc)
+            else:
+                # 按插入顺序分配整数文档号，再把倒排行按词聚合成数组
+                doc_map = DocIdMap()
+                for (doc_id,) in self.conn.execute(
+                    "SELECT doc_id FROM documents ORDER BY rowid"
+                ):
+                    doc_map.intern(doc_id)
+
+                grouped = {"content": {}, "title": {}}
+                for field, term, doc_id, tf in self.conn.execute(
+                    "SELECT field, term, doc_id, tf FROM postings"
+                ):
+                    grouped[field].setdefault(term, []).append(
+                        (doc_map.intern(doc_id), tf)
+                    )
+
+                # 段落按 (doc_id, 起始偏移) 顺序分配段落号
+                passage_map = DocIdMap()
+                grouped["passage"] = {}
+                for doc_id, start, end, term, tf in self.conn.execute(
+                    "SELECT doc_id, start_offset, end_offset, term, tf "
+                    "FROM passage_postings ORDER BY doc_id, start_offset"
+                ):
+                    grouped["passage"].setdefault(term, []).append(
+                        (passage_map.intern(kb._passage_id(doc_id, start, end)), tf)
+                    )
+
+                fields = {}
+                for field, terms in grouped.items():
+                    index = fields[field] = InvertedIndex()
+                    for term, pairs in terms.items():
+                        index.load_postings(term, pairs)
+                kb.doc_map = doc_map
+                kb.index = fields["content"]
+                kb.title_index = fields["title"]
+                kb.passage_map = passage_map
+                kb.passage_index = fields["passage"]
+                kb._rebuild_doc_passages()
+
+                if kb.positions is not None:
+                    # 词位置留在库中按需读取
+                    kb.positions = self.new_position_index(kb)
+                    has_positions = self.conn.execute(
+                        "SELECT 1 FROM positions LIMIT 1"
+                    ).fetchone() is not None
+                    if not has_positions and kb.doc_map:
+                        # 之前关闭了位置索引：根据正文逐篇重建并写回
+                        with self.conn:
+                            for doc in kb.documents.values():
+                                kb._index_positions(doc_map.get(doc.doc_id), doc)
+                                self._write_positions(kb, doc)
+            self.needs_reindex = False
+
+            kg = KnowledgeGraph()
+            for name, entity_type, properties, pagerank, degree in self.conn.execute(
+                "SELECT name, type, properties, pagerank, degree FROM entities"
+            ):
+                kg.entities[name] = {
+                    "type": entity_type,
+                    "properties": json.loads(properties),
+                    "related": set(),
+                    "docs": set(),
+                    "pagerank": pagerank,
+                    "degree": degree
+                }
+            # 同一文档ID在各实体和关系中只保留一个字符串对象
+            for name, doc_id in self.conn.execute("SELECT name, doc_id FROM entity_docs"):
+                if name in kg.entities:
+                    kg.entities[name]["docs"].add(sys.intern(doc_id))
+            rows_by_id = {}
+            for row in self.conn.execute(
+                "SELECT id, src, dst, type, weight, properties, created_at, updated_at "
+                "FROM edges ORDER BY id"
+            ):
+                row_id, src, dst, rel_type, weight, properties, created_at, updated_at = row
+                rel = {
+                    "from": src,
+                    "to": dst,
+                    "type": rel_type,
+                    "weight": weight,
+                    "docs": set(),
+                    "properties": json.loads(properties),
+                    "created_at": created_at,
+                    "updated_at": updated_at
+                }
+                # edges 表在 (src, dst, type) 和 dst 上有索引，邻接表随加载顺带建立
+                kg._index_edge(len(kg.relationships), rel)
+                kg.relationships.append(rel)
+                rows_by_id[row_id] = rel
+                if src in kg.entities and dst in kg.entities:
+                    kg.entities[src]["related"].add(dst)
+                    kg.entities[dst]["related"].add(src)
+            for row_id, doc_id in self.conn.execute(
+                "SELECT edge_docs.edge_id, doc_nums.doc_id FROM edge_docs "
+                "JOIN doc_nums ON doc_nums.num = edge_docs.doc"
+            ):
+                rel = rows_by_id.get(row_id)
+                if rel is not None:
+                    rel["docs"].add(sys.intern(doc_id))
+
+            if self._has_table("edges_legacy"):
+                # 旧版每次共现一行：合并重复的关系后写入新表
+                legacy_rows = self.conn.execute(
+                    "SELECT src, dst, type, properties, created_at FROM edges_legacy ORDER BY id"
+                ).fetchall()
+                merged = kg.merge_relationships(
+                    {"from": src, "to": dst, "type": rel_type,
+                     "properties": json.loads(properties), "created_at": created_at}
+                    for src, dst, rel_type, properties, created_at in legacy_rows
+                )
+                with self.conn:
+                    self.conn.execute("DELETE FROM edges")
+                    self.conn.execute("DELETE FROM edge_docs")
+                    self._write_edges(kg.relationships)
+                    self._write_edge_docs(kg.relationships)
+                    self.conn.execute("DROP TABLE edges_legacy")
+                print(f"🔧 已将 {len(legacy_rows)} 条关系合并为 {merged} 条带权重的关系")
+
+            if self.infer_entity_docs:
+                kg.infer_entity_docs()
+                with self.conn:
+                    self._write_entities(kg, kg.entities.keys())
+                    self._write_mentions(kg, kg.mentions.keys())
+                self.infer_entity_docs = False
+                print(f"🔧 已为 {len(kg.entities)} 个实体补全提及它的文档")
+            else:
+                kg.rebuild_mentions()
+            kg.track_changes = True
+            kb.knowledge_graph = kg
+
+            if kb.documents:
+                print(f"✅ 知识库加载成功 (SQLite: {self.db_file.name})")
+
+        except Exception as e:
+            # 不能吞掉：图谱的变更跟踪尚未打开，继续使用会让之后的写入静默丢失
+            print(f"⚠️ 加载知识库失败: {str(e)}")
+            raise
+
+    def new_position_index(self, kb) -> "SQLitePositionIndex":
+        """词位置索引：以 positions / token_offsets 表为后端"""
+        return SQLitePositionIndex(self.conn, kb)
+
+    def record(self, kb, op: Dict):
+        """在一个事务中写入本次操作涉及的行"""
+        self.record_batch(kb, [op])
+
+    def record_batch(self, kb, ops: List[Dict]):
+        """在一个事务中写入一批操作涉及的行"""
+        from knowledge_base import Document
+
+        written = []
+        with self.conn:
+            for op in ops:
+                kind = op["op"]
+                if kind in ("add", "update"):
+                    written.append(op["doc"]["doc_id"] if kind == "add" else op["doc_id"])
+                if kind == "add":
+                    # 批量导入时文档可能已被挤出LRU缓存，直接用日志中的数据
+                    doc = Document.from_dict(op["doc"])
+                    self._write_document(doc)
+                    self._write_category(doc)
+                    self._write_postings(kb, doc)
+                elif kind == "update":
+                    doc = kb.documents[op["doc_id"]]
+                    self._write_document(doc)
+                    self._write_category(doc)
+                    if op.get("content") or "title" in op.get("metadata", {}):
+                        self._write_postings(kb, doc)
+                elif kind == "delete":
+                    self._delete_document(kb, op["doc_id"])
+            self._write_graph_changes(kb.knowledge_graph)
+            self._write_meta(kb)
+        kb.documents.saved(written)
+
+    def iter_tags(self, kb) -> Iterator[Tuple[str, str]]:
+        """遍历全部 (doc_id, 标签)，不加载文档正文"""
+        yield from self.conn.execute("SELECT doc_id, tag FROM tags")
+
+    def popular_tags(self, kb, limit: int) -> List[Tuple[str, int]]:
+        """按使用次数从多到少取前 limit 个 (标签, 次数)，在数据库中聚合"""
+        return self.conn.execute(
+            "SELECT tag, COUNT(*) AS n FROM tags GROUP BY tag ORDER BY n DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+
+    def recent_documents(self, kb, limit: int) -> List:
+        """按创建时间从新到旧取前 limit 篇文档（走 created_at 索引）"""
+        return kb.documents.recent(limit)
+
+    def save(self, kb):
+        """把内存中的完整状态写入数据库（用于迁移和重建）"""
+        written = []
+        with self.conn:
+            # 派生表整体重写，顺带清掉失效的行；
+            # 库中的词位置按需读取，只改写有变化的文档，再清掉已删除文档的行
+            self.conn.execute("DELETE FROM categories")
+            self.conn.execute("DELETE FROM postings")
+            self.conn.execute("DELETE FROM passage_postings")
+            for doc in list(kb.documents.values()):
+                self._write_document(doc)
+                self._write_category(doc)
+                self._write_postings(kb, doc)
+                written.append(doc.doc_id)
+            for table in ("positions", "token_offsets"):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE doc_id NOT IN (SELECT doc_id FROM documents)"
+                )
+
+            kg = kb.knowledge_graph
+            kg.drain_changes()
+            self.conn.execute("DELETE FROM entities")
+            self.conn.execute("DELETE FROM entity_docs")
+            self.conn.execute("DELETE FROM edges")
+            self.conn.execute("DELETE FROM edge_docs")
+            self._write_entities(kg, kg.entities.keys())
+            self._write_mentions(kg, kg.mentions.keys())
+            self._write_edges(kg.relationships)
+            self._write_edge_docs(kg.relationships)
+            self._write_meta(kb)
+        if isinstance(kb.documents, SQLiteDocumentStore):
+            kb.documents.saved(written)
+
+    def save_ranks(self, kb, names: List[str]):
+        """持久化实体重要度：只更新有变化的实体行的两列"""
+        entities = kb.knowledge_graph.entities
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE entities SET pagerank = ?, degree = ? WHERE name = ?",
+                [(entities[name]["pagerank"], entities[name]["degree"], name) for name in names]
+            )
+
+    # ---------- 行级写入 ----------
+
+    def _write_meta(self, kb):
+        """记录建立索引所用的分词器"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO kb_meta (key, value) VALUES ('tokenizer', ?)",
+            (json.dumps(kb.tokenizer.spec()),)
+        )
+
+    def _write_document(self, doc):
+        metadata = doc.metadata
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(doc_id, title, category, source, content, metadata, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                doc.doc_id,
+                metadata.get("title"),
+                metadata.get("category", "未分类"),
+                metadata.get("source"),
+                doc.content,
+                json.dumps(metadata, ensure_ascii=False),
+                doc.created_at,
+                doc.updated_at
+            )
+        )
+        self.conn.execute("INSERT OR IGNORE INTO doc_nums (doc_id) VALUES (?)", (doc.doc_id,))
+        self.conn.execute("DELETE FROM tags WHERE doc_id = ?", (doc.doc_id,))
+        self.conn.executemany(
+            "INSERT INTO tags (doc_id, position, tag) VALUES (?, ?, ?)",
+            [(doc.doc_id, i, tag) for i, tag in enumerate(doc.tags)]
+        )
+
+    def _write_category(self, doc):
+        self.conn.execute("DELETE FROM categories WHERE doc_id = ?", (doc.doc_id,))
+        self.conn.execute(
+            "INSERT INTO categories (category, doc_id) VALUES (?, ?)",
+            (doc.metadata.get("category", "未分类"), doc.doc_id)
+        )
+
+    def _write_postings(self, kb, doc):
+        self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc.doc_id,))
+        rows = []
+        for field in ("content", "title"):
+            for term, tf in kb.get_term_vector(doc.doc_id, field).items():
+                rows.append((field, term, doc.doc_id, tf))
+        self.conn.executemany(
+            "INSERT INTO postings (field, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+            rows
+        )
+
+        self.conn.execute("DELETE FROM passage_postings WHERE doc_id = ?", (doc.doc_id,))
+        self.conn.executemany(
+            "INSERT INTO passage_postings (doc_id, start_offset, end_offset, term, tf) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (doc.doc_id, start, end, term, tf)
+                for start, end, freqs in kb.get_passage_vectors(doc.doc_id)
+                for term, tf in freqs.items()
+            ]
+        )
+        self._write_positions(kb, doc)
+
+    def _write_positions(self, kb, doc):
+        positions = kb.positions
+        if isinstance(positions, SQLitePositionIndex):
+            if not positions.is_pending(doc.doc_id):
+                return  # 库中的行就是最新的
+            encoded, offsets = positions.take(doc.doc_id) or ({}, None)
+        else:
+            num = kb.doc_map.get(doc.doc_id)
+            if positions is None or num is None:
+                encoded, offsets = {}, None
+            else:
+                encoded, offsets = positions.doc_positions(num), positions.doc_offsets(num)
+        self.conn.execute("DELETE FROM positions WHERE doc_id = ?", (doc.doc_id,))
+        self.conn.execute("DELETE FROM token_offsets WHERE doc_id = ?", (doc.doc_id,))
+        self.conn.executemany(
+            "INSERT INTO positions (doc_id, term, positions) VALUES (?, ?, ?)",
+            [(doc.doc_id, term, data) for term, data in encoded.items()]
+        )
+        if offsets:
+            self.conn.execute(
+                "INSERT INTO token_offsets (doc_id, offsets) VALUES (?, ?)",
+                (doc.doc_id, offsets)
+            )
+
+    def _delete_document(self, kb, doc_id: str):
+        if isinstance(kb.positions, SQLitePositionIndex):
+            kb.positions.take(doc_id)
+        self.conn.execute(
+            "DELETE FROM edge_docs WHERE doc = (SELECT num FROM doc_nums WHERE doc_id = ?)",
+            (doc_id,)
+        )
+        for table in ("documents", "categories", "tags", "postings", "passage_postings",
+                      "positions", "token_offsets", "doc_nums"):
+            self.conn.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+
+    def _write_entities(self, kg, names):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entities (name, type, properties, pagerank, degree) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (name, kg.entities[name]["type"],
+                 json.dumps(kg.entities[name]["properties"], ensure_ascii=False),
+                 kg.entities[name].get("pagerank", 0.0),
+                 kg.entities[name].get("degree", 0.0))
+                for name in names if name in kg.entities
+            ]
+        )
+
+    def _write_edges(self, relationships: List[Dict]):
+        """写入新关系或更新已有关系的权重（支持文档另存于 edge_docs）"""
+        self.conn.executemany(
+            "INSERT INTO edges (src, dst, type, weight, properties, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (src, dst, type) DO UPDATE SET "
+            "weight = excluded.weight, "
+            "properties = excluded.properties, updated_at = excluded.updated_at",
+            [
+                (rel["from"], rel["to"], rel["type"], rel["weight"],
+                 json.dumps(rel.get("properties", {}), ensure_ascii=False),
+                 rel.get("created_at"), rel.get("updated_at"))
+                for rel in relationships
+            ]
+        )
+
+    # 关系和文档都按键定位：任一方已不存在时不插入
+    INSERT_EDGE_DOC = (
+        "INSERT OR IGNORE INTO edge_docs (edge_id, doc) "
+        "SELECT edges.id, doc_nums.num FROM edges, doc_nums "
+        "WHERE edges.src = ? AND edges.dst = ? AND edges.type = ? AND doc_nums.doc_id = ?"
+    )
+
+    def _write_edge_docs(self, relationships: List[Dict]):
+        """写入关系的全部支持文档（用于整体重写）"""
+        self.conn.executemany(self.INSERT_EDGE_DOC, [
+            (rel["from"], rel["to"], rel["type"], doc_id)
+            for rel in relationships
+            for doc_id in rel["docs"]
+        ])
+
+    def _write_mentions(self, kg, doc_ids):
+        """按文档重写 entity_docs 中的行"""
+        for doc_id in doc_ids:
+            self.conn.execute("DELETE FROM entity_docs WHERE doc_id = ?", (doc_id,))
+            self.conn.executemany(
+                "INSERT INTO entity_docs (name, doc_id) VALUES (?, ?)",
+                [(name, doc_id) for name in kg.mentions.get(doc_id, ())]
+            )
+
+    def _write_graph_changes(self, kg):
+        changes = kg.drain_changes()
+        edge_docs = changes["edge_docs"]
+        self.conn.executemany(
+            "DELETE FROM edge_docs WHERE "
+            "edge_id = (SELECT id FROM edges WHERE src = ? AND dst = ? AND type = ?) AND "
+            "doc = (SELECT num FROM doc_nums WHERE doc_id = ?)",
+            [key for key, supported in edge_docs.items() if not supported]
+        )
+        self.conn.executemany(
+            "DELETE FROM edge_docs WHERE "
+            "edge_id = (SELECT id FROM edges WHERE src = ? AND dst = ? AND type = ?)",
+            changes["removed_relationships"]
+        )
+        self.conn.executemany(
+            "DELETE FROM edges WHERE src = ? AND dst = ? AND type = ?",
+            changes["removed_relationships"]
+        )
+        self.conn.executemany(
+            "DELETE FROM entities WHERE name = ?",
+            [(name,) for name in changes["removed_entities"]]
+        )
+        self._write_entities(kg, changes["entities"])
+        self._write_edges(changes["relationships"])
+        self.conn.executemany(
+            self.INSERT_EDGE_DOC,
+            [key for key, supported in edge_docs.items() if supported]
+        )
+        self._write_mentions(kg, changes["documents"])
@@ -0,0 +1,208 @@
+"""
+知识库分词器 - 可插拔的中英文分词
+
+ngram: 英文按单词，中文按重叠的 2/3 字切分（默认，无需词典）
+dict:  英文按单词，中文按本地词典做正向最大匹配，词典外的字按 2 字切分
+
+分词器的描述（名称 + 词典指纹）记录在知识库快照中，
+加载时与当前分词器不一致会重建索引，保证查询和索引使用同一种切分。
+"""
+
+import re
+import hashlib
+from pathlib import Path
+from typing import List, Dict, Optional, Set, Tuple
+
+from config import KB_TOKENIZER_DICT
+
+# 一次扫描同时取出英文单词和中文片段
+_TOKEN_RE = re.compile(r'[a-zA-Z]+|[\u4e00-\u9fff]+')
+_CHINESE_RE = re.compile(r'^[\u4e00-\u9fff]+$')
+
+
+class Tokenizer:
+    """分词器接口"""
+
+    name = ""
+
+    def tokenize(self, text: str) -> List[str]:
+        raise NotImplementedError
+
+    def tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[int]]:
+        """分词并给出每个词在原文中的起始字符偏移（词长即原文中的字符数）"""
+        raise NotImplementedError
+
+    def spec(self) -> Dict:
+        """写入快照的分词器描述，两个描述相等即切分结果一致"""
+        return {"name": self.name}
+
+    def __reduce__(self):
+        # 传给导入进程池时只传名称和词典路径，子进程中按需构造并缓存
+        return get_tokenizer, self._args()
+
+    def _args(self) -> tuple:
+        return (self.name,)
+
+
+class NgramTokenizer(Tokenizer):
+    """英文单词（至少2个字母，转小写）+ 中文重叠 2/3 字切分
+
+    按原文顺序输出（同一起点先 2 字再 3 字），位置索引据此判断短语中的词是否相邻。
+    """
+
+    name = "ngram"
+    # 第 2 版改为按原文顺序输出（第 1 版先输出全部英文单词），旧索引中的位置需要重建
+    VERSION = 2
+
+    def spec(self) -> Dict:
+        return {"name": self.name, "version": self.VERSION}
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = []
+        for match in _TOKEN_RE.findall(text):
+            if match[0] < '\u0080':
+                if len(match) > 1:
+                    tokens.append(match.lower())
+                continue
+            n = len(match)
+            for i in range(n - 1):
+                tokens.append(match[i:i + 2])
+                if i + 3 <= n:
+                    tokens.append(match[i:i + 3])
+        return tokens
+
+    def tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[int]]:
+        tokens, starts = [], []
+        for match in _TOKEN_RE.finditer(text):
+            run = match.group()
+            base = match.start()
+            if run[0] < '\u0080':
+                if len(run) > 1:
+                    tokens.append(run.lower())
+                    starts.append(base)
+                continue
+            n = len(run)
+            for i in range(n - 1):
+                tokens.append(run[i:i + 2])
+                starts.append(base + i)
+                if i + 3 <= n:
+                    tokens.append(run[i:i + 3])
+                    starts.append(base + i)
+        return tokens, starts
+
+
+class DictTokenizer(Tokenizer):
+    """英文单词 + 中文词典正向最大匹配
+
+    词典为 UTF-8 文本，每行一个词（行内空白后的词频、词性等列会被忽略）。
+    连续的词典外汉字按 2 字切分，单独一个时保留单字。按原文顺序输出。
+    """
+
+    name = "dict"
+    MAX_WORD_LENGTH = 8
+
+    def __init__(self, dict_file: Path):
+        self.dict_file = Path(dict_file)
+        self.words: Set[str] = set()
+        if self.dict_file.exists():
+            with open(self.dict_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and _CHINESE_RE.match(parts[0]) and len(parts[0]) > 1:
+                        self.words.add(parts[0])
+        else:
+            print(f"⚠️ 分词词典不存在: {self.dict_file}，中文将全部按 2 字切分")
+        self.max_length = min(max(map(len, self.words), default=1), self.MAX_WORD_LENGTH)
+        self.fingerprint = hashlib.md5(
+            "\n".join(sorted(self.words)).encode('utf-8')
+        ).hexdigest()
+
+    def spec(self) -> Dict:
+        return {"name": self.name, "dict": self.fingerprint}
+
+    def _args(self) -> tuple:
+        return (self.name, str(self.dict_file))
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = []
+        for match in _TOKEN_RE.findall(text):
+            if match[0] < '\u0080':
+                if len(match) > 1:
+                    tokens.append(match.lower())
+            else:
+                self._segment(match, tokens)
+        return tokens
+
+    def tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[int]]:
+        tokens, starts = [], []
+        for match in _TOKEN_RE.finditer(text):
+            run = match.group()
+            if run[0] < '\u0080':
+                if len(run) > 1:
+                    tokens.append(run.lower())
+                    starts.append(match.start())
+            else:
+                self._segment(run, tokens, starts, match.start())
+        return tokens, starts
+
+    def _segment(self, run: str, tokens: List[str],
+                 starts: Optional[List[int]] = None, base: int = 0):
+        """切分一段连续汉字，词追加到 tokens（starts 不为空时同时追加起始偏移）"""
+        words = self.words
+        max_length = self.max_length
+        n = len(run)
+        i = unknown = 0  # unknown: 尚未输出的词典外片段起点
+        while i < n:
+            length = min(max_length, n - i)
+            while length > 1 and run[i:i + length] not in words:
+                length -= 1
+            if length == 1:
+                i += 1
+                continue
+            if unknown < i:
+                self._split_unknown(run, unknown, i, tokens, starts, base)
+            tokens.append(run[i:i + length])
+            if starts is not None:
+                starts.append(base + i)
+            i += length
+            unknown = i
+        if unknown < n:
+            self._split_unknown(run, unknown, n, tokens, starts, base)
+
+    @staticmethod
+    def _split_unknown(run: str, start: int, end: int, tokens: List[str],
+                       starts: Optional[List[int]], base: int):
+        if end - start == 1:
+            tokens.append(run[start])
+            if starts is not None:
+                starts.append(base + start)
+            return
+        for i in range(start, end - 1):
+            tokens.append(run[i:i + 2])
+            if starts is not None:
+                starts.append(base + i)
+
+
+TOKENIZERS = {
+    NgramTokenizer.name: NgramTokenizer,
+    DictTokenizer.name: DictTokenizer
+}
+
+_cache: Dict[tuple, Tokenizer] = {}
+
+
+def get_tokenizer(name: str = "ngram", dict_file: Optional[str] = None) -> Tokenizer:
+    """按名称取得分词器（同一进程内缓存，词典只加载一次）"""
+    if name not in TOKENIZERS:
+        raise ValueError(f"未知的分词器: {name}（可选: {', '.join(TOKENIZERS)}）")
+    if name == DictTokenizer.name:
+        dict_file = str(dict_file or KB_TOKENIZER_DICT)
+    else:
+        dict_file = None
+    key = (name, dict_file)
+    tokenizer = _cache.get(key)
+    if tokenizer is None:
+        tokenizer = _cache[key] = (
+            DictTokenizer(dict_file) if dict_file else TOKENIZERS[name]()
+        )
+    return tokenizer
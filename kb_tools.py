@@ -2,15 +2,16 @@
 知识库工具 - 集成到Agent系统
 """
 
+import os
 from typing import Dict, List
-from knowledge_base import KnowledgeBase
+from knowledge_base import get_knowledge_base
 
 
 class KnowledgeBaseTools:
     """知识库工具集"""
     
     def __init__(self):
-        self.kb = KnowledgeBase()
+        self.kb = get_knowledge_base()
     
     @staticmethod
     def add_knowledge(content: str, 
@@ -27,7 +28,7 @@ class KnowledgeBaseTools:
             tags: 标签（逗号分隔）
         """
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             
             tag_list = []
             if tags:
@@ -52,22 +53,45 @@ class KnowledgeBaseTools:
     @staticmethod
     def search_knowledge(query: str, 
                         category: str = None,
-                        limit: int = 5) -> str:
+                        limit: int = 5,
+                        mode: str = "keyword",
+                        debug: bool = False,
+                        tags: List[str] = None,
+                        match_all_tags: bool = False) -> str:
         """
         搜索知识库
         
         Args:
-            query: 搜索关键词
+            query: 搜索关键词，支持 AND / OR / NOT、"短语" 和括号
             category: 限定分类
             limit: 返回结果数量
+            mode: 检索模式，keyword（关键词）、semantic（语义）或 hybrid（混合）
+            debug: 是否附带各检索阶段的耗时（仅 hybrid 模式）
+            tags: 限定标签
+            match_all_tags: 是否要求包含全部标签（默认包含任一即可）
         """
         try:
-            kb = KnowledgeBase()
-            results = kb.search(
-                query=query,
-                category=category,
-                limit=limit
-            )
+            kb = get_knowledge_base()
+            timing = None
+            if mode == "hybrid":
+                hybrid = kb.hybrid_search(
+                    query=query,
+                    category=category,
+                    tags=tags,
+                    limit=limit,
+                    match_all_tags=match_all_tags
+                )
+                results = hybrid["results"]
+                timing = hybrid["debug"]
+            else:
+                results = kb.search(
+                    query=query,
+                    category=category,
+                    tags=tags,
+                    limit=limit,
+                    mode=mode,
+                    match_all_tags=match_all_tags
+                )
             
             if not results:
                 return f"🔍 未找到与 '{query}' 相关的知识"
@@ -77,32 +101,55 @@ class KnowledgeBaseTools:
             for i, doc in enumerate(results, 1):
                 title = doc.metadata.get('title', f'文档_{doc.doc_id}')
                 category = doc.metadata.get('category', '未分类')
-                preview = doc.content[:100] + "..." if len(doc.content) > 100 else doc.content
                 
                 response += f"{i}. 【{category}】{title}\n"
-                response += f"   {preview}\n"
-                response += f"   ID: {doc.doc_id}\n"
+                
+                # 只返回以命中处为中心的摘要（命中词加粗），需要更多内容时按偏移读取；
+                # 长文档另给出 BM25 最匹配的段落的偏移，可用 get_knowledge_detail 读取该段
+                snippet = kb.snippet(doc.doc_id, query)
+                response += f"   {snippet['text']}\n"
+                if snippet["start"] > 0 or snippet["end"] < len(doc.content):
+                    location = f"摘要 {snippet['start']}-{snippet['end']}"
+                    passage = kb.best_passage(doc.doc_id, query)
+                    if passage and passage["score"] > 0 and \
+                            (passage["start"], passage["end"]) != (0, len(doc.content)):
+                        location += f"，最相关段落 {passage['start']}-{passage['end']}"
+                    response += (f"   ID: {doc.doc_id}（{location}，"
+                                 f"全文 {len(doc.content)} 字）\n")
+                else:
+                    response += f"   ID: {doc.doc_id}\n"
                 
                 if doc.tags:
                     response += f"   标签: {', '.join(doc.tags)}\n"
                 
                 response += "\n"
             
+            if debug and timing:
+                response += (f"⏱ 调试: 关键词 {timing['keyword_ms']:.1f}ms"
+                             f"（{timing['keyword_hits']} 条）, "
+                             f"语义 {timing['semantic_ms']:.1f}ms"
+                             f"（{timing['semantic_hits']} 条）, "
+                             f"融合 {timing['fusion_ms']:.1f}ms, "
+                             f"总计 {timing['total_ms']:.1f}ms"
+                             f"{'（缓存命中）' if timing.get('cached') else ''}")
+            
             return response.strip()
         
         except Exception as e:
             return f"❌ 搜索失败: {str(e)}"
     
     @staticmethod
-    def get_knowledge_detail(doc_id: str) -> str:
+    def get_knowledge_detail(doc_id: str, start: int = None, end: int = None) -> str:
         """
         获取知识详情
         
         Args:
             doc_id: 文档ID
+            start: 只返回正文中从该字符偏移开始的部分
+            end: 只返回正文中到该字符偏移为止的部分
         """
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             doc = kb.get_document(doc_id)
             
             if not doc:
@@ -123,7 +170,13 @@ class KnowledgeBaseTools:
             if doc.metadata.get('source'):
                 response += f"来源: {doc.metadata['source']}\n"
             
-            response += f"\n内容:\n{doc.content}"
+            if start is not None or end is not None:
+                start = max(0, start or 0)
+                end = min(len(doc.content), end if end is not None else len(doc.content))
+                response += f"\n内容（{start}-{end}，全文 {len(doc.content)} 字）:\n"
+                response += doc.content[start:end]
+            else:
+                response += f"\n内容:\n{doc.content}"
             
             return response
         
@@ -134,7 +187,7 @@ class KnowledgeBaseTools:
     def list_knowledge_categories() -> str:
         """列出所有分类"""
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             stats = kb.get_statistics()
             
             if not stats['categories']:
@@ -160,7 +213,7 @@ class KnowledgeBaseTools:
     def get_knowledge_stats() -> str:
         """获取知识库统计"""
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             stats = kb.get_statistics()
             
             response = "📊 知识库统计:\n\n"
@@ -168,7 +221,10 @@ class KnowledgeBaseTools:
             response += f"  📁 分类数量: {stats['total_categories']}\n"
             response += f"  🧠 实体数量: {stats['total_entities']}\n"
             response += f"  🔗 关系数量: {stats['total_relationships']}\n"
-            response += f"  📇 索引词数: {stats['total_index_words']}\n"
+            response += f"  📇 索引词数: {stats['total_index_words']}（分词器: {stats['tokenizer']}）\n"
+            cache = stats['query_cache']
+            response += (f"  ⚡ 检索缓存: 命中 {cache['hits']} / 未命中 {cache['misses']}"
+                         f"（命中率 {cache['hit_rate']:.0%}）\n")
             
             # 热门标签
             popular_tags = kb.get_popular_tags(5)
@@ -196,15 +252,22 @@ class KnowledgeBaseTools:
         从文件导入知识
         
         Args:
-            filepath: 文件路径
+            filepath: 文件或目录路径（目录会批量导入其中的 .txt/.md 文件）
             category: 分类名称
         """
         try:
-            kb = KnowledgeBase()
-            count = kb.import_from_file(filepath, category)
-            
-            if count > 0:
-                return f"✅ 成功导入 {count} 篇文档到分类 [{category}]"
+            kb = get_knowledge_base()
+            if os.path.isdir(filepath):
+                filepaths = kb.list_import_files(filepath)
+            else:
+                filepaths = [filepath]
+            stats = kb.import_files(filepaths, category)
+            
+            if stats["count"] > 0:
+                return f"✅ 成功导入 {stats['count']} 篇文档到分类 [{category}]\n" \
+                       f"   耗时: {stats['seconds']:.2f}s " \
+                       f"({stats['docs_per_sec']:.1f} 篇/秒, " \
+                       f"{stats['bytes_per_sec'] / 1024:.1f} KB/秒)"
             else:
                 return "❌ 导入失败，请检查文件路径"
         
@@ -220,7 +283,7 @@ class KnowledgeBaseTools:
             entity_name: 实体名称
         """
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             entity = kb.knowledge_graph.get_entity(entity_name)
             
             if not entity:
@@ -236,21 +299,34 @@ class KnowledgeBaseTools:
             
             if entity['properties']:
                 response += f"属性: {entity['properties']}\n"
+            if entity.get('pagerank'):
+                response += f"重要度: {entity['pagerank']:.5f} (加权度数 {entity.get('degree', 0):.0f})\n"
             
             # 获取关系
             relationships = kb.knowledge_graph.get_entity_relationships(entity_name)
             if relationships:
                 response += f"\n🔗 关系 ({len(relationships)} 条):\n"
-                for rel in relationships[:10]:  # 最多显示10条
+                # 按权重（支持的文档数）从高到低，最多显示10条
+                for rel in sorted(relationships, key=lambda r: r['weight'], reverse=True)[:10]:
+                    label = f"{rel['type']} ×{rel['weight']}"
                     if rel['from'] == entity_name:
-                        response += f"  • {entity_name} --[{rel['type']}]--> {rel['to']}\n"
+                        response += f"  • {entity_name} --[{label}]--> {rel['to']}\n"
                     else:
-                        response += f"  • {rel['from']} --[{rel['type']}]--> {entity_name}\n"
+                        response += f"  • {rel['from']} --[{label}]--> {entity_name}\n"
             
-            # 获取关联实体
-            related = kb.knowledge_graph.get_related_entities(entity_name, max_depth=1)
+            # 获取关联实体（按重要度排序）
+            related = kb.knowledge_graph.get_related_entities(entity_name, max_depth=1, limit=10)
             if related:
-                response += f"\n📌 关联实体:\n  " + "\n  ".join(related[:10])
+                response += f"\n📌 关联实体:\n  " + "\n  ".join(related)
+            
+            # 提及该实体的文档（实体 -> 文档的反向索引，不扫描正文）
+            doc_ids = kb.knowledge_graph.get_entity_documents(entity_name)
+            if doc_ids:
+                response += f"\n\n📄 提及该实体的文档 ({len(doc_ids)} 篇):\n"
+                for doc_id in doc_ids[:5]:
+                    doc = kb.get_document(doc_id)
+                    if doc:
+                        response += f"  • [{doc_id}] {doc.metadata.get('title', '无标题')}\n"
             
             return response
         
@@ -266,7 +342,7 @@ class KnowledgeBaseTools:
             output_file: 输出文件路径
         """
         try:
-            kb = KnowledgeBase()
+            kb = get_knowledge_base()
             
             if output_file is None:
                 from datetime import datetime
@@ -318,13 +394,13 @@ KB_TOOLS_CONFIG = [
         "type": "function",
         "function": {
             "name": "search_knowledge",
-            "description": "在个人知识库中搜索相关知识",
+            "description": "在个人知识库中搜索相关知识，长文档会给出摘要和最相关段落在原文中的偏移，可用 get_knowledge_detail 按偏移读取",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "query": {
                         "type": "string",
-                        "description": "搜索关键词或问题"
+                        "description": "搜索关键词或问题；精确查询可用大写的 AND / OR / NOT、双引号短语和括号，如 \"机器学习\" AND (python OR java) NOT 入门"
                     },
                     "category": {
                         "type": "string",
@@ -335,6 +411,28 @@ KB_TOOLS_CONFIG = [
                         "type": "integer",
                         "description": "返回结果数量",
                         "default": 5
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["keyword", "semantic", "hybrid"],
+                        "description": "检索模式：keyword 按关键词匹配，semantic 按语义相似度，hybrid 融合两者（推荐）",
+                        "default": "keyword"
+                    },
+                    "debug": {
+                        "type": "boolean",
+                        "description": "是否在结果末尾附带各检索阶段的耗时（hybrid 模式）",
+                        "default": False
+                    },
+                    "tags": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "限定标签",
+                        "default": None
+                    },
+                    "match_all_tags": {
+                        "type": "boolean",
+                        "description": "为 true 时要求包含全部标签，否则包含任一标签即可",
+                        "default": False
                     }
                 },
                 "required": ["query"]
@@ -352,6 +450,16 @@ KB_TOOLS_CONFIG = [
                     "doc_id": {
                         "type": "string",
                         "description": "文档ID"
+                    },
+                    "start": {
+                        "type": "integer",
+                        "description": "只读取正文的一部分时的起始字符偏移（可使用搜索结果中的段落偏移）",
+                        "default": None
+                    },
+                    "end": {
+                        "type": "integer",
+                        "description": "只读取正文的一部分时的结束字符偏移",
+                        "default": None
                     }
                 },
                 "required": ["doc_id"]
@@ -392,7 +500,7 @@ KB_TOOLS_CONFIG = [
                 "properties": {
                     "filepath": {
                         "type": "string",
-                        "description": "要导入的文件路径"
+                        "description": "要导入的文件或目录路径"
                     },
                     "category": {
                         "type": "string",
@@ -0,0 +1,451 @@
+"""
+知识库向量检索 - 本地哈希嵌入 + 内存映射嵌入矩阵 + IVF近似最近邻索引（需要 numpy）
+"""
+
+import os
+import math
+import zlib
+from array import array
+from pathlib import Path
+from typing import List, Dict, Optional, Callable, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时向量检索不可用
+    np = None
+
+
+def vectors_available() -> bool:
+    """是否可以使用向量检索"""
+    return np is not None
+
+
+def _bucket(term: str, dim: int) -> Tuple[int, float]:
+    """特征哈希：词 -> (维度, 符号)，跨进程稳定"""
+    data = term.encode('utf-8')
+    h = zlib.crc32(data)
+    sign = 1.0 if zlib.adler32(data) & 1 else -1.0
+    return h % dim, sign
+
+
+def embed_counts(freqs: Dict[str, int], dim: int,
+                 weights: Dict[str, float] = None) -> "np.ndarray":
+    """把词频向量哈希成 dim 维单位向量
+
+    每个词的权重为 1 + log(tf)（可再乘以 weights 中的权重，如查询词的IDF），
+    用带符号的特征哈希投影到固定维度，结果做L2归一化。
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for term, tf in freqs.items():
+        if tf <= 0:
+            continue
+        weight = 1.0 + math.log(tf)
+        if weights:
+            weight *= weights.get(term, 1.0)
+        i, sign = _bucket(term, dim)
+        vec[i] += sign * weight
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class IVFIndex:
+    """倒排文件（IVF）近似最近邻索引
+
+    粗量化器是在嵌入上用球面 k-means 训练出的 nlist 个质心，每行向量归入最相似的质心；
+    查询时只扫描与查询最相似的 nprobe 个质心下的行，nprobe 越大召回越高、越慢。
+    质心保存在 embeddings.ivf.npz，每行所属的质心号保存在内存映射的 embeddings.assign.npy
+    （-1 表示未分配），插入/更新只写一个整数；各质心的行列表在打开时由分配数组重建。
+    """
+
+    CENTROIDS_NAME = "embeddings.ivf.npz"
+    ASSIGN_NAME = "embeddings.assign.npy"
+    CHUNK_ROWS = 8192  # 批量分配时每次参与矩阵乘法的行数（限制相似度矩阵的内存）
+    MAX_SAMPLE = 131072  # k-means 训练样本上限
+
+    def __init__(self, kb_dir: Path, dim: int):
+        self.dim = dim
+        self.centroids_file = kb_dir / self.CENTROIDS_NAME
+        self.assign_file = kb_dir / self.ASSIGN_NAME
+        self.centroids = None  # (nlist, dim)
+        self.trained_rows = 0  # 训练时的向量数，用于判断是否需要重新训练
+        self.assign = None  # 行号 -> 质心号
+        self.lists: List[array] = []  # 质心号 -> 行号数组（只追加，可能含已转移的行）
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids) if self.centroids is not None else 0
+
+    # ============== 文件 ==============
+
+    def open(self, matrix: "np.ndarray", rows: List[int]):
+        """加载质心和分配数组；rows 为当前有效的行号"""
+        if not self.centroids_file.exists():
+            return
+        with np.load(self.centroids_file) as data:
+            centroids = data["centroids"]
+            trained_rows = int(data["trained_rows"])
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            self.drop()
+            return
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = trained_rows
+
+        capacity = matrix.shape[0]
+        assign = None
+        if self.assign_file.exists():
+            assign = np.load(self.assign_file, mmap_mode='r+')
+            if assign.shape != (capacity,):
+                del assign
+                assign = None
+        if assign is None:
+            self._create_assign(capacity)
+        else:
+            self.assign = assign
+
+        # 上次退出前未分配的行（例如嵌入文件被重新生成）
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            pending = rows[self.assign[rows] < 0]
+            if len(pending):
+                self.assign[pending] = self._nearest(matrix, pending)
+        self._build_lists(len(matrix))
+
+    def _create_assign(self, capacity: int, keep: int = 0):
+        tmp_file = self.assign_file.with_suffix(".npy.tmp")
+        assign = np.lib.format.open_memmap(
+            tmp_file, mode='w+', dtype=np.int32, shape=(capacity,)
+        )
+        assign[:] = -1
+        if keep:
+            assign[:keep] = self.assign[:keep]
+        assign.flush()
+        del assign
+        self.assign = None
+        os.replace(tmp_file, self.assign_file)
+        self.assign = np.load(self.assign_file, mmap_mode='r+')
+
+    def _build_lists(self, n_rows: int):
+        """按分配数组重建各质心的行列表"""
+        assign = np.asarray(self.assign[:n_rows])
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        self.lists = [
+            array('I', order[bounds[c]:bounds[c + 1]].astype(np.uint32).tobytes())
+            for c in range(self.nlist)
+        ]
+
+    def resize(self, capacity: int, keep: int):
+        """嵌入矩阵扩容时同步扩大分配数组"""
+        if self.trained:
+            self._create_assign(capacity, keep)
+
+    def flush(self):
+        if self.assign is not None:
+            self.assign.flush()
+
+    def drop(self):
+        """丢弃索引（维度变化或矩阵重建时）"""
+        self.centroids = None
+        self.trained_rows = 0
+        self.assign = None
+        self.lists = []
+        for path in (self.centroids_file, self.assign_file):
+            if path.exists():
+                path.unlink()
+
+    # ============== 训练与分配 ==============
+
+    def _nearest(self, matrix: "np.ndarray", rows: "np.ndarray",
+                 centroids: "np.ndarray" = None) -> "np.ndarray":
+        """分块计算每行最相似的质心"""
+        if centroids is None:
+            centroids = self.centroids
+        labels = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), self.CHUNK_ROWS):
+            chunk = rows[start:start + self.CHUNK_ROWS]
+            labels[start:start + len(chunk)] = np.argmax(matrix[chunk] @ centroids.T, axis=1)
+        return labels
+
+    def train(self, matrix: "np.ndarray", rows: List[int], nlist: int,
+              iterations: int = 10, sample_per_list: int = 64, seed: int = 0):
+        """在 rows 对应的向量上训练质心，并重新分配全部行"""
+        rng = np.random.default_rng(seed)
+        rows = np.asarray(rows, dtype=np.int64)
+        nlist = max(1, min(nlist, len(rows)))
+        sample_size = min(len(rows), nlist * sample_per_list, self.MAX_SAMPLE)
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, sample_size, replace=False))])
+        sample_rows = np.arange(sample_size)
+
+        # 球面 k-means：相似度用点积，质心每轮重新归一化
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = self._nearest(sample, sample_rows, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空簇用随机样本重新播种
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.centroids = centroids
+        self.trained_rows = len(rows)
+        tmp_file = self.centroids_file.with_suffix(".tmp.npz")
+        np.savez(tmp_file, centroids=centroids, trained_rows=self.trained_rows)
+        os.replace(tmp_file, self.centroids_file)
+
+        self._create_assign(matrix.shape[0])
+        self.assign[rows] = self._nearest(matrix, rows)
+        self._build_lists(int(rows.max()) + 1 if len(rows) else 0)
+        self.flush()
+
+    def reassign(self, matrix: "np.ndarray", n_rows: int):
+        """矩阵行号整体变化后（压缩），用现有质心重新分配前 n_rows 行"""
+        self._create_assign(matrix.shape[0])
+        rows = np.arange(n_rows)
+        if n_rows:
+            self.assign[:n_rows] = self._nearest(matrix, rows)
+        self._build_lists(n_rows)
+        self.flush()
+
+    def add(self, row: int, vec: "np.ndarray"):
+        """插入/更新一行"""
+        label = int(np.argmax(self.centroids @ vec))
+        if self.assign[row] != label:
+            self.assign[row] = label
+            self.lists[label].append(row)
+
+    def remove(self, row: int):
+        self.assign[row] = -1
+
+    # ============== 查询 ==============
+
+    def candidates(self, query_vec: "np.ndarray", nprobe: int) -> "np.ndarray":
+        """与查询最相似的 nprobe 个质心下的全部行号"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ query_vec
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        parts = []
+        for label in probe:
+            rows = np.frombuffer(self.lists[label], dtype=np.uint32)
+            # 列表只追加，转移到其他质心的行在这里过滤掉
+            parts.append(rows[self.assign[rows] == label])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.uint32)
+
+
+class VectorStore:
+    """嵌入矩阵
+
+    矩阵保存在 embeddings.npy 中并以内存映射方式打开，按行存放文档向量，
+    行号与 doc_id 的对应关系追加写入 embeddings.ids（每行一个 doc_id，flush 时批量追加）。
+    新增/更新只写一行，删除把该行清零；查询是一次矩阵-向量乘法加 argpartition。
+    ids 文件比矩阵短（未 flush 就退出）时，多出的行视为不存在，由知识库重新生成。
+
+    有效向量达到 ann_min_rows 后自动训练 IVF 索引，查询只扫描 probe_ratio 比例的质心下的行；
+    向量数比训练时增长到 RETRAIN_GROWTH 倍后重新训练，使各质心的列表保持均衡。
+    """
+
+    MATRIX_NAME = "embeddings.npy"
+    IDS_NAME = "embeddings.ids"
+    INITIAL_CAPACITY = 1024
+    RETRAIN_GROWTH = 4
+
+    def __init__(self, kb_dir: Path, dim: int = 256,
+                 ann_min_rows: int = 200000, probe_ratio: float = 0.03):
+        self.dim = dim
+        self.ann_min_rows = ann_min_rows
+        self.probe_ratio = probe_ratio
+        self.ivf = IVFIndex(kb_dir, dim)
+        self.matrix_file = kb_dir / self.MATRIX_NAME
+        self.ids_file = kb_dir / self.IDS_NAME
+        self.row_ids: List[Optional[str]] = []  # 行号 -> doc_id（None 表示已删除）
+        self.rows: Dict[str, int] = {}  # doc_id -> 行号
+        self.matrix = None
+        self._pending_ids: List[str] = []
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # ============== 文件 ==============
+
+    def _open(self):
+        if self.matrix_file.exists() and self.ids_file.exists():
+            matrix = np.load(self.matrix_file, mmap_mode='r+')
+            if matrix.ndim == 2 and matrix.shape[1] == self.dim:
+                self.matrix = matrix
+                with open(self.ids_file, 'r', encoding='utf-8') as f:
+                    row_ids = [line.strip() or None for line in f]
+                # 追加 ids 时崩溃可能多出矩阵容量之外的行
+                self.row_ids = row_ids[:matrix.shape[0]]
+                for row, doc_id in enumerate(self.row_ids):
+                    if doc_id is not None:
+                        self.rows[doc_id] = row
+                self.ivf.open(matrix, list(self.rows.values()))
+                return
+            # 维度变化：丢弃旧矩阵，由知识库重新生成
+            del matrix
+        self.ivf.drop()
+        self._create(self.INITIAL_CAPACITY)
+
+    def _create(self, capacity: int, keep: int = 0):
+        """创建（或扩容为）capacity 行的矩阵文件，保留前 keep 行"""
+        tmp_file = self.matrix_file.with_suffix(".npy.tmp")
+        matrix = np.lib.format.open_memmap(
+            tmp_file, mode='w+', dtype=np.float32, shape=(capacity, self.dim)
+        )
+        if keep:
+            matrix[:keep] = self.matrix[:keep]
+        matrix.flush()
+        del matrix
+        self.matrix = None
+        os.replace(tmp_file, self.matrix_file)
+        self.matrix = np.load(self.matrix_file, mmap_mode='r+')
+        if keep:
+            self.ivf.resize(capacity, keep)
+
+        if not keep:
+            self.row_ids = []
+            self.rows = {}
+            self._pending_ids = []
+            with open(self.ids_file, 'w', encoding='utf-8'):
+                pass
+
+    def flush(self):
+        """把矩阵写回磁盘并追加新行的 doc_id"""
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.ivf.flush()
+        if self._pending_ids:
+            with open(self.ids_file, 'a', encoding='utf-8') as f:
+                f.writelines(doc_id + "\n" for doc_id in self._pending_ids)
+            self._pending_ids = []
+        if self._needs_training():
+            self.train()
+
+    # ============== 维护 ==============
+
+    def set(self, doc_id: str, vec: "np.ndarray") -> "np.ndarray":
+        """写入文档向量，返回矩阵中对应行的视图"""
+        row = self.rows.get(doc_id)
+        if row is None:
+            row = len(self.row_ids)
+            if row >= self.matrix.shape[0]:
+                self._create(self.matrix.shape[0] * 2, keep=row)
+            self.row_ids.append(doc_id)
+            self.rows[doc_id] = row
+            self._pending_ids.append(doc_id)
+        self.matrix[row] = vec
+        if self.ivf.trained:
+            self.ivf.add(row, vec)
+        return self.matrix[row]
+
+    def get(self, doc_id: str) -> Optional["np.ndarray"]:
+        row = self.rows.get(doc_id)
+        return self.matrix[row] if row is not None else None
+
+    def delete(self, doc_id: str):
+        row = self.rows.pop(doc_id, None)
+        if row is not None:
+            self.matrix[row] = 0
+            self.row_ids[row] = None
+            if self.ivf.trained:
+                self.ivf.remove(row)
+
+    def compact(self):
+        """删除的行超过一半时重写矩阵，回收空间"""
+        used = len(self.row_ids)
+        if used == 0 or len(self.rows) * 2 >= used:
+            return
+        live = [doc_id for doc_id in self.row_ids if doc_id is not None]
+        vectors = np.array(self.matrix[[self.rows[doc_id] for doc_id in live]])
+        capacity = max(self.INITIAL_CAPACITY, 1 << max(len(live) - 1, 0).bit_length())
+        self._create(capacity)
+        self.matrix[:len(live)] = vectors
+        self.row_ids = live
+        self.rows = {doc_id: row for row, doc_id in enumerate(live)}
+        self._pending_ids = list(live)
+        if self.ivf.trained:
+            self.ivf.reassign(self.matrix, len(live))
+        self.flush()
+
+    def _needs_training(self) -> bool:
+        if len(self.rows) < self.ann_min_rows:
+            return False
+        return (not self.ivf.trained
+                or len(self.rows) >= self.ivf.trained_rows * self.RETRAIN_GROWTH)
+
+    def train(self, nlist: int = None):
+        """训练（或重新训练）IVF 索引，nlist 默认取 4·sqrt(向量数)"""
+        n = len(self.rows)
+        if n == 0:
+            return
+        if nlist is None:
+            nlist = min(4096, max(16, int(4 * math.sqrt(n))))
+        self.ivf.train(self.matrix, list(self.rows.values()), nlist)
+
+    # ============== 查询 ==============
+
+    def search(self, query_vec: "np.ndarray", k: int,
+               accept: Callable[[str], bool] = None,
+               nprobe: int = None) -> List[Tuple[str, float]]:
+        """余弦相似度 top-k，返回 [(doc_id, 分数)]
+
+        IVF 索引已训练时只在 nprobe 个质心下的行中查找（默认取质心数的 probe_ratio，
+        nprobe=0 强制精确检索）；近似结果不足 k 条（过滤条件很严格，或与查询相关的行
+        不在扫描的质心下）时退回精确检索。accept 为可选的过滤函数。
+        """
+        n = len(self.row_ids)
+        if n == 0 or k <= 0:
+            return []
+
+        if nprobe is None and self.ivf.trained:
+            nprobe = max(1, math.ceil(self.ivf.nlist * self.probe_ratio))
+        if nprobe and self.ivf.trained:
+            rows = self.ivf.candidates(query_vec, nprobe)
+            results = self._top(rows, self.matrix[rows] @ query_vec, k, accept)
+            if len(results) >= k:
+                return results
+
+        return self._top(None, self.matrix[:n] @ query_vec, k, accept)
+
+    def _top(self, rows: Optional["np.ndarray"], scores: "np.ndarray", k: int,
+             accept: Callable[[str], bool] = None) -> List[Tuple[str, float]]:
+        """从候选分数中取 top-k；rows 为 None 表示 scores 按行号排列
+
+        有过滤条件时先取 4k 个候选，过滤后不够再全量排序；没有过滤条件时 argpartition
+        的前 k 个已包含全部可能的结果（删除的行向量为零，分数不为正），不再全量排序。
+        """
+        n = len(scores)
+        if n == 0:
+            return []
+
+        def collect(order):
+            results = []
+            for i in order:
+                score = float(scores[i])
+                if score <= 0:
+                    break
+                doc_id = self.row_ids[i if rows is None else rows[i]]
+                if doc_id is None or (accept and not accept(doc_id)):
+                    continue
+                results.append((doc_id, score))
+                if len(results) >= k:
+                    break
+            return results
+
+        fetch = min(n, k * 4 if accept else k)
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        results = collect(top[np.argsort(-scores[top])])
+        if accept and len(results) < k and fetch < n:
+            results = collect(np.argsort(-scores))
+        return results
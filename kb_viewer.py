@@ -6,32 +6,38 @@ import json
 import os
 from pathlib import Path
 from datetime import datetime
-from knowledge_base import KnowledgeBase
+from knowledge_base import KnowledgeBase, get_knowledge_base
 
 
 def check_kb_exists():
     """检查知识库是否存在"""
     kb_file = Path("data/knowledge_base/knowledge_base.json")
+    journal_file = Path("data/knowledge_base/knowledge_base.journal")
+    db_file = Path("data/knowledge_base/knowledge_base.db")
     
-    if not kb_file.exists():
+    if not kb_file.exists() and not journal_file.exists() and not db_file.exists():
         print("❌ 知识库文件不存在")
-        print(f"   预期位置: {kb_file.absolute()}")
+        print(f"   预期位置: {kb_file.absolute()} 或 {db_file.absolute()}")
         print("\n💡 提示：知识库会在首次添加知识时自动创建")
         return False
     
-    print(f"✅ 知识库文件存在: {kb_file.absolute()}")
-    
-    # 显示文件信息
-    size = kb_file.stat().st_size
-    mtime = datetime.fromtimestamp(kb_file.stat().st_mtime)
-    
-    if size < 1024:
-        size_str = f"{size} B"
-    else:
-        size_str = f"{size / 1024:.2f} KB"
-    
-    print(f"   文件大小: {size_str}")
-    print(f"   最后更新: {mtime}")
+    for path in (kb_file, journal_file, db_file):
+        if not path.exists():
+            continue
+        
+        print(f"✅ 知识库文件存在: {path.absolute()}")
+        
+        # 显示文件信息
+        size = path.stat().st_size
+        mtime = datetime.fromtimestamp(path.stat().st_mtime)
+        
+        if size < 1024:
+            size_str = f"{size} B"
+        else:
+            size_str = f"{size / 1024:.2f} KB"
+        
+        print(f"   文件大小: {size_str}")
+        print(f"   最后更新: {mtime}")
     
     return True
 
@@ -43,7 +49,7 @@ def view_kb_summary():
     print("=" * 70)
     
     try:
-        kb = KnowledgeBase()
+        kb = get_knowledge_base()
         stats = kb.get_statistics()
         
         print(f"\n📄 文档总数: {stats['total_documents']}")
@@ -203,11 +209,11 @@ def search_in_kb(kb: KnowledgeBase, query: str):
     for i, doc in enumerate(results, 1):
         title = doc.metadata.get('title', f'文档_{doc.doc_id}')
         category = doc.metadata.get('category', '未分类')
-        preview = doc.content[:100].replace('\n', ' ')
+        snippet = kb.snippet(doc.doc_id, query, markers=("【", "】"))
         
         print(f"{i}. [{category}] {title}")
         print(f"   ID: {doc.doc_id}")
-        print(f"   {preview}...")
+        print(f"   {snippet['text']}")
         print()
 
 
@@ -220,6 +226,22 @@ def export_kb_readable(kb: KnowledgeBase):
     print(f"   文件位置: {Path(output_file).absolute()}")
 
 
+def rank_entities(kb: KnowledgeBase, top: int = 20):
+    """计算实体重要度并显示最重要的实体"""
+    try:
+        kb.update_entity_ranks()
+    except RuntimeError as e:
+        print(f"❌ {str(e)}")
+        return
+    
+    entities = kb.knowledge_graph.entities
+    ranked = sorted(entities, key=lambda name: entities[name]["pagerank"], reverse=True)
+    print(f"\n🏆 最重要的 {min(top, len(ranked))} 个实体:")
+    for i, name in enumerate(ranked[:top], 1):
+        entity = entities[name]
+        print(f"  {i:>2}. {name}  (PageRank {entity['pagerank']:.5f}, 加权度数 {entity['degree']:.0f})")
+
+
 def interactive_viewer():
     """交互式查看器"""
     print("\n" + "=" * 70)
@@ -245,10 +267,11 @@ def interactive_viewer():
         print("  4. 查看文档详情")
         print("  5. 导出知识库")
         print("  6. 刷新统计")
+        print("  7. 计算实体重要度")
         print("  0. 退出")
         print("-" * 70)
         
-        choice = input("\n请选择 (0-6): ").strip()
+        choice = input("\n请选择 (0-7): ").strip()
         
         if choice == '0':
             print("\n👋 退出查看器")
@@ -280,6 +303,9 @@ def interactive_viewer():
         elif choice == '6':
             kb = view_kb_summary()
         
+        elif choice == '7':
+            rank_entities(kb)
+        
         else:
             print("\n⚠️ 无效选项")
         
@@ -3,14 +3,203 @@
 """
 
 import os
+import sys
 import json
 import time
+import heapq
+import bisect
+import threading
+from array import array
+from functools import partial
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Callable
 from pathlib import Path
 import hashlib
 
-from config import DATA_DIR
+from config import (
+    KB_DIR, KB_STORAGE_BACKEND, KB_JOURNAL_COMPACT_THRESHOLD,
+    KB_IMPORT_COMMIT_EVERY, KB_IMPORT_WORKERS, KB_EMBEDDING_DIM,
+    KB_ANN_MIN_ROWS, KB_ANN_PROBE_RATIO, KB_PASSAGE_SIZE, KB_PASSAGE_OVERLAP,
+    KB_QUERY_CACHE_SIZE, KB_POSITIONAL_INDEX, KB_TOKENIZER, KB_SNIPPET_CHARS,
+    KB_GRAPH_MAX_RESULTS, KB_PAGERANK_DAMPING, KB_PAGERANK_TOL, KB_PAGERANK_MAX_ITER,
+    KB_RANK_AFTER_IMPORT, KB_RANK_AFTER_IMPORT_MIN_DOCS
+)
+from kb_storage import JsonStorage, SQLiteStorage
+from kb_index import (
+    InvertedIndex, DocIdMap, FacetIndex, Bitmap, PositionIndex, intersect_bitmaps,
+    term_frequencies, token_positions, encode_offsets, phrase_in_positions, union_sorted, top_k
+)
+from kb_query import is_boolean_query, parse_query, positive_terms, QueryEvaluator
+from kb_tokenizer import Tokenizer, get_tokenizer
+from kb_graph import GraphView, graph_view_available
+from kb_vector import VectorStore, embed_counts, vectors_available
+
+
+# ============== 文本分析（纯函数，可在子进程中运行） ==============
+
+def tokenize(text: str) -> List[str]:
+    """简单分词（中英文，默认的 ngram 分词器）"""
+    return get_tokenizer().tokenize(text)
+
+
+def top_keywords(freqs: Dict[str, int], limit: int = 10) -> List[tuple]:
+    """选择高频词作为实体（过滤单字）"""
+    return sorted(
+        ((word, freq) for word, freq in freqs.items() if len(word) > 1),
+        key=lambda x: x[1],
+        reverse=True
+    )[:limit]
+
+
+PASSAGE_BREAKS = "\n。！？!?；;.，, "  # 段落切分点，越靠前越优先
+
+
+def split_passages(text: str,
+                   size: int = KB_PASSAGE_SIZE,
+                   overlap: int = KB_PASSAGE_OVERLAP) -> List[tuple]:
+    """把正文切分为相互重叠的段落，返回 [(起始偏移, 结束偏移)]
+    
+    每段最多 size 个字符，尽量在换行或句末标点处断开（不早于半段），
+    下一段从上一段结尾往回 overlap 个字符内的第一个断点之后开始。
+    """
+    if len(text) <= size:
+        return [(0, len(text))]
+    
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            for mark in PASSAGE_BREAKS:
+                cut = text.rfind(mark, start + size // 2, end)
+                if cut != -1:
+                    end = cut + 1
+                    break
+        passages.append((start, end))
+        if end >= len(text):
+            break
+        next_start = end - overlap
+        for mark in PASSAGE_BREAKS:
+            cut = text.find(mark, next_start, end - 1)
+            if cut != -1:
+                next_start = cut + 1
+                while next_start < end and text[next_start].isspace():
+                    next_start += 1
+                break
+        start = max(next_start, start + 1)
+    return passages
+
+
+def densest_window(spans: List[tuple], size: int, length: int) -> tuple:
+    """在按起始偏移排序的命中 [(起始, 结束, 词)] 中，找覆盖不同查询词最多
+    （其次命中次数最多）的 size 字符窗口，命中区域居中，返回 (起始, 结束)"""
+    if length <= size:
+        return 0, length
+    if not spans:
+        return 0, size
+    
+    best = None
+    counts = {}
+    left = 0
+    for right, (_, end, term) in enumerate(spans):
+        counts[term] = counts.get(term, 0) + 1
+        while end - spans[left][0] > size:
+            dropped = spans[left][2]
+            counts[dropped] -= 1
+            if not counts[dropped]:
+                del counts[dropped]
+            left += 1
+        key = (len(counts), right - left + 1)
+        if best is None or key > best[0]:
+            best = (key, spans[left][0], end)
+    
+    _, first, last = best
+    start = max(0, first - (size - (last - first)) // 2)
+    end = min(length, start + size)
+    return max(0, end - size), end
+
+
+def merge_spans(spans: List[tuple], start: int, end: int) -> List[list]:
+    """[start, end) 内的命中区域：重叠或相连的命中（如同一个词的多个 n-gram）合并为一段"""
+    merged = []
+    for hit_start, hit_end, _ in spans:
+        hit_start, hit_end = max(hit_start, start), min(hit_end, end)
+        if hit_start >= hit_end:
+            continue
+        if merged and hit_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hit_end)
+        else:
+            merged.append([hit_start, hit_end])
+    return merged
+
+
+def highlight(text: str, start: int, end: int, spans: List[tuple],
+              markers: tuple = ("**", "**")) -> str:
+    """截取 text[start:end]，用标记包围其中的命中（重叠或相连的命中合并），空白折叠为单个空格"""
+    parts = []
+    pos = start
+    for hit_start, hit_end in merge_spans(spans, start, end):
+        parts.append(text[pos:hit_start])
+        parts.append(markers[0] + text[hit_start:hit_end] + markers[1])
+        pos = hit_end
+    parts.append(text[pos:end])
+    return " ".join("".join(parts).split())
+
+
+def analyze_passages(content: str, tokenizer: Tokenizer = None) -> List[tuple]:
+    """切分段落并统计每段词频，返回 [(起始偏移, 结束偏移, 词频)]"""
+    tokenizer = tokenizer or get_tokenizer()
+    return [
+        (start, end, term_frequencies(tokenizer.tokenize(content[start:end].lower())))
+        for start, end in split_passages(content)
+    ]
+
+
+def analyze_document(content: str, title: str = "", tokenizer: Tokenizer = None) -> Dict:
+    """分词并统计正文/标题/段落词频、关键词和正文词位置"""
+    tokenizer = tokenizer or get_tokenizer()
+    if KB_POSITIONAL_INDEX:
+        tokens, starts = tokenizer.tokenize_with_offsets(content)
+    else:
+        tokens = tokenizer.tokenize(content.lower())
+    content_tf = term_frequencies(tokens)
+    analysis = {
+        "content_tf": content_tf,
+        "title_tf": term_frequencies(tokenizer.tokenize((title or "").lower())),
+        "keywords": top_keywords(content_tf),
+        "passages": analyze_passages(content, tokenizer)
+    }
+    if KB_POSITIONAL_INDEX:
+        analysis["positions"] = token_positions(tokens)
+        analysis["offsets"] = encode_offsets(starts)
+    return analysis
+
+
+def _analyze_file(filepath: str, tokenizer: Tokenizer = None) -> Optional[Dict]:
+    """读取并分析一个待导入文件（导入进程池的工作函数）"""
+    try:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        content = raw.decode('utf-8')
+    except Exception as e:
+        return {"filepath": filepath, "error": str(e)}
+    
+    title = os.path.splitext(os.path.basename(filepath))[0]
+    return {
+        "filepath": filepath,
+        "title": title,
+        "content": content,
+        "bytes": len(raw),
+        "hash": hashlib.md5(raw).hexdigest(),
+        "analysis": analyze_document(content, title, tokenizer)
+    }
+
+
+def _analyze_chunk(filepaths: List[str], tokenizer: Tokenizer = None) -> List[Dict]:
+    """分析一组待导入文件（一次进程间往返处理多个文件）"""
+    return [_analyze_file(filepath, tokenizer) for filepath in filepaths]
 
 
 class Document:
@@ -26,7 +215,7 @@ class Document:
         self.created_at = datetime.now().isoformat()
         self.updated_at = self.created_at
         self.tags = []
-        self.embedding = None  # 向量嵌入（如果使用向量检索）
+        self.embedding = None  # 向量嵌入（嵌入矩阵中对应行的视图）
     
     @staticmethod
     def _generate_id(content: str) -> str:
@@ -67,56 +256,347 @@ class Document:
 
 
 class KnowledgeGraph:
-    """知识图谱"""
+    """知识图谱
+    
+    同一 (起点, 终点, 类型) 的关系只有一条，重复添加时累加权重并记录支持它的文档；
+    无向的关系类型（如共现）两端按名称排序后作为键。
+    实体记录提及它的文档，删除文档时递减实体和关系的引用，
+    不再被任何文档支持的关系、以及没有文档也没有关系的实体随之回收。
+    """
+    
+    SYMMETRIC_TYPES = {"co_occurrence"}
     
     def __init__(self):
-        self.entities = {}  # 实体: {name: {type, properties, related}}
-        self.relationships = []  # 关系: [{from, to, type, properties}]
+        self.entities = {}  # 实体: {name: {type, properties, related, docs}}
+        self.mentions: Dict[str, set] = {}  # 文档ID -> 提及的实体名（实体 docs 的反向索引）
+        # 关系: [{from, to, type, weight, docs, properties, created_at, updated_at}]，
+        # 列表下标即关系ID，docs 为支持该关系的文档ID集合
+        self.relationships = []
+        self.edge_ids: Dict[tuple, int] = {}  # (起点, 终点, 类型) -> 关系ID
+        # 邻接索引：实体 -> 以它为起点/终点的关系ID（升序），按实体查关系只需 O(度数)
+        self.out_edges: Dict[str, List[int]] = {}
+        self.in_edges: Dict[str, List[int]] = {}
+        
+        # 只读 CSR 视图（多跳遍历用），版本号与图谱不一致时重新建立
+        self.version = 0
+        self._view: Optional[GraphView] = None
+        
+        # 变更跟踪（供按行写入的存储引擎使用）
+        self.track_changes = False
+        self._changed_entities = set()
+        self._changed_edges = set()
+        self._removed_entities = set()
+        self._removed_edges = []  # 被回收关系的 (起点, 终点, 类型)
+        self._changed_mentions = set()  # 提及的实体有变化的文档ID
+        # 关系支持文档的增减：(起点, 终点, 类型, 文档ID) -> 是否支持（同一批内以最后一次为准）
+        self._changed_edge_docs: Dict[tuple, bool] = {}
     
-    def add_entity(self, name: str, entity_type: str, properties: Dict = None):
-        """添加实体"""
+    def add_entity(self, name: str, entity_type: str, properties: Dict = None,
+                   doc_id: str = None):
+        """添加实体，doc_id 为提及该实体的文档"""
         if name not in self.entities:
             self.entities[name] = {
                 "type": entity_type,
                 "properties": properties or {},
-                "related": set()
+                "related": set(),
+                "docs": set()
             }
+            self.version += 1
+            if self.track_changes:
+                self._changed_entities.add(name)
+        if doc_id is not None:
+            self._mention(name, doc_id)
+    
+    def _mention(self, name: str, doc_id: str):
+        """记录文档提及了实体"""
+        docs = self.entities[name]["docs"]
+        if doc_id not in docs:
+            docs.add(doc_id)
+            self.mentions.setdefault(doc_id, set()).add(name)
+            if self.track_changes:
+                self._changed_mentions.add(doc_id)
     
     def add_relationship(self, 
                         from_entity: str, 
                         to_entity: str, 
                         rel_type: str,
-                        properties: Dict = None):
-        """添加关系"""
+                        properties: Dict = None,
+                        doc_id: str = None,
+                        created_at: str = None) -> Dict:
+        """添加关系（已存在则累加权重），返回关系
+        
+        doc_id 为支持该关系的文档：同一文档重复添加同一关系不会重复计权，
+        两端实体也记为被该文档提及（删除文档时据此找到它支持的关系）。
+        """
+        if rel_type in self.SYMMETRIC_TYPES and to_entity < from_entity:
+            from_entity, to_entity = to_entity, from_entity
+        
         # 确保实体存在
-        if from_entity not in self.entities:
-            self.add_entity(from_entity, "unknown")
-        if to_entity not in self.entities:
-            self.add_entity(to_entity, "unknown")
-        
-        # 添加关系
-        relationship = {
-            "from": from_entity,
-            "to": to_entity,
-            "type": rel_type,
-            "properties": properties or {},
-            "created_at": datetime.now().isoformat()
-        }
-        self.relationships.append(relationship)
+        self.add_entity(from_entity, "unknown", doc_id=doc_id)
+        self.add_entity(to_entity, "unknown", doc_id=doc_id)
+        
+        now = datetime.now().isoformat()
+        edge_id = self.edge_ids.get((from_entity, to_entity, rel_type))
+        if edge_id is None:
+            relationship = {
+                "from": from_entity,
+                "to": to_entity,
+                "type": rel_type,
+                "weight": 0,
+                "docs": set(),
+                "properties": properties or {},
+                "created_at": created_at or now,
+                "updated_at": created_at or now
+            }
+            edge_id = len(self.relationships)
+            self.relationships.append(relationship)
+            self._index_edge(edge_id, relationship)
+            
+            # 更新实体的关联
+            self.entities[from_entity]["related"].add(to_entity)
+            self.entities[to_entity]["related"].add(from_entity)
+        else:
+            relationship = self.relationships[edge_id]
+            if doc_id is not None and doc_id in relationship["docs"]:
+                return relationship
+            if properties:
+                relationship["properties"].update(properties)
+            relationship["updated_at"] = created_at or now
+        
+        relationship["weight"] += 1
+        self.version += 1
+        if doc_id is not None:
+            relationship["docs"].add(doc_id)
+            if self.track_changes:
+                self._changed_edge_docs[(from_entity, to_entity, rel_type, doc_id)] = True
+        if self.track_changes:
+            self._changed_edges.add(edge_id)
+        return relationship
+    
+    def _index_edge(self, edge_id: int, rel: Dict):
+        """把关系ID加入键表和两端实体的邻接表"""
+        self.edge_ids[(rel["from"], rel["to"], rel["type"])] = edge_id
+        self.out_edges.setdefault(rel["from"], []).append(edge_id)
+        self.in_edges.setdefault(rel["to"], []).append(edge_id)
+    
+    def remove_document(self, doc_id: str) -> Dict:
+        """撤销文档对图谱的引用，回收孤立的关系和实体，返回回收数量
+        
+        文档支持的关系都在它提及的实体之间，只需检查这些实体的邻接表。
+        """
+        names = self.mentions.pop(doc_id, None)
+        if not names:
+            return {"entities": 0, "relationships": 0}
+        if self.track_changes:
+            self._changed_mentions.add(doc_id)
+        self.version += 1
         
-        # 更新实体的关联
-        self.entities[from_entity]["related"].add(to_entity)
-        self.entities[to_entity]["related"].add(from_entity)
+        # 从邻接表较短的一侧查找两端都在 names 中、由该文档支持的关系
+        out_total = sum(len(self.out_edges.get(name, ())) for name in names)
+        in_total = sum(len(self.in_edges.get(name, ())) for name in names)
+        adjacency, other = (self.out_edges, "to") if out_total <= in_total else (self.in_edges, "from")
+        orphaned = []
+        for name in names:
+            for edge_id in adjacency.get(name, ()):
+                rel = self.relationships[edge_id]
+                if rel[other] not in names or doc_id not in rel["docs"]:
+                    continue
+                rel["docs"].discard(doc_id)
+                rel["weight"] -= 1
+                if self.track_changes:
+                    self._changed_edge_docs[(rel["from"], rel["to"], rel["type"], doc_id)] = False
+                if rel["weight"] <= 0:
+                    orphaned.append(edge_id)
+                elif self.track_changes:
+                    self._changed_edges.add(edge_id)
+        # 从大到小移除：被换到空位上的末尾关系一定不在待移除之列
+        for edge_id in sorted(orphaned, reverse=True):
+            self._remove_edge(edge_id)
+        
+        removed_entities = 0
+        for name in names:
+            entity = self.entities.get(name)
+            if entity is None:
+                continue
+            entity["docs"].discard(doc_id)
+            if not entity["docs"] and not self.out_edges.get(name) and not self.in_edges.get(name):
+                self._remove_entity(name)
+                removed_entities += 1
+        
+        return {"entities": removed_entities, "relationships": len(orphaned)}
+    
+    def _remove_edge(self, edge_id: int):
+        """移除关系：末尾的关系移到空出的位置，邻接表保持升序"""
+        rel = self.relationships[edge_id]
+        src, dst = rel["from"], rel["to"]
+        key = (src, dst, rel["type"])
+        del self.edge_ids[key]
+        for adjacency, name in ((self.out_edges, src), (self.in_edges, dst)):
+            ids = adjacency[name]
+            del ids[bisect.bisect_left(ids, edge_id)]
+            if not ids:
+                del adjacency[name]
+        
+        self._changed_edges.discard(edge_id)
+        last = len(self.relationships) - 1
+        if edge_id != last:
+            moved = self.relationships[last]
+            self.relationships[edge_id] = moved
+            self.edge_ids[(moved["from"], moved["to"], moved["type"])] = edge_id
+            for ids in (self.out_edges[moved["from"]], self.in_edges[moved["to"]]):
+                ids.pop()  # 末尾关系的ID在邻接表中总是最大的
+                bisect.insort(ids, edge_id)
+            if last in self._changed_edges:
+                self._changed_edges.discard(last)
+                self._changed_edges.add(edge_id)
+        self.relationships.pop()
+        if self.track_changes:
+            self._removed_edges.append(key)
+        
+        # 两个实体之间已没有其他关系时，解除 related
+        if src != dst and not self._connected(src, dst):
+            for a, b in ((src, dst), (dst, src)):
+                if a in self.entities:
+                    self.entities[a]["related"].discard(b)
+    
+    def _connected(self, a: str, b: str) -> bool:
+        """a 与 b 之间是否还有任一方向、任一类型的关系（从度数较小的一端查找）"""
+        if len(self.out_edges.get(a, ())) + len(self.in_edges.get(a, ())) > \
+                len(self.out_edges.get(b, ())) + len(self.in_edges.get(b, ())):
+            a, b = b, a
+        relationships = self.relationships
+        return (any(relationships[i]["to"] == b for i in self.out_edges.get(a, ()))
+                or any(relationships[i]["from"] == b for i in self.in_edges.get(a, ())))
+    
+    def _remove_entity(self, name: str):
+        entity = self.entities.pop(name)
+        for other in entity["related"]:
+            if other in self.entities:
+                self.entities[other]["related"].discard(name)
+        self._changed_entities.discard(name)
+        if self.track_changes:
+            self._removed_entities.add(name)
+    
+    def get_entity_documents(self, name: str) -> List[str]:
+        """提及实体的文档ID（按ID排序），实体不存在时为空"""
+        entity = self.entities.get(name)
+        return sorted(entity["docs"]) if entity else []
+    
+    def infer_entity_docs(self):
+        """迁移旧数据：旧版实体只在 properties 中记录首个来源文档，
+        补全为 source_doc 与相连关系的支持文档之并"""
+        for name, entity in self.entities.items():
+            docs = entity["docs"]
+            source_doc = entity["properties"].pop("source_doc", None)
+            entity["properties"].pop("frequency", None)
+            if source_doc:
+                docs.add(source_doc)
+            for edge_id in self.out_edges.get(name, ()):
+                docs.update(self.relationships[edge_id]["docs"])
+            for edge_id in self.in_edges.get(name, ()):
+                docs.update(self.relationships[edge_id]["docs"])
+        self.rebuild_mentions()
+    
+    def rebuild_mentions(self):
+        """由实体的 docs 重建文档 -> 实体的反向索引"""
+        self.mentions = {}
+        for name, entity in self.entities.items():
+            for doc_id in entity["docs"]:
+                self.mentions.setdefault(doc_id, set()).add(name)
+    
+    def rebuild_adjacency(self):
+        """根据关系列表重建键表和邻接索引"""
+        self.version += 1
+        self.edge_ids = {}
+        self.out_edges = {}
+        self.in_edges = {}
+        for edge_id, rel in enumerate(self.relationships):
+            self._index_edge(edge_id, rel)
+    
+    def merge_relationships(self, relationships: Iterable[Dict]) -> int:
+        """把旧格式的关系（每次共现一条，文档ID在 properties 中）合并为带权重的关系，
+        返回合并后的关系数"""
+        for rel in relationships:
+            properties = dict(rel.get("properties") or {})
+            doc_id = properties.pop("doc_id", None)
+            self.add_relationship(
+                rel["from"], rel["to"], rel["type"], properties,
+                doc_id=doc_id, created_at=rel.get("created_at")
+            )
+        return len(self.relationships)
     
     def get_entity(self, name: str) -> Optional[Dict]:
         """获取实体"""
         return self.entities.get(name)
     
-    def get_related_entities(self, name: str, max_depth: int = 1) -> List[str]:
-        """获取关联实体"""
+    def graph_view(self) -> Optional[GraphView]:
+        """图谱的 CSR 视图（未安装 numpy 时为 None），图谱变化后首次调用时重建"""
+        if not graph_view_available():
+            return None
+        if self._view is None or self._view.version != self.version:
+            self._view = GraphView.build(self.entities, self.relationships, self.version)
+        return self._view
+    
+    def update_centrality(self,
+                          damping: float = KB_PAGERANK_DAMPING,
+                          tol: float = KB_PAGERANK_TOL,
+                          max_iter: int = KB_PAGERANK_MAX_ITER) -> Dict:
+        """计算各实体的 PageRank 和加权度数，写入实体的 pagerank / degree 字段
+        
+        已有得分时以其为初值（新实体取均匀值），图谱增量变化后只需少量迭代。
+        结果中的 changed 为得分有变化的实体名：PageRank 变化不超过
+        收敛阈值按实体数均摊的份额（tol / n）时视为未变，不更新字段，持久化时也不必重写。
+        """
+        view = self.graph_view()
+        if view is None:
+            raise RuntimeError("计算实体重要度需要安装 numpy")
+        
+        start = time.perf_counter()
+        initial = [self.entities[name].get("pagerank", 0.0) for name in view.names]
+        warm_start = any(initial)
+        scores, iterations = view.pagerank(damping, tol, max_iter,
+                                           initial if warm_start else None)
+        degrees = view.weighted_degree()
+        
+        threshold = tol / max(len(view), 1)
+        changed = []
+        for name, score, degree in zip(view.names, scores.tolist(), degrees.tolist()):
+            entity = self.entities[name]
+            if "pagerank" not in entity or abs(score - entity["pagerank"]) > threshold or \
+                    degree != entity.get("degree", 0.0):
+                entity["pagerank"] = score
+                entity["degree"] = degree
+                changed.append(name)
+        view.scores = scores  # 得分不改变图结构，视图无需重建
+        
+        return {
+            "entities": len(view),
+            "changed": changed,
+            "iterations": iterations,
+            "warm_start": warm_start,
+            "seconds": time.perf_counter() - start
+        }
+    
+    def _by_rank(self, names: Iterable[str]) -> List[str]:
+        """按重要度从高到低排列实体名（未计算过的排在后面，同分按名称）"""
+        entities = self.entities
+        return sorted(names, key=lambda name: (-entities[name].get("pagerank", 0.0), name))
+    
+    def get_related_entities(self, name: str, max_depth: int = 1,
+                             limit: Optional[int] = KB_GRAPH_MAX_RESULTS) -> List[str]:
+        """获取 max_depth 跳以内的关联实体，最多 limit 个，重要的排在前面
+        
+        多跳时使用 CSR 视图逐层向量化扩展（按跳数、重要度、关系权重排序）；
+        一跳或未安装 numpy 时直接取实体的 related 集合按重要度排序。
+        """
         if name not in self.entities:
             return []
         
+        if max_depth > 1:
+            view = self.graph_view()
+            if view is not None:
+                return view.k_hop(name, max_depth, limit)
+        
         related = set()
         current_level = {name}
         
@@ -129,10 +609,11 @@ class KnowledgeGraph:
             current_level = next_level
         
         related.discard(name)  # 移除自己
-        return list(related)
+        related.intersection_update(self.entities)
+        return self._by_rank(related)[:limit]
     
     def search_entities(self, query: str, entity_type: str = None) -> List[str]:
-        """搜索实体"""
+        """搜索名称包含 query 的实体，按重要度从高到低"""
         results = []
         query_lower = query.lower()
         
@@ -145,15 +626,44 @@ class KnowledgeGraph:
             if query_lower in name.lower():
                 results.append(name)
         
-        return results
+        return self._by_rank(results)
     
     def get_entity_relationships(self, entity_name: str) -> List[Dict]:
-        """获取实体的所有关系"""
-        relationships = []
-        for rel in self.relationships:
-            if rel["from"] == entity_name or rel["to"] == entity_name:
-                relationships.append(rel)
-        return relationships
+        """获取实体的所有关系（按添加顺序）"""
+        outgoing = self.out_edges.get(entity_name, ())
+        incoming = self.in_edges.get(entity_name, ())
+        if not incoming:
+            edge_ids = outgoing
+        elif not outgoing:
+            edge_ids = incoming
+        else:
+            edge_ids = sorted(set(outgoing).union(incoming))  # 自环在两个表中各出现一次
+        return [self.relationships[edge_id] for edge_id in edge_ids]
+    
+    def drain_changes(self) -> Dict:
+        """取出并清空自上次调用以来的变更
+        
+        entities / relationships: 新增或更新的实体名和关系；
+        removed_entities / removed_relationships: 被回收的实体名和关系键；
+        documents: 提及的实体有变化的文档ID；
+        edge_docs: {(起点, 终点, 类型, 文档ID): 是否支持}，关系支持文档的增减。
+        """
+        changes = {
+            "entities": self._changed_entities,
+            "relationships": [self.relationships[edge_id]
+                              for edge_id in sorted(self._changed_edges)],
+            "removed_entities": self._removed_entities,
+            "removed_relationships": self._removed_edges,
+            "documents": self._changed_mentions,
+            "edge_docs": self._changed_edge_docs
+        }
+        self._changed_entities = set()
+        self._changed_edges = set()
+        self._removed_entities = set()
+        self._removed_edges = []
+        self._changed_mentions = set()
+        self._changed_edge_docs = {}
+        return changes
     
     def to_dict(self) -> Dict:
         """转换为字典"""
@@ -162,11 +672,19 @@ class KnowledgeGraph:
         for name, entity in self.entities.items():
             entity_copy = entity.copy()
             entity_copy["related"] = list(entity_copy["related"])
+            entity_copy["docs"] = sorted(entity_copy["docs"])
             entities_dict[name] = entity_copy
         
+        relationships = []
+        for rel in self.relationships:
+            rel_copy = rel.copy()
+            rel_copy["docs"] = sorted(rel_copy["docs"])
+            relationships.append(rel_copy)
+        
         return {
             "entities": entities_dict,
-            "relationships": self.relationships
+            "relationships": relationships,
+            "adjacency": {"out": self.out_edges, "in": self.in_edges}
         }
     
     @classmethod
@@ -174,33 +692,157 @@ class KnowledgeGraph:
         """从字典创建"""
         kg = cls()
         
-        # 恢复实体
+        # 恢复实体（旧快照的实体没有 docs，在关系恢复后补全）
+        legacy_entities = False
         for name, entity in data.get("entities", {}).items():
             entity_copy = entity.copy()
             entity_copy["related"] = set(entity_copy["related"])
+            legacy_entities = legacy_entities or "docs" not in entity_copy
+            entity_copy["docs"] = set(map(sys.intern, entity_copy.get("docs", ())))
             kg.entities[name] = entity_copy
         
-        # 恢复关系
-        kg.relationships = data.get("relationships", [])
+        relationships = data.get("relationships", [])
+        if relationships and "weight" not in relationships[0]:
+            # 旧快照：每次共现一条关系，合并重复的关系
+            merged = kg.merge_relationships(relationships)
+            print(f"🔧 已将 {len(relationships)} 条关系合并为 {merged} 条带权重的关系")
+        else:
+            # 恢复关系和邻接索引（旧快照没有邻接索引，或与关系数不符时重建）
+            # 同一文档ID在各实体和关系中只保留一个字符串对象
+            for rel in relationships:
+                rel["docs"] = set(map(sys.intern, rel.get("docs", ())))
+            kg.relationships = relationships
+            adjacency = data.get("adjacency")
+            if adjacency and sum(map(len, adjacency.get("out", {}).values())) == len(relationships):
+                kg.out_edges = adjacency["out"]
+                kg.in_edges = adjacency.get("in", {})
+                kg.edge_ids = {
+                    (rel["from"], rel["to"], rel["type"]): edge_id
+                    for edge_id, rel in enumerate(relationships)
+                }
+            else:
+                kg.rebuild_adjacency()
+        
+        if legacy_entities:
+            kg.infer_entity_docs()
+            print(f"🔧 已为 {len(kg.entities)} 个实体补全提及它的文档")
+        else:
+            kg.rebuild_mentions()
         
         return kg
 
 
+class QueryCache:
+    """检索结果的LRU缓存
+    
+    键中包含知识库的写版本号，任何增删改都会让版本号递增，
+    旧版本的条目因此不会再被命中，随后按LRU顺序被淘汰。
+    """
+    
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: tuple, compute):
+        """命中则返回缓存值，否则调用 compute() 计算并缓存"""
+        if self.max_size <= 0:
+            return compute()
+        
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
 class KnowledgeBase:
     """个人知识库"""
     
-    def __init__(self, kb_dir: Path = None):
-        self.kb_dir = kb_dir or DATA_DIR / "knowledge_base"
+    TITLE_BOOST = 2.0  # 标题匹配的BM25分数权重
+    SEARCH_MODES = ("keyword", "semantic", "hybrid")
+    RRF_K = 60  # 倒数排名融合的平滑常数
+    HYBRID_DEPTH = 50  # 混合检索中每种排序参与融合的候选数
+    
+    def __init__(self,
+                 kb_dir: Path = None,
+                 storage: str = KB_STORAGE_BACKEND,
+                 compact_threshold: int = KB_JOURNAL_COMPACT_THRESHOLD,
+                 embedding_dim: int = KB_EMBEDDING_DIM,
+                 positional: bool = KB_POSITIONAL_INDEX,
+                 tokenizer: str = None):
+        self.kb_dir = kb_dir or KB_DIR
         self.kb_dir.mkdir(exist_ok=True, parents=True)
+        self.embedding_dim = embedding_dim
+        self.positional = positional
         
-        self.documents: Dict[str, Document] = {}
-        self.knowledge_graph = KnowledgeGraph()
-        self.categories = {}  # 分类: {category: [doc_ids]}
-        self.index = {}  # 倒排索引: {word: [doc_ids]}
+        # 分词器：未指定时沿用已有索引记录的分词器（新知识库用 KB_TOKENIZER）
+        self.requested_tokenizer = tokenizer
+        self.tokenizer = get_tokenizer(tokenizer or KB_TOKENIZER)
+        self._pending_tokenizer: Optional[Tokenizer] = None  # 加载后需切换到的分词器
+        self.vectors: Optional[VectorStore] = None  # 嵌入矩阵（未安装numpy时为None）
+        
+        # 写版本号：每次增删改递增，检索缓存的键包含它
+        self.write_version = 0
+        self.query_cache = QueryCache(KB_QUERY_CACHE_SIZE)
+        
+        # 存储引擎：json（快照 + 操作日志）或 sqlite
+        if storage == "json":
+            self.storage = JsonStorage(self.kb_dir, compact_threshold)
+        elif storage == "sqlite":
+            self.storage = SQLiteStorage(self.kb_dir)
+        else:
+            raise ValueError(f"未知的存储引擎: {storage}")
+        
+        self._reset()
         
         # 加载知识库
         self.load()
     
+    def _reset(self):
+        """清空内存状态"""
+        self.documents: Dict[str, Document] = {}
+        self.knowledge_graph = KnowledgeGraph()
+        self.categories = {}  # 分类: {category: [doc_ids]}
+        self.doc_map = DocIdMap()  # doc_id <-> 整数文档号
+        self.index = InvertedIndex()  # 正文倒排索引
+        self.title_index = InvertedIndex()  # 标题倒排索引
+        # 正文词位置索引（用于短语查询，可关闭）
+        self.positions: Optional[PositionIndex] = (
+            self.storage.new_position_index(self) if self.positional else None
+        )
+        self.category_facets = FacetIndex()  # 分类 -> 文档号位图
+        self.tag_facets = FacetIndex()  # 标签 -> 文档号位图
+        self.passage_map = DocIdMap()  # 段落ID（doc_id@起始:结束）<-> 段落号
+        self.passage_index = InvertedIndex()  # 段落倒排索引
+        self.doc_passages: Dict[str, List[int]] = {}  # doc_id -> 段落号列表
+    
     # ============== 文档管理 ==============
     
     def add_document(self, 
@@ -210,6 +852,72 @@ class KnowledgeBase:
                      tags: List[str] = None,
                      source: str = None) -> str:
         """添加文档"""
+        doc = self._new_document(content, title, category, tags, source)
+        
+        self._apply_add(doc)
+        
+        # 持久化（只追加一条日志）
+        self._record({"op": "add", "doc": doc.to_dict()})
+        
+        return doc.doc_id
+    
+    def add_documents(self,
+                      documents: Iterable[Dict],
+                      commit_every: int = KB_IMPORT_COMMIT_EVERY,
+                      on_commit: Callable[[List[Document]], None] = None) -> List[str]:
+        """批量添加文档
+        
+        documents 中每一项是 add_document 的参数字典（content 必填），
+        可附带 analyze_document 的预计算结果 "analysis"。
+        分类和索引在内存中逐篇更新，知识提取推迟到提交时统一进行，
+        每 commit_every 篇（以及最后）才持久化一次，每次持久化后以该批文档调用 on_commit。
+        """
+        doc_ids = []
+        pending = []
+        
+        for item in documents:
+            doc = self._new_document(
+                item["content"],
+                item.get("title"),
+                item.get("category", "未分类"),
+                item.get("tags"),
+                item.get("source")
+            )
+            analysis = item.get("analysis")
+            self._apply_add(doc, extract=False, analysis=analysis)
+            pending.append((doc, analysis))
+            doc_ids.append(doc.doc_id)
+            
+            if commit_every and len(pending) >= commit_every:
+                self._commit_batch(pending, on_commit)
+                pending = []
+        
+        if pending:
+            self._commit_batch(pending, on_commit)
+        
+        return doc_ids
+    
+    def _commit_batch(self, pending: List[tuple],
+                      on_commit: Callable[[List[Document]], None] = None):
+        """提取一批文档的知识并一次性持久化"""
+        for doc, analysis in pending:
+            if analysis:
+                self._add_knowledge(doc, analysis["keywords"])
+            else:
+                self._extract_knowledge(doc)
+        self._record_batch([
+            {"op": "add", "doc": doc.to_dict()} for doc, _ in pending
+        ])
+        if on_commit is not None:
+            on_commit([doc for doc, _ in pending])
+    
+    def _new_document(self,
+                      content: str,
+                      title: str = None,
+                      category: str = "未分类",
+                      tags: List[str] = None,
+                      source: str = None) -> Document:
+        """创建文档对象（不加入知识库）"""
         metadata = {
             "title": title or f"文档_{len(self.documents) + 1}",
             "category": category,
@@ -223,69 +931,133 @@ class KnowledgeBase:
             for tag in tags:
                 doc.add_tag(tag)
         
+        return doc
+    
+    def _apply_add(self, doc: Document, extract: bool = True,
+                   analysis: Dict = None):
+        """在内存中应用新增文档"""
+        self.write_version += 1
         # 保存文档
         self.documents[doc.doc_id] = doc
         
         # 更新分类
+        category = doc.metadata.get("category", "未分类")
         if category not in self.categories:
             self.categories[category] = []
         self.categories[category].append(doc.doc_id)
         
         # 更新索引
-        self._update_index(doc)
+        self._update_index(doc, analysis)
+        self._index_facets(doc)
         
         # 自动提取知识（简单实现）
-        self._extract_knowledge(doc)
-        
-        # 持久化
-        self.save()
-        
-        return doc.doc_id
+        if extract:
+            self._extract_knowledge(doc)
     
     def get_document(self, doc_id: str) -> Optional[Document]:
         """获取文档"""
-        return self.documents.get(doc_id)
+        doc = self.documents.get(doc_id)
+        if doc is not None and doc.embedding is None and self.vectors is not None:
+            doc.embedding = self.vectors.get(doc_id)
+        return doc
     
     def update_document(self, doc_id: str, content: str = None, **metadata):
         """更新文档"""
+        return self._update_document(doc_id, content, metadata)
+    
+    def _update_document(self, doc_id: str, content: Optional[str], metadata: Dict,
+                         analysis: Dict = None) -> bool:
+        """更新文档并持久化，analysis 为新正文的预计算分析结果（可选）"""
         if doc_id not in self.documents:
             return False
         
+        updated_at = datetime.now().isoformat()
+        self._apply_update(doc_id, content, metadata, updated_at, analysis)
+        
+        self._record({
+            "op": "update",
+            "doc_id": doc_id,
+            "content": content,
+            "metadata": metadata,
+            "updated_at": updated_at
+        })
+        return True
+    
+    def _apply_update(self, doc_id: str, content: Optional[str],
+                      metadata: Dict, updated_at: str, analysis: Dict = None):
+        """在内存中应用文档更新（analysis 只在 content 变化时使用）"""
+        self.write_version += 1
         doc = self.documents[doc_id]
+        # 写回存储层的文档表：提交之前不会被缓存挤掉
+        self.documents[doc_id] = doc
         
         if content:
             doc.content = content
-            self._update_index(doc)
         
         if metadata:
+            old_category = doc.metadata.get("category", "未分类")
             doc.metadata.update(metadata)
+            if "category" in metadata and metadata["category"] != old_category:
+                self._move_category(doc, old_category)
         
-        doc.updated_at = datetime.now().isoformat()
-        self.save()
-        return True
+        # 只重新统计变化了的字段
+        fields = []
+        if content:
+            fields.append("content")
+        if "title" in metadata:
+            fields.append("title")
+        if not content:
+            analysis = None
+        if fields:
+            self._update_index(doc, analysis, fields=fields)
+        if content:
+            # 正文变化后关键词可能不同：撤销旧的引用再重新提取
+            self.knowledge_graph.remove_document(doc_id)
+            if analysis:
+                self._add_knowledge(doc, analysis["keywords"])
+            else:
+                self._extract_knowledge(doc)
+        
+        doc.updated_at = updated_at
     
     def delete_document(self, doc_id: str) -> bool:
         """删除文档"""
         if doc_id not in self.documents:
             return False
         
+        self._apply_delete(doc_id)
+        
+        self._record({"op": "delete", "doc_id": doc_id})
+        return True
+    
+    def _apply_delete(self, doc_id: str):
+        """在内存中应用文档删除"""
+        self.write_version += 1
         doc = self.documents[doc_id]
         
         # 从分类中移除
         category = doc.metadata.get("category", "未分类")
-        if category in self.categories:
-            self.categories[category].remove(doc.id)
+        if category in self.categories and doc_id in self.categories[category]:
+            self.categories[category].remove(doc_id)
         
         # 从索引中移除
-        for word in self._tokenize(doc.content):
-            if word in self.index and doc_id in self.index[word]:
-                self.index[word].remove(doc_id)
+        num = self.doc_map.get(doc_id)
+        if num is not None:
+            self.category_facets.discard(category, num)
+            for tag in doc.tags:
+                self.tag_facets.discard(tag, num)
+            self.index.remove(num)
+            self.title_index.remove(num)
+            if self.positions is not None:
+                self.positions.remove(num)
+            self.doc_map.release(doc_id)
+        self._remove_passages(doc_id)
+        if self.vectors is not None:
+            self.vectors.delete(doc_id)
+        self.knowledge_graph.remove_document(doc_id)
         
         # 删除文档
         del self.documents[doc_id]
-        
-        self.save()
-        return True
     
     # ============== 搜索功能 ==============
     
@@ -293,95 +1065,639 @@ class KnowledgeBase:
                query: str, 
                category: str = None,
                tags: List[str] = None,
-               limit: int = 10) -> List[Document]:
-        """搜索文档"""
+               limit: int = 10,
+               mode: str = "keyword",
+               match_all_tags: bool = False) -> List[Document]:
+        """搜索文档
+        
+        mode="keyword": BM25，只遍历查询词的倒排表；
+        mode="semantic": 本地嵌入的余弦相似度（需要 numpy）；
+        mode="hybrid": 两者并发执行后用倒数排名融合（见 hybrid_search）。
+        
+        tags 默认匹配任一标签，match_all_tags=True 时要求包含全部标签。
+        分类和标签过滤先在位图上求出候选文档号集合，打分只涉及集合内的文档。
+        结果按 (查询, 过滤条件, 数量, 模式, 写版本号) 缓存。
+        """
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"未知的搜索模式: {mode}")
+        
+        def compute():
+            allowed = self._filter_bitmap(category, tags, match_all_tags)
+            if mode == "semantic":
+                docs = self._semantic_search(query, allowed, limit)
+            elif mode == "hybrid":
+                docs = self._hybrid_search(query, allowed, limit)["results"]
+            else:
+                docs = [
+                    self.documents[doc_id]
+                    for doc_id, score in self._keyword_ranking(query, limit, allowed)
+                    if doc_id in self.documents
+                ]
+            return [doc.doc_id for doc in docs]
+        
+        key = self._cache_key("search", query, category, tags, match_all_tags, limit, mode)
+        return self._load_documents(self.query_cache.get(key, compute))
+    
+    def _cache_key(self, kind: str, query: str, category: Optional[str],
+                   tags: Optional[List[str]], match_all_tags: bool, *options) -> tuple:
+        """检索缓存键：规范化查询（小写、合并空白）+ 过滤条件 + 选项 + 写版本号"""
+        return (
+            kind,
+            self.write_version,
+            " ".join(query.lower().split()),
+            category or None,
+            tuple(sorted(set(tags))) if tags else (),
+            bool(match_all_tags) and bool(tags) and len(set(tags)) > 1,
+        ) + options
+    
+    def _load_documents(self, doc_ids: List[str]) -> List[Document]:
+        docs = []
+        for doc_id in doc_ids:
+            doc = self.documents.get(doc_id)
+            if doc is not None:
+                docs.append(doc)
+        return docs
+    
+    def _filter_bitmap(self, category: str = None, tags: List[str] = None,
+                       match_all_tags: bool = False) -> Optional[Bitmap]:
+        """分类/标签过滤对应的文档号位图，无过滤条件时返回 None"""
+        bitmaps = []
+        if category:
+            bitmaps.append(self.category_facets.get(category))
+        if tags:
+            bitmaps.append(self.tag_facets.select(tags, match_all_tags))
+        return intersect_bitmaps(*bitmaps) if bitmaps else None
+    
+    def _keyword_ranking(self, query: str, limit: int,
+                         allowed: Bitmap = None) -> List[tuple]:
+        """BM25 前 limit 名（正文 + 加权标题），返回按分数降序的 [(doc_id, 分数)]
+        
+        一般情况用 MaxScore 动态剪枝（见 kb_index.top_k），常见词不必逐条打分；
+        过滤集合很小时直接对集合内的文档打分，再用堆取前 limit 名。
+        布尔/短语查询改由 _boolean_ranking 处理。
+        """
+        if is_boolean_query(query):
+            return self._boolean_ranking(query, limit, allowed)
+        
+        query_words = self._query_words(query)
+        if not query_words:
+            return []
+        
+        if allowed is not None and len(allowed) * InvertedIndex.PROBE_RATIO < len(self.doc_map):
+            scores = self.index.bm25(query_words, allowed)
+            
+            # 标题匹配加权
+            for num, title_score in self.title_index.bm25(query_words, allowed).items():
+                scores[num] = scores.get(num, 0.0) + title_score * self.TITLE_BOOST
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+        else:
+            scorers = (self.index.scorers(query_words)
+                       + self.title_index.scorers(query_words, self.TITLE_BOOST))
+            ranked = top_k(scorers, limit, allowed)
+        
+        ranking = []
+        for num, score in ranked:
+            doc_id = self.doc_map.lookup(num)
+            if doc_id:
+                ranking.append((doc_id, score))
+        return ranking
+    
+    def _boolean_ranking(self, query: str, limit: int,
+                         allowed: Bitmap = None) -> List[tuple]:
+        """布尔/短语查询（语法见 kb_query）
+        
+        先在正文+标题的倒排表上求出精确匹配的文档集合，短语用位置索引校验相邻，
+        再只对集合内的文档做BM25打分排序，不必给大量部分匹配的文档打分。
+        """
+        node = parse_query(query, self._tokenize)
+        if node is None:
+            return []
+        
+        evaluator = QueryEvaluator(self._term_docs, self._all_docs, self._has_phrase)
+        matched = Bitmap()
+        for num in evaluator.evaluate(node):
+            if allowed is None or num in allowed:
+                matched.add(num)
+        if not matched:
+            return []
+        
+        query_words = positive_terms(node)
+        scores = self.index.bm25(query_words, matched)
+        for num, title_score in self.title_index.bm25(query_words, matched).items():
+            scores[num] = scores.get(num, 0.0) + title_score * self.TITLE_BOOST
+        
+        ranking = []
+        for num in heapq.nlargest(limit, matched.members(), key=lambda n: scores.get(n, 0.0)):
+            doc_id = self.doc_map.lookup(num)
+            if doc_id:
+                ranking.append((doc_id, scores.get(num, 0.0)))
+        return ranking
+    
+    def _query_words(self, query: str) -> List[str]:
+        """用于打分的查询词：布尔查询取不在 NOT 之下的词"""
+        if is_boolean_query(query):
+            return positive_terms(parse_query(query, self._tokenize))
+        return list(dict.fromkeys(self._tokenize(query.lower())))
+    
+    def _term_docs(self, term: str):
+        """正文或标题中包含该词的文档号（有序数组）"""
+        return union_sorted(self.index.docs(term), self.title_index.docs(term))
+    
+    def _all_docs(self):
+        """全部文档号（有序数组）"""
+        return array('I', sorted(self.doc_map.nums.values()))
+    
+    def _has_phrase(self, num: int, terms: List[str]) -> bool:
+        """正文或标题中是否有短语（与 _term_docs 一致；没有位置索引时重新分词校验正文）"""
+        doc = self.documents.get(self.doc_map.lookup(num))
+        if self.positions is not None:
+            if self.positions.has_phrase(num, terms):
+                return True
+        elif doc is not None and self._phrase_in_text(doc.content, terms):
+            return True
+        # 标题很短，不建位置索引，直接重新分词
+        title = doc.metadata.get("title") if doc is not None else None
+        return bool(title) and self._phrase_in_text(title, terms)
+    
+    def _phrase_in_text(self, text: str, terms: List[str]) -> bool:
+        """text 分词后短语的各词是否相邻"""
+        wanted = set(terms)
+        positions = {term: [] for term in wanted}
+        for pos, token in enumerate(self._tokenize(text.lower())):
+            if token in wanted:
+                positions[token].append(pos)
+        return phrase_in_positions([positions[term] for term in terms])
+    
+    def _semantic_search(self, query: str, allowed: Bitmap = None,
+                         limit: int = 10) -> List[Document]:
+        """语义检索：查询向量与嵌入矩阵做一次矩阵-向量乘法取 top-k"""
+        return [
+            self.documents[doc_id]
+            for doc_id, _ in self._semantic_ranking(query, limit, allowed)
+            if doc_id in self.documents
+        ]
+    
+    def _semantic_ranking(self, query: str, limit: int,
+                          allowed: Bitmap = None) -> List[tuple]:
+        """语义排序，返回按相似度降序的 [(doc_id, 分数)]"""
+        if self.vectors is None:
+            raise RuntimeError("语义检索需要安装 numpy")
+        
+        if is_boolean_query(query):
+            query_tf = term_frequencies(self._query_words(query))
+        else:
+            query_tf = term_frequencies(self._tokenize(query.lower()))
+        if not query_tf:
+            return []
+        
+        accept = None
+        if allowed is not None:
+            if not allowed:
+                return []
+            nums = self.doc_map.nums
+            
+            def accept(doc_id):
+                num = nums.get(doc_id)
+                return num is not None and num in allowed
+        
+        # 查询词按IDF加权，文档向量只用词频，点积即 TF-IDF 余弦相似度
+        idf = {term: self.index.idf(term) for term in query_tf}
+        query_vec = embed_counts(query_tf, self.vectors.dim, idf)
+        return self.vectors.search(query_vec, limit, accept)
+    
+    def hybrid_search(self,
+                      query: str,
+                      category: str = None,
+                      tags: List[str] = None,
+                      limit: int = 10,
+                      match_all_tags: bool = False) -> Dict:
+        """混合检索：关键词与语义排序并发执行，用倒数排名融合（RRF）合并
+        
+        每种排序取前 HYBRID_DEPTH 个文档，文档得分为 Σ 1/(RRF_K + 名次)。
+        返回 {"results": [Document], "debug": 各阶段耗时(毫秒)和候选数}，
+        命中检索缓存时 debug 中带 cached=True。
+        """
+        computed = False
+        
+        def compute():
+            nonlocal computed
+            computed = True
+            allowed = self._filter_bitmap(category, tags, match_all_tags)
+            hybrid = self._hybrid_search(query, allowed, limit)
+            return [doc.doc_id for doc in hybrid["results"]], hybrid["debug"]
+        
+        key = self._cache_key("hybrid", query, category, tags, match_all_tags, limit)
+        doc_ids, debug = self.query_cache.get(key, compute)
+        if not computed:
+            # 命中缓存：各阶段耗时是最初那次实际检索的耗时
+            debug = dict(debug, cached=True)
+        return {"results": self._load_documents(doc_ids), "debug": debug}
+    
+    def _hybrid_search(self, query: str, allowed: Bitmap = None, limit: int = 10) -> Dict:
+        if self.vectors is None:
+            raise RuntimeError("语义检索需要安装 numpy")
+        
+        depth = max(self.HYBRID_DEPTH, limit)
+        debug = {}
+        
+        def timed(name, func, *args):
+            start = time.perf_counter()
+            ranking = func(*args)[:depth]
+            debug[f"{name}_ms"] = (time.perf_counter() - start) * 1000
+            debug[f"{name}_hits"] = len(ranking)
+            return ranking
+        
+        start = time.perf_counter()
+        # 语义排序在线程中运行（矩阵乘法释放GIL），关键词排序在当前线程；
+        # 过滤只读位图，读取文档留在当前线程完成
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            semantic_future = pool.submit(
+                timed, "semantic", self._semantic_ranking, query, depth, allowed
+            )
+            keyword = timed("keyword", self._keyword_ranking, query, depth, allowed)
+            semantic = semantic_future.result()
+        
+        fuse_start = time.perf_counter()
+        fused = {}
+        for ranking in (keyword, semantic):
+            for rank, (doc_id, _) in enumerate(ranking, 1):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.RRF_K + rank)
+        
         results = []
-        query_words = set(self._tokenize(query.lower()))
+        for doc_id in sorted(fused, key=fused.get, reverse=True):
+            doc = self.documents.get(doc_id)
+            if doc is not None:
+                results.append(doc)
+                if len(results) >= limit:
+                    break
+        debug["fusion_ms"] = (time.perf_counter() - fuse_start) * 1000
+        debug["total_ms"] = (time.perf_counter() - start) * 1000
         
-        for doc_id, doc in self.documents.items():
-            # 分类过滤
-            if category and doc.metadata.get("category") != category:
+        return {"results": results, "debug": debug}
+    
+    def search_passages(self,
+                        query: str,
+                        category: str = None,
+                        tags: List[str] = None,
+                        limit: int = 10,
+                        match_all_tags: bool = False,
+                        per_doc: int = 1) -> List[Dict]:
+        """段落级检索：对段落做BM25打分，返回最匹配的段落及其在原文中的偏移
+        
+        每篇文档最多返回 per_doc 段，结果为
+        [{"doc_id", "title", "start", "end", "text", "score"}]，按分数降序。
+        """
+        key = self._cache_key("passages", query, category, tags, match_all_tags,
+                              limit, per_doc)
+        return [
+            dict(result) for result in self.query_cache.get(
+                key,
+                lambda: self._search_passages(query, category, tags, limit,
+                                              match_all_tags, per_doc)
+            )
+        ]
+    
+    def _search_passages(self, query: str, category: Optional[str], tags: Optional[List[str]],
+                         limit: int, match_all_tags: bool, per_doc: int) -> List[Dict]:
+        query_words = self._query_words(query)
+        if not query_words:
+            return []
+        
+        allowed = self._filter_bitmap(category, tags, match_all_tags)
+        passage_filter = None
+        if allowed is not None and len(allowed) * InvertedIndex.PROBE_RATIO < len(self.doc_map):
+            # 过滤集合很小：换算成段落号位图，打分时只涉及这些段落
+            passage_filter = Bitmap()
+            for num in allowed.members():
+                for passage in self.doc_passages.get(self.doc_map.lookup(num), ()):
+                    passage_filter.add(passage)
+        
+        scores = self.passage_index.bm25(query_words, passage_filter)
+        
+        results = []
+        taken = {}
+        for num, score in sorted(scores.items(), key=lambda x: x[1], reverse=True):
+            doc_id, start, end = self.parse_passage_id(self.passage_map.lookup(num))
+            if taken.get(doc_id, 0) >= per_doc:
                 continue
+            if allowed is not None and passage_filter is None:
+                doc_num = self.doc_map.get(doc_id)
+                if doc_num is None or doc_num not in allowed:
+                    continue
             
-            # 标签过滤
-            if tags and not any(tag in doc.tags for tag in tags):
+            doc = self.documents.get(doc_id)
+            if doc is None:
                 continue
-            
-            # 内容匹配
-            doc_words = set(self._tokenize(doc.content.lower()))
-            score = len(query_words & doc_words) / len(query_words) if query_words else 0
-            
-            # 标题匹配加权
-            if "title" in doc.metadata:
-                title_words = set(self._tokenize(doc.metadata["title"].lower()))
-                title_score = len(query_words & title_words) / len(query_words) if query_words else 0
-                score += title_score * 2  # 标题匹配权重更高
-            
-            if score > 0:
-                results.append((score, doc))
+            taken[doc_id] = taken.get(doc_id, 0) + 1
+            results.append(self._passage_result(doc, start, end, score))
+            if len(results) >= limit:
+                break
+        
+        return results
+    
+    def best_passage(self, doc_id: str, query: str) -> Optional[Dict]:
+        """文档中与查询最匹配的段落（没有匹配时返回第一段）"""
+        doc = self.documents.get(doc_id)
+        passages = self.doc_passages.get(doc_id)
+        if doc is None or not passages:
+            return None
+        
+        query_words = self._query_words(query)
+        scores = {}
+        if query_words:
+            candidates = Bitmap()
+            for num in passages:
+                candidates.add(num)
+            scores = self.passage_index.bm25(query_words, candidates)
+        
+        best = max(scores, key=scores.get) if scores else passages[0]
+        _, start, end = self.parse_passage_id(self.passage_map.lookup(best))
+        return self._passage_result(doc, start, end, scores.get(best, 0.0))
+    
+    def snippet(self, doc_id: str, query: str, size: int = KB_SNIPPET_CHARS,
+                markers: tuple = ("**", "**")) -> Optional[Dict]:
+        """搜索结果摘要：以查询词命中最密集的窗口为中心，命中词用 markers 包围
+        
+        命中位置由位置索引中的词序号和词起始偏移直接得到，不重新扫描正文；
+        未启用位置索引时只对最匹配的段落分词定位。
+        返回 {"text", "start", "end", "hits"}，start/end 为摘要在原文中的偏移，
+        hits 为摘要中（合并重叠的 n-gram 后）高亮的命中处数。
+        """
+        doc = self.documents.get(doc_id)
+        if doc is None:
+            return None
         
-        # 按分数排序
-        results.sort(key=lambda x: x[0], reverse=True)
+        terms = set(self._query_words(query))
+        spans = self._hit_spans(doc, terms) if terms else []
+        start, end = densest_window(spans, size, len(doc.content))
+        # 不从英文单词中间截断
+        content = doc.content
+        if 0 < start and content[start - 1].isalnum() and content[start].isalnum():
+            space = content.find(" ", start, start + 15)
+            if space != -1:
+                start = space + 1
+        if end < len(content) and content[end - 1].isalnum() and content[end].isalnum():
+            space = content.rfind(" ", end - 15, end)
+            if space > start:
+                end = space
         
-        return [doc for score, doc in results[:limit]]
+        text = highlight(content, start, end, spans, markers)
+        return {
+            "text": ("…" if start > 0 else "") + text + ("…" if end < len(content) else ""),
+            "start": start,
+            "end": end,
+            "hits": len(merge_spans(spans, start, end))
+        }
+    
+    def _hit_spans(self, doc: Document, terms: set) -> List[tuple]:
+        """查询词在正文中的命中 [(起始, 结束, 词)]，按起始偏移排序"""
+        num = self.doc_map.get(doc.doc_id)
+        if self.positions is not None and num is not None:
+            spans = self.positions.term_spans(num, terms)
+            if spans is not None:
+                return spans
+        
+        # 没有词偏移表：只在最匹配的段落内分词
+        passage = self.best_passage(doc.doc_id, " ".join(terms))
+        base, text = (passage["start"], passage["text"]) if passage else (0, doc.content)
+        tokens, starts = self.tokenizer.tokenize_with_offsets(text)
+        return [
+            (base + offset, base + offset + len(token), token)
+            for token, offset in zip(tokens, starts)
+            if token in terms
+        ]
+    
+    @staticmethod
+    def _passage_result(doc: Document, start: int, end: int, score: float) -> Dict:
+        return {
+            "doc_id": doc.doc_id,
+            "title": doc.metadata.get("title", doc.doc_id),
+            "start": start,
+            "end": end,
+            "text": doc.content[start:end],
+            "score": score
+        }
     
     def _tokenize(self, text: str) -> List[str]:
-        """简单分词（中英文）"""
-        import re
-        # 分离中英文
-        words = []
-        
-        # 英文单词
-        eng_words = re.findall(r'[a-zA-Z]+', text)
-        words.extend([w.lower() for w in eng_words if len(w) > 1])
-        
-        # 中文字符（简单按字符分）
-        chinese_chars = re.findall(r'[\u4e00-\u9fff]+', text)
-        for chars in chinese_chars:
-            # 简单按2-3字切分
-            for i in range(len(chars)):
-                if i + 2 <= len(chars):
-                    words.append(chars[i:i+2])
-                if i + 3 <= len(chars):
-                    words.append(chars[i:i+3])
-        
-        return words
-    
-    def _update_index(self, doc: Document):
-        """更新倒排索引"""
-        words = self._tokenize(doc.content.lower())
-        for word in set(words):  # 去重
-            if word not in self.index:
-                self.index[word] = []
-            if doc.doc_id not in self.index[word]:
-                self.index[word].append(doc.doc_id)
+        """用本知识库的分词器分词"""
+        return self.tokenizer.tokenize(text)
+    
+    def _update_index(self, doc: Document, analysis: Dict = None,
+                      fields: Iterable[str] = ("content", "title")):
+        """更新倒排索引（正文 + 标题）
+        
+        每篇文档只在新增/修改时分词一次，得到的词频向量和文档长度保存在索引中，
+        之后的打分、知识提取和持久化都直接使用，不再重新分词。
+        """
+        num = self.doc_map.intern(doc.doc_id)
+        if "content" in fields:
+            positions = offsets = None
+            if analysis:
+                content_tf = analysis["content_tf"]
+                positions, offsets = analysis.get("positions"), analysis.get("offsets")
+            elif self.positions is not None:
+                tokens, starts = self.tokenizer.tokenize_with_offsets(doc.content)
+                content_tf = term_frequencies(tokens)
+                positions, offsets = token_positions(tokens), encode_offsets(starts)
+            else:
+                content_tf = term_frequencies(self._tokenize(doc.content.lower()))
+            self.index.add_counts(num, content_tf)
+            if self.positions is not None:
+                if offsets is None:
+                    self._index_positions(num, doc)
+                else:
+                    self.positions.add(num, positions, offsets)
+            self._update_passages(doc, analysis)
+        if "title" in fields:
+            if analysis:
+                title_tf = analysis["title_tf"]
+            else:
+                title = (doc.metadata.get("title") or "").lower()
+                title_tf = term_frequencies(self._tokenize(title))
+            self.title_index.add_counts(num, title_tf)
+        
+        self._update_embedding(doc)
+    
+    def _update_embedding(self, doc: Document):
+        """用索引中的词频向量（标题词按 TITLE_BOOST 加权）生成文档嵌入"""
+        if self.vectors is None:
+            return
+        freqs = dict(self.get_term_vector(doc.doc_id))
+        for term, tf in self.get_term_vector(doc.doc_id, "title").items():
+            freqs[term] = freqs.get(term, 0) + tf * self.TITLE_BOOST
+        doc.embedding = self.vectors.set(
+            doc.doc_id, embed_counts(freqs, self.vectors.dim)
+        )
+    
+    def _sync_embeddings(self):
+        """加载后补齐缺失的嵌入、清理已删除文档的行"""
+        live = self.doc_map.nums
+        for doc_id in [doc_id for doc_id in self.vectors.rows if doc_id not in live]:
+            self.vectors.delete(doc_id)
+        
+        missing = [doc_id for doc_id in live if doc_id not in self.vectors.rows]
+        if missing:
+            for doc_id in missing:
+                self._update_embedding(self.documents[doc_id])
+            print(f"🧮 已生成 {len(missing)} 篇文档的嵌入向量")
+        self.vectors.flush()
+    
+    def _update_passages(self, doc: Document, analysis: Dict = None):
+        """重新切分并索引文档的段落"""
+        self._remove_passages(doc.doc_id)
+        if analysis and "passages" in analysis:
+            passages = analysis["passages"]
+        else:
+            passages = analyze_passages(doc.content, self.tokenizer)
+        
+        nums = []
+        for start, end, freqs in passages:
+            num = self.passage_map.intern(self._passage_id(doc.doc_id, start, end))
+            self.passage_index.add_counts(num, freqs)
+            nums.append(num)
+        self.doc_passages[doc.doc_id] = nums
+    
+    def _remove_passages(self, doc_id: str):
+        for num in self.doc_passages.pop(doc_id, ()):
+            self.passage_index.remove(num)
+            self.passage_map.release(self.passage_map.lookup(num))
+    
+    @staticmethod
+    def _passage_id(doc_id: str, start: int, end: int) -> str:
+        return f"{doc_id}@{start}:{end}"
+    
+    @staticmethod
+    def parse_passage_id(passage_id: str) -> tuple:
+        """段落ID -> (doc_id, 起始偏移, 结束偏移)"""
+        doc_id, _, span = passage_id.rpartition("@")
+        start, _, end = span.partition(":")
+        return doc_id, int(start), int(end)
+    
+    def _rebuild_doc_passages(self):
+        """根据段落ID表重建 doc_id -> 段落号列表（按起始偏移排序）"""
+        doc_passages = {}
+        for num, passage_id in enumerate(self.passage_map.ids):
+            if passage_id is not None:
+                doc_id, start, _ = self.parse_passage_id(passage_id)
+                doc_passages.setdefault(doc_id, []).append((start, num))
+        self.doc_passages = {
+            doc_id: [num for _, num in sorted(spans)]
+            for doc_id, spans in doc_passages.items()
+        }
+    
+    def get_passage_vectors(self, doc_id: str) -> List[tuple]:
+        """文档各段落的 (起始偏移, 结束偏移, 词频向量)"""
+        vectors = []
+        for num in self.doc_passages.get(doc_id, ()):
+            _, start, end = self.parse_passage_id(self.passage_map.lookup(num))
+            vectors.append((start, end, self.passage_index.doc_vector(num)))
+        return vectors
+    
+    def get_term_vector(self, doc_id: str, field: str = "content") -> Dict[str, int]:
+        """获取文档的词频向量（来自索引缓存）"""
+        num = self.doc_map.get(doc_id)
+        if num is None:
+            return {}
+        index = self.title_index if field == "title" else self.index
+        return index.doc_vector(num)
+    
+    def compact_index(self) -> Dict:
+        """从文档重建倒排索引和分类并持久化
+        
+        用于清理旧版本遗留的失效倒排记录（更新/删除后未移除的词）、
+        分类中已不存在的文档，同时让文档号重新变得连续。
+        """
+        stats = {
+            "terms_before": len(self.index) + len(self.title_index),
+            "category_entries_before": sum(len(ids) for ids in self.categories.values())
+        }
+        
+        self._rebuild_index()
+        
+        categories = {}
+        for doc_id, doc in self.documents.items():
+            categories.setdefault(doc.metadata.get("category", "未分类"), []).append(doc_id)
+        self.categories = categories
+        self._rebuild_facets()
+        
+        self.save()
+        
+        stats["terms_after"] = len(self.index) + len(self.title_index)
+        stats["category_entries_after"] = sum(len(ids) for ids in self.categories.values())
+        return stats
+    
+    def _rebuild_index(self):
+        """根据全部文档重建倒排索引"""
+        self.write_version += 1
+        self.doc_map = DocIdMap()
+        self.index = InvertedIndex()
+        self.title_index = InvertedIndex()
+        if self.positional:
+            self.positions = self.storage.new_position_index(self)
+        self.passage_map = DocIdMap()
+        self.passage_index = InvertedIndex()
+        self.doc_passages = {}
+        for doc in self.documents.values():
+            self._update_index(doc)
+        self._rebuild_facets()
+    
+    def _rebuild_positions(self):
+        """根据全部文档正文重建词位置索引（不动倒排索引）"""
+        self.positions = self.storage.new_position_index(self)
+        for doc_id, num in self.doc_map.nums.items():
+            doc = self.documents.get(doc_id)
+            if doc is not None:
+                self._index_positions(num, doc)
+    
+    def _index_positions(self, num: int, doc: Document):
+        """分词正文，写入词位置和词起始偏移"""
+        tokens, starts = self.tokenizer.tokenize_with_offsets(doc.content)
+        self.positions.add(num, token_positions(tokens), encode_offsets(starts))
+    
+    def _index_facets(self, doc: Document):
+        """把文档加入分类/标签位图"""
+        num = self.doc_map.intern(doc.doc_id)
+        self.category_facets.add(doc.metadata.get("category", "未分类"), num)
+        for tag in doc.tags:
+            self.tag_facets.add(tag, num)
+    
+    def _move_category(self, doc: Document, old_category: str):
+        """文档分类变化时同步分类列表和位图"""
+        if doc.doc_id in self.categories.get(old_category, []):
+            self.categories[old_category].remove(doc.doc_id)
+        new_category = doc.metadata.get("category", "未分类")
+        self.categories.setdefault(new_category, []).append(doc.doc_id)
+        
+        num = self.doc_map.get(doc.doc_id)
+        if num is not None:
+            self.category_facets.discard(old_category, num)
+            self.category_facets.add(new_category, num)
+    
+    def _rebuild_facets(self):
+        """根据分类列表和存储中的标签重建位图（加载后调用，不读取文档正文）"""
+        self.category_facets = FacetIndex()
+        self.tag_facets = FacetIndex()
+        for category, doc_ids in self.categories.items():
+            for doc_id in doc_ids:
+                num = self.doc_map.get(doc_id)
+                if num is not None:
+                    self.category_facets.add(category, num)
+        for doc_id, tag in self.storage.iter_tags(self):
+            num = self.doc_map.get(doc_id)
+            if num is not None:
+                self.tag_facets.add(tag, num)
     
     # ============== 知识提取 ==============
     
     def _extract_knowledge(self, doc: Document):
         """从文档中提取知识（简单实现）"""
-        content = doc.content
-        
-        # 提取关键词作为实体
-        words = self._tokenize(content)
-        word_freq = {}
-        for word in words:
-            if len(word) > 1:  # 过滤单字
-                word_freq[word] = word_freq.get(word, 0) + 1
-        
-        # 选择高频词作为实体
-        important_words = sorted(
-            word_freq.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:10]
-        
-        for word, freq in important_words:
-            self.knowledge_graph.add_entity(
-                word, 
-                "keyword",
-                {"frequency": freq, "source_doc": doc.doc_id}
-            )
+        # 提取关键词作为实体（使用索引中缓存的词频向量）
+        self._add_knowledge(doc, top_keywords(self.get_term_vector(doc.doc_id)))
+    
+    def _add_knowledge(self, doc: Document, important_words: List[tuple]):
+        """把文档的高频词及其共现关系加入知识图谱"""
+        for word, _ in important_words:
+            self.knowledge_graph.add_entity(word, "keyword", doc_id=doc.doc_id)
         
         # 简单的共现关系
         for i, (word1, _) in enumerate(important_words):
@@ -390,11 +1706,33 @@ class KnowledgeBase:
                     word1, 
                     word2, 
                     "co_occurrence",
-                    {"doc_id": doc.doc_id}
+                    doc_id=doc.doc_id
                 )
     
     # ============== 统计分析 ==============
     
+    def update_entity_ranks(self) -> Dict:
+        """计算知识图谱实体的重要度（PageRank）和加权度数并持久化
+        
+        离线任务：图谱规模大时耗时较长，大批量导入后会自动以上次结果为初值增量刷新。
+        只持久化得分有变化的实体，不重写整个图谱。
+        """
+        self._catch_up()
+        stats = self.knowledge_graph.update_centrality()
+        before = self.storage.fingerprint()
+        self.storage.save_ranks(self, stats["changed"])
+        self._refresh_fingerprint(before)
+        print(f"📈 已计算 {stats['entities']} 个实体的重要度 "
+              f"(迭代 {stats['iterations']} 次{'，热启动' if stats['warm_start'] else ''}, "
+              f"{len(stats['changed'])} 个有变化, 耗时 {stats['seconds']:.2f}s)")
+        return stats
+    
+    def _refresh_ranks_after_import(self, changed_docs: int):
+        """一次导入/同步改动的文档足够多时刷新实体重要度"""
+        if (KB_RANK_AFTER_IMPORT and changed_docs >= KB_RANK_AFTER_IMPORT_MIN_DOCS
+                and graph_view_available() and self.knowledge_graph.entities):
+            self.update_entity_ranks()
+    
     def get_statistics(self) -> Dict:
         """获取统计信息"""
         return {
@@ -406,62 +1744,235 @@ class KnowledgeBase:
                 cat: len(docs) 
                 for cat, docs in self.categories.items()
             },
-            "total_index_words": len(self.index)
+            "total_index_words": len(self.index),
+            "tokenizer": self.tokenizer.name,
+            "total_embeddings": len(self.vectors) if self.vectors is not None else 0,
+            "query_cache": self.query_cache.stats()
         }
     
     def get_popular_tags(self, limit: int = 10) -> List[tuple]:
         """获取热门标签"""
-        tag_count = {}
-        for doc in self.documents.values():
-            for tag in doc.tags:
-                tag_count[tag] = tag_count.get(tag, 0) + 1
-        
-        return sorted(
-            tag_count.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:limit]
+        return self.storage.popular_tags(self, limit)
     
     def get_recent_documents(self, limit: int = 10) -> List[Document]:
         """获取最近的文档"""
-        docs = sorted(
-            self.documents.values(),
-            key=lambda x: x.created_at,
-            reverse=True
-        )
-        return docs[:limit]
+        return self.storage.recent_documents(self, limit)
     
     # ============== 导入导出 ==============
     
+    IMPORT_EXTENSIONS = ('.txt', '.md', '.markdown')
+    
     def import_from_file(self, filepath: str, category: str = "导入") -> int:
         """从文件导入"""
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            filename = os.path.basename(filepath)
-            title = os.path.splitext(filename)[0]
-            
-            self.add_document(
-                content=content,
-                title=title,
-                category=category,
-                source=filepath
-            )
-            return 1
-        except Exception as e:
-            print(f"导入失败: {str(e)}")
-            return 0
+        return self.import_files([filepath], category)["count"]
     
     def import_from_directory(self, dirpath: str, category: str = "导入") -> int:
         """从目录批量导入"""
-        count = 0
+        return self.import_files(self.list_import_files(dirpath), category)["count"]
+    
+    @classmethod
+    def list_import_files(cls, dirpath: str) -> List[str]:
+        """列出目录下可导入的文件"""
+        filepaths = []
         for root, dirs, files in os.walk(dirpath):
             for file in files:
-                if file.endswith(('.txt', '.md', '.markdown')):
-                    filepath = os.path.join(root, file)
-                    count += self.import_from_file(filepath, category)
-        return count
+                if file.endswith(cls.IMPORT_EXTENSIONS):
+                    filepaths.append(os.path.join(root, file))
+        return filepaths
+    
+    PARALLEL_MIN_FILES = 32  # 文件数少于此值时不启动进程池
+    
+    def import_files(self,
+                     filepaths: Iterable[str],
+                     category: str = "导入",
+                     commit_every: int = KB_IMPORT_COMMIT_EVERY,
+                     workers: int = KB_IMPORT_WORKERS) -> Dict:
+        """批量导入文件，返回导入统计（篇数、字节数、吞吐量）
+        
+        读取文件、分词、统计词频和关键词在 workers 个子进程中并行完成，
+        主进程只负责合并索引、知识图谱并持久化。
+        """
+        filepaths = list(filepaths)
+        stats = {"count": 0, "bytes": 0, "failed": 0}
+        
+        def collect(results):
+            for result in results:
+                if "error" in result:
+                    print(f"导入失败: {result['filepath']}: {result['error']}")
+                    stats["failed"] += 1
+                    continue
+                
+                stats["count"] += 1
+                stats["bytes"] += result["bytes"]
+                yield {
+                    "content": result["content"],
+                    "title": result["title"],
+                    "category": category,
+                    "source": result["filepath"],
+                    "analysis": result["analysis"]
+                }
+        
+        start = time.perf_counter()
+        self.add_documents(collect(self._analyze_files(filepaths, workers, commit_every)),
+                           commit_every=commit_every)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        
+        stats["seconds"] = elapsed
+        stats["docs_per_sec"] = stats["count"] / elapsed
+        stats["bytes_per_sec"] = stats["bytes"] / elapsed
+        
+        if stats["count"]:
+            print(f"📥 导入 {stats['count']} 篇文档, "
+                  f"{stats['bytes'] / 1024:.1f} KB, 耗时 {elapsed:.2f}s "
+                  f"({stats['docs_per_sec']:.1f} 篇/秒, "
+                  f"{stats['bytes_per_sec'] / 1024:.1f} KB/秒)")
+            self._refresh_ranks_after_import(stats["count"])
+        
+        return stats
+    
+    def _analyze_files(self, filepaths: List[str], workers: int,
+                       window: int = KB_IMPORT_COMMIT_EVERY):
+        """按顺序产出每个文件的分析结果，文件多时使用进程池
+        
+        进程池中同时最多约 window 个文件在分析或等待取走（至少让每个子进程有两组活），
+        调用方取走一组才提交下一组，内存占用与文件总数无关。
+        """
+        if workers > 1 and len(filepaths) >= self.PARALLEL_MIN_FILES:
+            chunksize = max(1, min(64, len(filepaths) // (workers * 4)))
+            limit = max(window or 0, workers * chunksize * 2)
+            in_flight = deque()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for i in range(0, len(filepaths), chunksize):
+                    in_flight.append(pool.submit(
+                        _analyze_chunk, filepaths[i:i + chunksize], self.tokenizer
+                    ))
+                    if len(in_flight) * chunksize >= limit:
+                        yield from in_flight.popleft().result()
+                while in_flight:
+                    yield from in_flight.popleft().result()
+        else:
+            yield from map(partial(_analyze_file, tokenizer=self.tokenizer), filepaths)
+    
+    # ============== 目录同步 ==============
+    
+    MANIFEST_NAME = "sync_manifest.json"
+    
+    def sync_directory(self,
+                       dirpath: str,
+                       category: str = "导入",
+                       workers: int = KB_IMPORT_WORKERS) -> Dict:
+        """增量同步目录
+        
+        清单记录 路径 -> (大小, mtime, 内容哈希, doc_id)：
+        大小和mtime都未变的文件不读取直接跳过；内容变化的文件原地更新对应文档；
+        新文件批量导入；已删除的文件删除对应文档。
+        新文件每提交一批就写一次清单，中途崩溃后再次同步不会重复导入已提交的文件。
+        """
+        dirpath = os.path.abspath(dirpath)
+        stats = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0, "failed": 0}
+        
+        # 目录不存在（例如未挂载）时不能当作文件全部被删除
+        if not os.path.isdir(dirpath):
+            print(f"❌ 同步目录不存在: {dirpath}")
+            return stats
+        
+        manifest = self._load_manifest()
+        entries = manifest.setdefault(dirpath, {})
+        
+        # 1. 只用 stat 找出可能变化的文件，按清单中是否有对应文档分为已有/新增
+        seen = set()
+        stat_by_path = {}
+        changed, new = [], []
+        for filepath in self.list_import_files(dirpath):
+            seen.add(filepath)
+            stat = os.stat(filepath)
+            entry = entries.get(filepath)
+            known = entry is not None and entry["doc_id"] in self.documents
+            if (known and entry["size"] == stat.st_size
+                    and entry["mtime_ns"] == stat.st_mtime_ns):
+                stats["unchanged"] += 1
+                continue
+            stat_by_path[filepath] = stat
+            (changed if known else new).append(filepath)
+        
+        def analyzed(filepaths):
+            for result in self._analyze_files(filepaths, workers):
+                if "error" in result:
+                    print(f"同步失败: {result['filepath']}: {result['error']}")
+                    stats["failed"] += 1
+                    continue
+                yield result
+        
+        # 2. 已有文件：按内容哈希区分修改和仅touch
+        for result in analyzed(changed):
+            stat = stat_by_path[result["filepath"]]
+            entry = entries[result["filepath"]]
+            if entry["hash"] != result["hash"]:
+                # 直接使用子进程中的分析结果，不在主进程重新分词
+                self._update_document(entry["doc_id"], result["content"], {},
+                                      result["analysis"])
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                         hash=result["hash"])
+        
+        # 3. 新文件：分析结果边产出边导入，只有尚未提交的一批留在内存中
+        hashes = {}
+        
+        def new_items():
+            for result in analyzed(new):
+                hashes[result["filepath"]] = result["hash"]
+                yield {
+                    "content": result["content"],
+                    "title": result["title"],
+                    "category": category,
+                    "source": result["filepath"],
+                    "analysis": result["analysis"]
+                }
+        
+        def committed(docs):
+            for doc in docs:
+                filepath = doc.metadata["source"]
+                stat = stat_by_path[filepath]
+                entries[filepath] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "hash": hashes.pop(filepath),
+                    "doc_id": doc.doc_id
+                }
+            self._save_manifest(manifest)
+        
+        doc_ids = self.add_documents(new_items(), on_commit=committed)
+        stats["added"] = len(doc_ids)
+        
+        # 4. 删除已不存在的文件对应的文档
+        for filepath in [path for path in entries if path not in seen]:
+            self.delete_document(entries.pop(filepath)["doc_id"])
+            stats["deleted"] += 1
+        
+        self._save_manifest(manifest)
+        self._refresh_ranks_after_import(stats["added"] + stats["updated"] + stats["deleted"])
+        
+        print(f"🔄 同步完成: 新增 {stats['added']}, 更新 {stats['updated']}, "
+              f"删除 {stats['deleted']}, 未变 {stats['unchanged']}")
+        return stats
+    
+    def _load_manifest(self) -> Dict:
+        """读取同步清单 {目录: {文件路径: 记录}}"""
+        manifest_file = self.kb_dir / self.MANIFEST_NAME
+        if not manifest_file.exists():
+            return {}
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _save_manifest(self, manifest: Dict):
+        """原子地写入同步清单"""
+        manifest_file = self.kb_dir / self.MANIFEST_NAME
+        tmp_file = manifest_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_file, manifest_file)
     
     def export_to_markdown(self, output_file: str):
         """导出为Markdown"""
@@ -486,50 +1997,213 @@ class KnowledgeBase:
     
     # ============== 持久化 ==============
     
-    def save(self):
-        """保存知识库"""
-        data = {
+    def _record(self, op: Dict):
+        """把一次写操作交给存储引擎持久化"""
+        self._record_batch([op])
+    
+    def _record_batch(self, ops: List[Dict]):
+        """把一批写操作一次性交给存储引擎持久化"""
+        self._catch_up(ops)
+        before = self.storage.fingerprint()
+        self.storage.record_batch(self, ops)
+        if self.vectors is not None:
+            self.vectors.flush()
+        self._refresh_fingerprint(before)
+    
+    def _catch_up(self, ops: List[Dict] = ()):
+        """写入前确认存储没有被其他进程修改过
+        
+        否则先重新加载（包含其他进程的写入），再把本次已在内存中应用的操作重放到新状态上，
+        避免追加的日志序号重复、或压缩时用过时的内存状态覆盖其他进程的记录。
+        """
+        if not self.is_stale():
+            return
+        print("🔄 知识库已被其他进程修改，重新加载后再写入")
+        self._reset()
+        self.load()
+        for op in ops:
+            self._replay(op)
+    
+    def _refresh_fingerprint(self, before):
+        """写入后更新指纹：只有写入前的指纹与已知的一致时才更新，
+        否则其间还有其他进程写入，留给 is_stale 发现"""
+        if before == self._fingerprint:
+            self._fingerprint = self.storage.fingerprint()
+    
+    def _replay(self, op: Dict):
+        """重放一条操作日志"""
+        kind = op.get("op")
+        if kind == "add":
+            doc = Document.from_dict(op["doc"])
+            if doc.doc_id not in self.documents:
+                self._apply_add(doc)
+        elif kind == "update":
+            if op["doc_id"] in self.documents:
+                self._apply_update(
+                    op["doc_id"], op.get("content"),
+                    op.get("metadata") or {}, op["updated_at"]
+                )
+        elif kind == "delete":
+            if op["doc_id"] in self.documents:
+                self._apply_delete(op["doc_id"])
+        elif kind == "ranks":
+            entities = self.knowledge_graph.entities
+            for name, (pagerank, degree) in op["ranks"].items():
+                if name in entities:
+                    entities[name]["pagerank"] = pagerank
+                    entities[name]["degree"] = degree
+    
+    def _snapshot(self) -> Dict:
+        """生成完整快照数据"""
+        return {
             "documents": {
                 doc_id: doc.to_dict() 
                 for doc_id, doc in self.documents.items()
             },
             "knowledge_graph": self.knowledge_graph.to_dict(),
             "categories": self.categories,
-            "index": self.index,
-            "saved_at": datetime.now().isoformat()
+            "doc_ids": self.doc_map.to_list(),
+            "index": self.index.to_dict(),
+            "title_index": self.title_index.to_dict(),
+            "passage_ids": self.passage_map.to_list(),
+            "passage_index": self.passage_index.to_dict(),
+            "positions": self.positions.to_dict() if self.positions is not None else None,
+            "tokenizer": self.tokenizer.spec()
         }
-        
-        kb_file = self.kb_dir / "knowledge_base.json"
-        with open(kb_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
     
-    def load(self):
-        """加载知识库"""
-        kb_file = self.kb_dir / "knowledge_base.json"
+    def _adopt_tokenizer(self, spec: Optional[Dict]):
+        """加载已有数据前对齐分词器
         
-        if not kb_file.exists():
+        spec 为索引记录的分词器描述（旧数据没有记录，都是 ngram）。
+        没有显式指定分词器时沿用记录的分词器；显式指定了不同的分词器、
+        或词典已变化时，先用记录的分词器加载（重放日志），加载完成后重建索引。
+        """
+        stored = spec or {"name": "ngram"}
+        if stored == self.tokenizer.spec():
             return
-        
         try:
-            with open(kb_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 加载文档
-            self.documents = {
-                doc_id: Document.from_dict(doc_data)
-                for doc_id, doc_data in data.get("documents", {}).items()
-            }
-            
-            # 加载知识图谱
-            kg_data = data.get("knowledge_graph", {})
-            if kg_data:
-                self.knowledge_graph = KnowledgeGraph.from_dict(kg_data)
-            
-            # 加载分类和索引
-            self.categories = data.get("categories", {})
-            self.index = data.get("index", {})
-            
-            print(f"✅ 知识库加载成功 (保存于: {data.get('saved_at', '未知')})")
-            
-        except Exception as e:
-            print(f"⚠️ 加载知识库失败: {str(e)}")
\ No newline at end of file
+            previous = get_tokenizer(stored["name"])
+        except ValueError:
+            previous = None
+        if previous is not None and previous.spec() == stored:
+            if self.requested_tokenizer is None:
+                self.tokenizer = previous
+                return
+            self._pending_tokenizer, self.tokenizer = self.tokenizer, previous
+        else:
+            # 记录的分词器已无法还原（词典变了）：用当前的同名分词器或指定的分词器重建
+            if self.requested_tokenizer is None and previous is not None:
+                self.tokenizer = previous
+            self._pending_tokenizer = self.tokenizer
+    
+    def _restore_snapshot(self, data: Dict):
+        """从快照数据恢复"""
+        self._adopt_tokenizer(data.get("tokenizer"))
+        # 加载文档
+        self.documents = {
+            doc_id: Document.from_dict(doc_data)
+            for doc_id, doc_data in data.get("documents", {}).items()
+        }
+        
+        # 加载知识图谱
+        kg_data = data.get("knowledge_graph", {})
+        if kg_data:
+            self.knowledge_graph = KnowledgeGraph.from_dict(kg_data)
+        
+        # 加载分类和索引
+        self.categories = data.get("categories", {})
+        index_data = data.get("index", {})
+        if "postings" in index_data:
+            self.doc_map = DocIdMap.from_list(data.get("doc_ids", []))
+            self.index = InvertedIndex.from_dict(index_data, self.doc_map)
+            self.title_index = InvertedIndex.from_dict(
+                data.get("title_index", {}), self.doc_map
+            )
+            if "passage_index" in data:
+                self.passage_map = DocIdMap.from_list(data.get("passage_ids", []))
+                self.passage_index = InvertedIndex.from_dict(
+                    data["passage_index"], self.passage_map
+                )
+                self._rebuild_doc_passages()
+            else:
+                # 没有段落索引的旧快照：只切分段落，不动文档索引
+                for doc in self.documents.values():
+                    self._update_passages(doc)
+            if self.positions is not None:
+                if data.get("positions") is not None:
+                    self.positions = PositionIndex.from_dict(data["positions"])
+                if data.get("positions") is None or (self.doc_map and not self.positions.offsets):
+                    # 旧快照没有位置索引或词偏移表：根据正文重建
+                    self._rebuild_positions()
+        else:
+            # 旧版快照只记录了 {词: [doc_ids]}，没有词频，需要重建
+            self._rebuild_index()
+    
+    def save(self):
+        """保存知识库（json引擎：写入完整快照并清空操作日志）"""
+        self._catch_up()
+        before = self.storage.fingerprint()
+        self.storage.save(self)
+        if self.vectors is not None:
+            self.vectors.compact()
+            self.vectors.flush()
+        self._refresh_fingerprint(before)
+    
+    def compact(self):
+        """立即把操作日志压缩进快照"""
+        self.save()
+    
+    def load(self):
+        """加载知识库"""
+        if vectors_available():
+            self.vectors = VectorStore(self.kb_dir, self.embedding_dim,
+                                       KB_ANN_MIN_ROWS, KB_ANN_PROBE_RATIO)
+        self.storage.load(self)
+        self._fingerprint = self.storage.fingerprint()
+        if self._pending_tokenizer is not None:
+            self.tokenizer, self._pending_tokenizer = self._pending_tokenizer, None
+            print(f"🔤 分词器已变更为 {self.tokenizer.name}，重建索引...")
+            self._rebuild_index()
+            self.save()
+        self.write_version += 1
+        self._rebuild_facets()
+        if self.vectors is not None:
+            self._sync_embeddings()
+        self._fingerprint = self.storage.fingerprint()
+    
+    def is_stale(self) -> bool:
+        """存储是否被其他进程修改过"""
+        return self.storage.fingerprint() != self._fingerprint
+    
+    def reload_if_stale(self) -> bool:
+        """存储被外部修改时重新加载，返回是否重新加载"""
+        if not self.is_stale():
+            return False
+        self._reset()
+        self.load()
+        return True
+
+
+# ============== 共享实例 ==============
+
+_shared_kbs: Dict[str, KnowledgeBase] = {}
+_shared_lock = threading.Lock()
+
+
+def get_knowledge_base(kb_dir: Path = None) -> KnowledgeBase:
+    """获取进程内共享的知识库实例
+    
+    按知识库目录缓存，首次调用时才创建；之后每次调用只检查文件指纹，
+    仅当其他进程修改了知识库时才重新加载。
+    """
+    kb_dir = Path(kb_dir or KB_DIR)
+    key = str(kb_dir.resolve())
+    
+    with _shared_lock:
+        kb = _shared_kbs.get(key)
+        if kb is None:
+            kb = KnowledgeBase(kb_dir)
+            _shared_kbs[key] = kb
+        else:
+            kb.reload_if_stale()
+        return kb
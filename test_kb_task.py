@@ -3,7 +3,7 @@
 """
 
 from multi_agent import MultiAgentSystem
-from knowledge_base import KnowledgeBase
+from knowledge_base import get_knowledge_base
 import time
 
 
@@ -47,7 +47,7 @@ def test_knowledge_task():
     print("-" * 70)
     
     try:
-        kb = KnowledgeBase()
+        kb = get_knowledge_base()
         stats = kb.get_statistics()
         
         print(f"\n📊 知识库统计:")
@@ -98,7 +98,7 @@ def manual_add_test():
     print("=" * 70)
     
     try:
-        kb = KnowledgeBase()
+        kb = get_knowledge_base()
         
         # 添加测试文档
         test_docs = [
@@ -7,7 +7,7 @@ import json
 import hashlib
 import random
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import requests
 from config import *
 from kb_tools import KnowledgeBaseTools
@@ -321,13 +321,16 @@ class Tools:
         """添加知识到知识库"""
         return self.kb_tools.add_knowledge(content, title, category, tags)
 
-    def search_knowledge(self, query: str, category: str = None, limit: int = 5) -> str:
+    def search_knowledge(self, query: str, category: str = None, limit: int = 5,
+                         mode: str = "keyword", debug: bool = False,
+                         tags: List[str] = None, match_all_tags: bool = False) -> str:
         """搜索知识库"""
-        return self.kb_tools.search_knowledge(query, category, limit)
+        return self.kb_tools.search_knowledge(query, category, limit, mode, debug,
+                                              tags, match_all_tags)
 
-    def get_knowledge_detail(self, doc_id: str) -> str:
+    def get_knowledge_detail(self, doc_id: str, start: int = None, end: int = None) -> str:
         """获取知识详情"""
-        return self.kb_tools.get_knowledge_detail(doc_id)
+        return self.kb_tools.get_knowledge_detail(doc_id, start, end)
 
     def list_knowledge_categories(self) -> str:
         """列出知识库分类"""